@@ -1,18 +1,40 @@
 #!/usr/bin/env python3
 """
 ARMscaler — Direct DiffBIR Inference
-Simple wrapper that calls armscaler_server.py
+Client for a resident armscaler_server.py (started on demand, shared across
+calls over a Unix socket). The old spawn-per-image path is kept as --oneshot.
 """
 
 import sys
 import os
 import json
+import time
+import fcntl
+import functools
+import shutil
+import socket
+import tempfile
 import subprocess
 from pathlib import Path
 
+from raw_transport import HEADER as RAW_HEADER, map_raw, raw_to_png
+import cost_model
+
 SCRIPT_DIR = Path(__file__).parent.resolve()
 DIFFBIR_DIR = SCRIPT_DIR / 'diffbir_engine'
 SERVER_SCRIPT = SCRIPT_DIR / 'armscaler_server.py'
+DISPATCHER_SCRIPT = SCRIPT_DIR / 'armscaler_dispatcher.py'
+
+SOCKET_PATH = os.environ.get(
+    'ARMSCALER_SOCKET', os.path.join(tempfile.gettempdir(), 'armscaler_server.sock'))
+SERVER_LOG = os.environ.get(
+    'ARMSCALER_SERVER_LOG', os.path.join(tempfile.gettempdir(), 'armscaler_server.log'))
+IDLE_TIMEOUT = float(os.environ.get('ARMSCALER_IDLE_TIMEOUT', '600'))
+# Either one set: spawn the multi-worker dispatcher (same protocol) instead of a single server
+MULTI_WORKER = bool(os.environ.get('ARMSCALER_WORKERS') or os.environ.get('ARMSCALER_DEVICES'))
+STARTUP_TIMEOUT = 120
+WATCH_INTERVAL = 15  # seconds between job status checks while waiting on a long request
+GIGAPIXEL_OUTPUTS = ('.rgb', '.png')  # the formats written without holding the whole image
 
 def log(msg):
     print(f"  {msg}", file=sys.stderr, flush=True)
@@ -24,48 +46,332 @@ def check_setup():
         return False, "inference.py not found"
     return True, "OK"
 
-def get_gpu_info():
+def status(refresh=False):
+    """Setup + GPU status from the capability probe snapshot (no torch import)"""
+    import capability_probe
+    return capability_probe.status(refresh=refresh)
+
+def _server_env():
+    env = os.environ.copy()
+    env['PYTHONPATH'] = str(DIFFBIR_DIR) + ':' + env.get('PYTHONPATH', '')
+    env['PYTHONUNBUFFERED'] = '1'
+    return env
+
+class ServerClient:
+    """Talks JSON lines to a resident armscaler_server.py over a Unix socket.
+
+    The server is started on demand, reused by every later call (from this
+    process or any other), restarted if it has died, and exits by itself
+    after idle_timeout seconds without requests.
+    """
+
+    def __init__(self, socket_path=SOCKET_PATH, idle_timeout=IDLE_TIMEOUT, log_path=SERVER_LOG):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.log_path = log_path
+        self._sock = None
+        self._buffer = b''
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._buffer = b''
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = None
+        self._buffer = b''
+
+    def is_alive(self):
+        try:
+            return bool(self.request({'action': 'ping'}, timeout=5, start=False).get('pong'))
+        except OSError:
+            return False
+
+    def _spawn(self):
+        """Start a detached server; it outlives this client and is shared."""
+        log(f"Starting resident ARMscaler server ({self.socket_path})...")
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # stale socket from a dead server
+        with open(self.log_path, 'ab') as log_file:
+            subprocess.Popen(
+                [sys.executable, '-u', str(DISPATCHER_SCRIPT if MULTI_WORKER else SERVER_SCRIPT),
+                 '--socket', self.socket_path,
+                 '--idle-timeout', str(self.idle_timeout)],
+                stdin=subprocess.DEVNULL,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                env=_server_env(),
+                start_new_session=True,
+            )
+        deadline = time.time() + STARTUP_TIMEOUT
+        while time.time() < deadline:
+            try:
+                self._connect()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"Server did not start within {STARTUP_TIMEOUT}s (see {self.log_path})")
+
+    def ensure_server(self):
+        """Connect to the running server, starting one if there is none."""
+        if self._sock is not None:
+            return
+        try:
+            self._connect()
+            return
+        except OSError:
+            pass
+        # Only one client may spawn a server at a time
+        with open(self.socket_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._connect()  # someone else started it while we waited
+            except OSError:
+                self._spawn()
+
+    def _readline(self, timeout):
+        """Next response line; a timeout leaves any partial line buffered for the next call"""
+        self._sock.settimeout(timeout)
+        while b'\n' not in self._buffer:
+            chunk = self._sock.recv(1 << 16)
+            if not chunk:
+                raise ConnectionResetError("Server closed the connection")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode('utf-8')
+
+    def _roundtrip(self, cmd, timeout, on_partial=None, still_waiting=None):
+        self._sock.settimeout(timeout)
+        self._sock.sendall((json.dumps(cmd) + '\n').encode('utf-8'))
+        while True:
+            if still_waiting is None:
+                line = self._readline(timeout)
+            else:
+                try:
+                    line = self._readline(WATCH_INTERVAL)
+                except socket.timeout:
+                    if not still_waiting():
+                        raise
+                    continue
+            response = json.loads(line)
+            if not response.get('partial'):
+                return response
+            if on_partial is not None:
+                on_partial(response)
+
+    def request(self, cmd, timeout=None, start=True, on_partial=None, still_waiting=None):
+        """Send one command and return the decoded response.
+
+        Partial responses (progressive previews) before the final one go to
+        on_partial. With still_waiting, `timeout` is ignored: every
+        WATCH_INTERVAL seconds without a response it is asked whether to keep
+        waiting. If the server died (refused connection, dropped mid-request)
+        it is restarted and the command is retried once.
+        """
+        for attempt in range(2):
+            try:
+                if start:
+                    self.ensure_server()
+                elif self._sock is None:
+                    self._connect()
+                return self._roundtrip(cmd, timeout, on_partial, still_waiting)
+            except socket.timeout:
+                self.close()
+                raise
+            except (OSError, ValueError) as e:
+                self.close()
+                if not start or attempt == 1:
+                    raise
+                log(f"Server connection lost ({e}), restarting...")
+        raise RuntimeError("unreachable")
+
+    def stop(self):
+        try:
+            self.request({'action': 'shutdown'}, timeout=5, start=False)
+        except OSError:
+            pass
+        self.close()
+
+_client = None
+
+def get_client():
+    """Process-wide client so repeated calls reuse one connection"""
+    global _client
+    if _client is None:
+        _client = ServerClient()
+    return _client
+
+def _read_input_base64(input_path):
+    import base64
+    with open(input_path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+def _save_raw(raw_file, output_path):
+    """Raw RGB from the server -> output file.
+
+    .rgb is kept as-is and .png is encoded a strip of rows at a time, so
+    neither loads the whole image; other formats are decoded in memory by PIL.
+    """
+    if output_path.endswith('.rgb'):
+        shutil.move(raw_file, output_path)
+        return
     try:
-        import torch
-        if torch.cuda.is_available():
-            return {
-                'available': True,
-                'name': torch.cuda.get_device_name(0),
-                'vram_gb': round(torch.cuda.get_device_properties(0).total_memory / 1024**3, 1)
-            }
-    except:
-        pass
-    return {'available': False, 'name': 'CPU', 'vram_gb': 0}
-
-def status():
-    ok, msg = check_setup()
-    gpu = get_gpu_info()
-    weights_dir = DIFFBIR_DIR / 'weights'
-    models = len(list(weights_dir.glob('*.pth'))) if weights_dir.exists() else 0
-    return {
-        'available': ok, 'ready': ok, 'setup_complete': ok,
-        'message': msg, 'gpu': gpu, 'models_downloaded': models
-    }
+        if output_path.lower().endswith('.png'):
+            raw_to_png(raw_file, output_path, compress_level=1)
+            return
+        from PIL import Image
+        width, height, channels, mm = map_raw(raw_file)
+        view = memoryview(mm)[RAW_HEADER.size:RAW_HEADER.size + width * height * channels]
+        try:
+            # frombuffer copies RGB data, so this holds the full image in memory
+            image = Image.frombuffer('RGB', (width, height), view, 'raw', 'RGB', 0, 1)
+            image.save(output_path)
+            del image
+        finally:
+            view.release()
+            mm.close()
+    finally:
+        os.unlink(raw_file)
 
-def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanced'):
-    """Run inference - server.py handles everything"""
+def _write_output(response, output_path):
+    if not response:
+        return False, "No response from server"
+    
+    if not response.get('success'):
+        return False, response.get('error', 'Processing failed')
+    
+    try:
+        if response.get('image_raw'):
+            _save_raw(response['image_raw'], output_path)
+        else:
+            import base64
+            with open(output_path, 'wb') as f:
+                f.write(base64.b64decode(response['image_base64']))
+        return True, f"Done in {response.get('processing_time', 0)}s"
+    except Exception as e:
+        return False, f"Failed to write output: {e}"
+
+def _write_preview(response, preview_path):
+    ok, msg = _write_output(response, preview_path)
+    log(f"Preview: {preview_path} ({msg})" if ok else f"Preview failed: {msg}")
+
+def _side_request(cmd):
+    """One command on a fresh connection, next to a request in progress (None if it fails)"""
+    client = ServerClient(get_client().socket_path)
+    try:
+        return client.request(cmd, timeout=10, start=False)
+    except (OSError, ValueError):
+        return None
+    finally:
+        client.close()
+
+def _run_watch(job_id, limit):
+    """still_waiting check for a job on the shared server.
+
+    Time spent queued behind other clients' jobs doesn't count: the limit
+    starts when the job starts running, and is raised to what the server
+    predicts for the job (cost_model.timeout) when that is longer.
+    """
+    def still_waiting():
+        summary = _side_request({'action': 'status', 'job_id': job_id})
+        if not summary or summary.get('status') != 'running' or not summary.get('started'):
+            return True  # queued, finished with the response on its way, or unknown
+        allowed = max(limit, cost_model.timeout(summary.get('predicted_seconds') or 0))
+        return time.time() - summary['started'] < allowed
+    return still_waiting
+
+def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanced', oneshot=False,
+                  transport='base64', gigapixel=False, roi=None, roi_margin=None, roi_crop=False,
+                  preview_path=None):
+    """Run inference on the resident server (or a throwaway one with oneshot=True).
+
+    transport='raw' passes the input by path and gets the result back as raw
+    RGB in shared memory instead of PNG+base64 over the socket.
+    gigapixel=True streams tiles into a raw canvas on disk (written straight
+    to output_path if it ends in .rgb, encoded in strips for .png), for
+    results too large for RAM; other output formats are refused.
+    roi="x,y,w,h" restores only that rectangle (plus roi_margin pixels of
+    context); roi_crop=True returns just the upscaled rectangle.
+    preview_path asks for a progressive run: a quick turbo preview is written
+    there first, then the requested preset to output_path.
+    """
     
     ok, msg = check_setup()
     if not ok:
         return False, msg
     
+    if gigapixel and not output_path.lower().endswith(GIGAPIXEL_OUTPUTS):
+        return False, f"Gigapixel output must be {' or '.join(GIGAPIXEL_OUTPUTS)} (other formats need the whole image in memory)"
+    
+    region = {}
+    if roi:
+        region = {'roi': [int(v) for v in str(roi).split(',')],
+                  'roi_output': 'crop' if roi_crop else 'full'}
+        if roi_margin is not None:
+            region['roi_margin'] = int(roi_margin)
+    
+    if oneshot:
+        return _run_oneshot(input_path, output_path, task, upscale, quality, region)
+    
+    cmd = {
+        'action': 'process',
+        'task': task,
+        'upscale': int(upscale),
+        'quality': quality,
+        **region
+    }
+    if gigapixel:
+        cmd['image_path'] = os.path.abspath(input_path)
+        cmd['gigapixel'] = True
+        if output_path.endswith('.rgb'):
+            cmd['output_path'] = os.path.abspath(output_path)
+    elif transport == 'raw':
+        cmd['image_path'] = os.path.abspath(input_path)
+        cmd['output'] = 'raw'
+    else:
+        try:
+            cmd['image_base64'] = _read_input_base64(input_path)
+        except Exception as e:
+            return False, f"Cannot read input: {e}"
+    
+    on_partial = None
+    if preview_path and not gigapixel:
+        cmd['progressive'] = True
+        on_partial = functools.partial(_write_preview, preview_path=preview_path)
+    
+    # Named here so the job can be watched (and cancelled) from a second connection
+    cmd['job_id'] = f"job_{int(time.time() * 1000)}_{os.getpid()}"
+    limit = 24 * 3600 if gigapixel else 600 if quality == 'quality' else 300
+    log(f"Sending job to resident server ({quality} mode)...")
+    try:
+        response = get_client().request(cmd, on_partial=on_partial,
+                                        still_waiting=_run_watch(cmd['job_id'], limit))
+    except socket.timeout:
+        _side_request({'action': 'cancel', 'job_id': cmd['job_id']})
+        return False, "Processing timeout"
+    except Exception as e:
+        return False, f"Server error: {e}"
+    
+    return _write_output(response, output_path)
+
+def _run_oneshot(input_path, output_path, task, upscale, quality, region=None):
+    """Spawn a fresh server for this image only (pays startup + model load)"""
+    
     # Read input
     try:
-        with open(input_path, 'rb') as f:
-            import base64
-            image_base64 = base64.b64encode(f.read()).decode('utf-8')
+        image_base64 = _read_input_base64(input_path)
     except Exception as e:
         return False, f"Cannot read input: {e}"
     
     # Run server script
-    env = os.environ.copy()
-    env['PYTHONPATH'] = str(DIFFBIR_DIR) + ':' + env.get('PYTHONPATH', '')
-    env['PYTHONUNBUFFERED'] = '1'
+    env = _server_env()
     
     log(f"Starting DiffBIR inference ({quality} mode)...")
     log("Loading models into GPU (first run takes ~30-60s)...")
@@ -76,7 +382,8 @@ def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanc
         'image_base64': image_base64,
         'task': task,
         'upscale': int(upscale),
-        'quality': quality
+        'quality': quality,
+        **(region or {})
     }) + '\n'
     
     proc = subprocess.run(
@@ -108,29 +415,23 @@ def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanc
     if proc.returncode != 0:
         return False, f"Server error: {proc.stderr[:500]}"
     
-    if not response:
-        return False, "No response from server"
-    
-    if not response.get('success'):
-        return False, response.get('error', 'Processing failed')
-    
-    # Write output
-    try:
-        import base64
-        with open(output_path, 'wb') as f:
-            f.write(base64.b64decode(response['image_base64']))
-        return True, f"Done in {response.get('processing_time', 0)}s"
-    except Exception as e:
-        return False, f"Failed to write output: {e}"
+    return _write_output(response, output_path)
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         print(f"Usage: {sys.argv[0]} <input> <output> [--task sr] [--upscale 4] [--quality turbo]")
-        print(f"       {sys.argv[0]} --status")
+        print(f"       [--oneshot] [--idle-timeout SECONDS] [--transport base64|raw] [--gigapixel]")
+        print(f"       [--roi X,Y,W,H [--roi-margin PIXELS] [--roi-crop]] [--preview PREVIEW_PATH]")
+        print(f"       {sys.argv[0]} --status [--refresh]")
+        print(f"       {sys.argv[0]} --stop-server")
         sys.exit(1)
 
     if sys.argv[1] == '--status':
-        print(json.dumps(status(), indent=2))
+        print(json.dumps(status(refresh='--refresh' in sys.argv), indent=2))
+        sys.exit(0)
+
+    if sys.argv[1] == '--stop-server':
+        get_client().stop()
         sys.exit(0)
 
     input_path = sys.argv[1]
@@ -146,6 +447,22 @@ if __name__ == '__main__':
             kwargs['upscale'] = int(args[i + 1]); i += 2
         elif args[i] == '--quality' and i + 1 < len(args):
             kwargs['quality'] = args[i + 1]; i += 2
+        elif args[i] == '--oneshot':
+            kwargs['oneshot'] = True; i += 1
+        elif args[i] == '--roi' and i + 1 < len(args):
+            kwargs['roi'] = args[i + 1]; i += 2
+        elif args[i] == '--roi-margin' and i + 1 < len(args):
+            kwargs['roi_margin'] = int(args[i + 1]); i += 2
+        elif args[i] == '--roi-crop':
+            kwargs['roi_crop'] = True; i += 1
+        elif args[i] == '--preview' and i + 1 < len(args):
+            kwargs['preview_path'] = args[i + 1]; i += 2
+        elif args[i] == '--gigapixel':
+            kwargs['gigapixel'] = True; i += 1
+        elif args[i] == '--transport' and i + 1 < len(args):
+            kwargs['transport'] = args[i + 1]; i += 2
+        elif args[i] == '--idle-timeout' and i + 1 < len(args):
+            get_client().idle_timeout = float(args[i + 1]); i += 2
         else:
             i += 1
 
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+ARMscaler — Streaming batch mode for folders, globs and manifests
+
+Three stages connected by bounded queues, so memory stays flat on huge folders:
+
+  decoder pool   read + decode inputs, hand them over as raw RGB (/dev/shm)
+  inference      one stage feeding the resident armscaler_server.py (which
+                 holds the model), keeping a few jobs submitted ahead so the
+                 server can micro-batch and never waits on us
+  encoder pool   read raw results, encode (format from the output's
+                 extension) and write outputs
+
+Outputs that already exist are skipped, so an interrupted run resumes.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+
+from armscaler import ServerClient, check_setup, log
+from raw_transport import HEADER as RAW_HEADER, raw_path, write_raw, map_raw
+
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff'}
+
+
+def collect_jobs(source, output_dir=None, suffix=''):
+    """(input, output) pairs from a directory, a glob pattern or a manifest.
+
+    Manifest: JSON list of {"input": ..., "output": ...} (or [input, output]),
+    or a text file with one "input[,output]" per line.
+    """
+    pairs = []
+    if os.path.isdir(source):
+        inputs = sorted(str(p) for p in Path(source).iterdir() if p.suffix.lower() in IMAGE_EXTS)
+    elif source.endswith(('.json', '.txt', '.csv')) and os.path.isfile(source):
+        with open(source) as f:
+            text = f.read()
+        if source.endswith('.json'):
+            entries = json.loads(text)
+        else:
+            entries = [[p.strip() for p in line.split(',')] for line in text.splitlines()
+                       if line.strip() and not line.startswith('#')]
+        inputs = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                entry = [entry['input'], entry.get('output')]
+            if len(entry) > 1 and entry[1]:
+                pairs.append((entry[0], entry[1]))
+            else:
+                inputs.append(entry[0])
+    else:
+        inputs = sorted(p for p in glob.glob(source) if Path(p).suffix.lower() in IMAGE_EXTS)
+
+    if inputs and output_dir is None:
+        raise ValueError("--output-dir is required for directory/glob inputs")
+    for input_path in inputs:
+        stem = Path(input_path).stem
+        pairs.append((input_path, os.path.join(output_dir, f"{stem}{suffix}.png")))
+
+    by_output = {}
+    for input_path, output_path in pairs:
+        output_format(output_path)
+        by_output.setdefault(os.path.normcase(os.path.abspath(output_path)), []).append(input_path)
+    clashes = {out: ins for out, ins in by_output.items() if len(ins) > 1}
+    if clashes:
+        out, ins = next(iter(clashes.items()))
+        raise ValueError(f"{len(clashes)} output path(s) written by more than one input, "
+                         f"e.g. {out} <- {', '.join(ins)} (use a manifest to name them)")
+    return pairs
+
+
+def output_format(path):
+    """PIL format name for an output path, from its extension"""
+    from PIL import Image
+    ext = Path(path).suffix.lower()
+    fmt = Image.registered_extensions().get(ext)
+    if fmt is None or fmt not in Image.SAVE:
+        raise ValueError(f"Unsupported output format: {path}")
+    return fmt
+
+
+class BatchRunner:
+    """Pipelined decode → inference → encode over a list of (input, output) jobs"""
+
+    def __init__(self, jobs, task='sr', upscale=4, quality='balanced', decoders=2, encoders=2,
+                 inflight=2, queue_size=4, skip_existing=True, timeout=1800, client=None):
+        self.jobs = jobs
+        self.params = {'task': task, 'upscale': int(upscale), 'quality': quality}
+        self.decoders = max(1, decoders)
+        self.encoders = max(1, encoders)
+        self.inflight = max(1, inflight)
+        self.skip_existing = skip_existing
+        self.timeout = timeout
+        self.client = client or ServerClient()
+
+        self._todo = queue.Queue()
+        self._decoded = queue.Queue(maxsize=queue_size)
+        self._results = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._run_id = f"{os.getpid()}_{int(time.time())}"
+        self.stats = {'total': len(jobs), 'done': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+
+    # ── Stage 1: decode ──
+    def _decode_worker(self):
+        from PIL import Image
+        while True:
+            item = self._todo.get()
+            if item is None:
+                self._decoded.put(None)
+                return
+            try:
+                image = Image.open(item['input']).convert('RGB')
+                item['input_raw'] = write_raw(raw_path(f"armscaler_in_{self._run_id}_{item['index']}"),
+                                              image.width, image.height, image.tobytes())
+                del image
+            except Exception as e:
+                item['error'] = f"Decode failed: {e}"
+            self._decoded.put(item)
+
+    # ── Stage 2: inference (single stage, talks to the model server) ──
+    def _inference_stage(self):
+        inflight = deque()
+        decoders_left = self.decoders
+        while True:
+            # Keep the server fed: submit ahead up to self.inflight jobs
+            while len(inflight) < self.inflight and decoders_left:
+                try:
+                    item = self._decoded.get(timeout=0.05 if inflight else None)
+                except queue.Empty:
+                    break
+                if item is None:
+                    decoders_left -= 1
+                    continue
+                if 'error' not in item:
+                    self._submit(item)
+                if 'error' in item:
+                    self._results.put(item)
+                else:
+                    inflight.append(item)
+
+            if not inflight:
+                if not decoders_left:
+                    break
+                continue
+
+            item = inflight.popleft()
+            try:
+                item['result'] = self.client.request(
+                    {'action': 'result', 'job_id': item['job_id'], 'wait': self.timeout},
+                    timeout=self.timeout + 30)
+            except Exception as e:
+                item['error'] = f"Server error: {e}"
+            _remove_quietly(item.pop('input_raw', None))
+            self._results.put(item)
+
+        for _ in range(self.encoders):
+            self._results.put(None)
+
+    def _submit(self, item):
+        try:
+            response = self.client.request(dict(self.params, action='submit', output='raw',
+                                                image_raw=item['input_raw']), timeout=60)
+        except Exception as e:
+            response = {'success': False, 'error': f"Server error: {e}"}
+        if response.get('success'):
+            item['job_id'] = response['job_id']
+        else:
+            item['error'] = response.get('error', 'Submit failed')
+            _remove_quietly(item.pop('input_raw', None))
+
+    # ── Stage 3: encode + write ──
+    def _encode_worker(self):
+        from PIL import Image
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            result = item.get('result') or {}
+            error = item.get('error')
+            if not error and not result.get('success'):
+                error = result.get('error', 'Processing failed')
+            if not error:
+                try:
+                    width, height, channels, mm = map_raw(result['image_raw'])
+                    try:
+                        image = Image.frombuffer(
+                            'RGB', (width, height),
+                            mm[RAW_HEADER.size:RAW_HEADER.size + width * height * channels],
+                            'raw', 'RGB', 0, 1)
+                        os.makedirs(os.path.dirname(item['output']) or '.', exist_ok=True)
+                        tmp = f"{item['output']}.part"
+                        image.save(tmp, format=output_format(item['output']))
+                        os.replace(tmp, item['output'])
+                    finally:
+                        mm.close()
+                except Exception as e:
+                    error = f"Write failed: {e}"
+            _remove_quietly(result.get('image_raw'))
+            self._finish(item, error)
+
+    def _finish(self, item, error=None):
+        with self._lock:
+            if error:
+                self.stats['failed'] += 1
+                self.stats['errors'].append({'input': item['input'], 'error': error})
+                log(f"FAILED {item['input']}: {error}")
+            else:
+                self.stats['done'] += 1
+                finished = self.stats['done'] + self.stats['failed']
+                log(f"[{finished}/{self.stats['total'] - self.stats['skipped']}] {item['output']}")
+
+    def run(self):
+        start = time.time()
+        for index, (input_path, output_path) in enumerate(self.jobs):
+            if self.skip_existing and os.path.exists(output_path):
+                self.stats['skipped'] += 1
+                continue
+            self._todo.put({'index': index, 'input': input_path, 'output': output_path})
+        for _ in range(self.decoders):
+            self._todo.put(None)
+        log(f"Batch: {self.stats['total']} image(s), {self.stats['skipped']} already done")
+
+        threads = [threading.Thread(target=self._decode_worker, daemon=True) for _ in range(self.decoders)]
+        threads += [threading.Thread(target=self._encode_worker, daemon=True) for _ in range(self.encoders)]
+        for t in threads:
+            t.start()
+        self._inference_stage()
+        for t in threads:
+            t.join()
+
+        elapsed = time.time() - start
+        self.stats['elapsed'] = round(elapsed, 2)
+        self.stats['images_per_minute'] = round(self.stats['done'] / elapsed * 60, 2) if elapsed else 0.0
+        return self.stats
+
+
+def _remove_quietly(path):
+    if path:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <dir|glob|manifest> [--output-dir DIR] [--suffix _4x]")
+        print(f"       [--task sr] [--upscale 4] [--quality turbo] [--decoders 2] [--encoders 2]")
+        print(f"       [--inflight 2] [--overwrite]")
+        sys.exit(1)
+
+    ok, msg = check_setup()
+    if not ok:
+        log(f"FAILED: {msg}")
+        sys.exit(1)
+
+    source = sys.argv[1]
+    kwargs = {}
+    output_dir = None
+    suffix = ''
+    args = sys.argv[2:]
+    i = 0
+    while i < len(args):
+        if args[i] == '--output-dir' and i + 1 < len(args):
+            output_dir = args[i + 1]; i += 2
+        elif args[i] == '--suffix' and i + 1 < len(args):
+            suffix = args[i + 1]; i += 2
+        elif args[i] == '--task' and i + 1 < len(args):
+            kwargs['task'] = args[i + 1]; i += 2
+        elif args[i] == '--upscale' and i + 1 < len(args):
+            kwargs['upscale'] = int(args[i + 1]); i += 2
+        elif args[i] == '--quality' and i + 1 < len(args):
+            kwargs['quality'] = args[i + 1]; i += 2
+        elif args[i] in ('--decoders', '--encoders', '--inflight') and i + 1 < len(args):
+            kwargs[args[i][2:]] = int(args[i + 1]); i += 2
+        elif args[i] == '--overwrite':
+            kwargs['skip_existing'] = False; i += 1
+        else:
+            i += 1
+
+    try:
+        jobs = collect_jobs(source, output_dir, suffix)
+    except (OSError, ValueError) as e:
+        log(f"FAILED: {e}")
+        sys.exit(1)
+
+    stats = BatchRunner(jobs, **kwargs).run()
+    print(json.dumps(stats, indent=2))
+    sys.exit(1 if stats['failed'] else 0)
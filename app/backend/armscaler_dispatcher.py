@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+"""
+ARMscaler multi-device dispatcher.
+
+Runs N armscaler_server.py workers, each pinned to one GPU
+(CUDA_VISIBLE_DEVICES) or to a CPU core set (sched_setaffinity; each
+worker sizes its threads from cpu_tuning's profile), and serves the same JSON-lines socket
+protocol as a single server (process, submit, result, cancel, status,
+ping, shutdown), so armscaler.py and armscaler_batch.py work unchanged.
+
+Jobs wait here, shortest predicted first with aging (cost_model.sjf_key),
+until a worker has a free slot (WORKER_DEPTH in flight per worker), then
+go to the worker with the earliest estimated finish: its
+backlog plus this job's cost (output megapixels x sampling steps x that
+worker's measured seconds per unit), plus COLD_TASK_SECONDS when the task
+isn't warm in the worker's task pool. A worker that dies is restarted with
+backoff; the jobs it held go back to the queue (up to MAX_ATTEMPTS runs).
+
+    python3 armscaler_dispatcher.py [--socket PATH] [--idle-timeout S]
+        [--devices 0,1 | cpu:0-15,cpu:16-31] [--workers N] [--worker-script PATH]
+
+Without --devices: one worker per visible GPU, else --workers CPU workers
+(default one per CPU_WORKER_CORES cores) splitting this process's cores.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import base64
+import tempfile
+import itertools
+import threading
+import subprocess
+import socketserver
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from armscaler import ServerClient, SCRIPT_DIR, _server_env
+from raw_transport import read_header
+import cost_model
+
+DEFAULT_SOCKET_PATH = os.environ.get(
+    'ARMSCALER_SOCKET', os.path.join(tempfile.gettempdir(), 'armscaler_server.sock'))
+DEFAULT_IDLE_TIMEOUT = 600.0
+WORKER_SCRIPT = SCRIPT_DIR / 'armscaler_server.py'
+WORKER_LOG_DIR = os.environ.get('ARMSCALER_WORKER_LOG_DIR', tempfile.gettempdir())
+DEVICES = os.environ.get('ARMSCALER_DEVICES', '')
+WORKERS = os.environ.get('ARMSCALER_WORKERS', 'auto')
+CPU_WORKER_CORES = 8
+
+# Routing
+WORKER_DEPTH = int(os.environ.get('ARMSCALER_WORKER_DEPTH', '2'))  # running + one queued for micro-batching
+COLD_TASK_SECONDS = float(os.environ.get('ARMSCALER_COLD_TASK_SECONDS', '15'))
+GPU_SECONDS_PER_UNIT = 0.8    # per output megapixel per sampling step; refined per worker as jobs finish
+CPU_SECONDS_PER_UNIT = 30.0
+RATE_SMOOTHING = 0.3
+TASK_POOL_SIZE = int(os.environ.get('ARMSCALER_TASK_POOL', '3'))
+
+# Recovery
+MAX_ATTEMPTS = 2
+RESTART_BACKOFF_MAX = 30.0
+STABLE_SECONDS = 60.0  # a worker that ran this long before dying restarts without backoff
+MONITOR_INTERVAL = 0.5
+
+MAX_QUEUE = int(os.environ.get('ARMSCALER_MAX_QUEUE', '32'))
+JOB_TTL = float(os.environ.get('ARMSCALER_JOB_TTL', '3600'))
+
+_workers = []
+_jobs: Dict[str, Dict[str, Any]] = {}
+_pending = []  # queued jobs, in no particular order (sorted when scheduling)
+_cond = threading.Condition()
+_job_seq = itertools.count()
+_stats = {"jobs_completed": 0, "jobs_failed": 0, "jobs_cancelled": 0, "jobs_requeued": 0,
+          "worker_restarts": 0}
+_gpu_info = {'available': False, 'name': 'CPU', 'vram_gb': 0, 'is_ampere': False}
+_stdout_lock = threading.Lock()
+_last_activity = time.time()
+_active_connections = 0
+_shutdown_requested = threading.Event()
+
+
+def log(msg: str, level: str = "INFO"):
+    emit({"level": level, "message": msg, "timestamp": time.time()})
+
+
+def emit(obj: Dict[str, Any]):
+    line = json.dumps(obj)
+    with _stdout_lock:
+        print(line, flush=True)
+
+
+# ── Devices ──
+
+def _parse_cores(spec: str) -> list:
+    """[0, 1, 2, 3, 8, 9] from "0-3+8-9" """
+    cores = []
+    for part in spec.split('+'):
+        first, _, last = part.partition('-')
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def parse_devices(spec: str) -> list:
+    """Worker devices from "0,1" / "cuda:0,cuda:1" (GPUs) or "cpu:0-7,cpu:8-15" / "cpu" (core sets)"""
+    devices = []
+    for entry in (e.strip() for e in spec.split(',') if e.strip()):
+        if entry.startswith('cpu'):
+            cores = _parse_cores(entry[4:]) if entry.startswith('cpu:') else None
+            devices.append({'name': entry, 'gpu': None, 'cores': cores})
+        else:
+            index = int(entry.split(':')[-1])
+            devices.append({'name': f'cuda:{index}', 'gpu': index, 'cores': None})
+    return devices
+
+
+def detect_devices(workers: Optional[int] = None) -> list:
+    """One worker per visible GPU (or `workers`, round-robin over them), else CPU core sets"""
+    global _gpu_info
+    gpus = []
+    try:
+        from capability_probe import capabilities
+        caps, _ = capabilities()
+        gpus = caps.get('devices', [])
+    except Exception as e:
+        log(f"Device probe failed ({e}), using CPU workers", "WARNING")
+    if gpus:
+        _gpu_info = {k: v for k, v in gpus[0].items() if k != 'index'}
+        _gpu_info['available'] = True
+        return [{'name': f"cuda:{gpus[i % len(gpus)]['index']}", 'gpu': gpus[i % len(gpus)]['index'],
+                 'cores': None} for i in range(workers or len(gpus))]
+    cores = sorted(os.sched_getaffinity(0))
+    count = max(1, min(len(cores), workers or len(cores) // CPU_WORKER_CORES))
+    sets = [cores[i * len(cores) // count:(i + 1) * len(cores) // count] for i in range(count)]
+    return [{'name': f"cpu:{'+'.join(_core_ranges(s))}", 'gpu': None, 'cores': s} for s in sets]
+
+
+def _core_ranges(cores: list) -> list:
+    """["0-3", "8"] from [0, 1, 2, 3, 8] (the inverse of _parse_cores)"""
+    ranges = []
+    for core in cores:
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return [f"{first}-{last}" if last > first else str(first) for first, last in ranges]
+
+
+# ── Workers ──
+
+class Worker:
+    """One armscaler_server.py process pinned to a device, and what we know about it"""
+
+    def __init__(self, index: int, device: Dict[str, Any], script):
+        self.index = index
+        self.device = device
+        self.script = str(script)
+        self.socket_path = os.path.join(tempfile.gettempdir(),
+                                        f"armscaler_worker_{os.getpid()}_{index}.sock")
+        self.log_path = os.path.join(WORKER_LOG_DIR, f"armscaler_worker_{index}.log")
+        self.proc = None
+        self.ready = False
+        self.started = None
+        self.next_start = 0.0
+        self.restarts = 0
+        self.in_flight: Dict[str, Dict[str, Any]] = {}
+        self.warm = OrderedDict()  # tasks set up in the worker's task pool, LRU order
+        self.rate = CPU_SECONDS_PER_UNIT if device['gpu'] is None else GPU_SECONDS_PER_UNIT
+        self.completed = 0
+        self.failed = 0
+
+    def _env(self) -> Dict[str, str]:
+        env = _server_env()
+        env['CUDA_VISIBLE_DEVICES'] = '' if self.device['gpu'] is None else str(self.device['gpu'])
+        if not self.device['cores']:
+            # Workers without a core set split the machine; cpu_tuning gives each its slice
+            shared = [w for w in _workers if not w.device['cores']]
+            env['ZARMA_CPU_SHARE'] = str(len(shared))
+            env['ZARMA_CPU_SLOT'] = str(shared.index(self))
+        return env
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        cores = self.device['cores']
+        with open(self.log_path, 'ab') as log_file:
+            self.proc = subprocess.Popen(
+                [sys.executable, '-u', self.script, '--socket', self.socket_path, '--idle-timeout', '0'],
+                stdin=subprocess.DEVNULL,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                env=self._env(),
+                preexec_fn=(lambda: os.sched_setaffinity(0, cores)) if cores else None,
+            )
+        self.started = time.time()
+        log(f"Worker {self.index} ({self.device['name']}) started, pid {self.proc.pid}")
+
+    def request(self, cmd: Dict[str, Any], timeout: Optional[float] = None, on_partial=None) -> Dict[str, Any]:
+        """One command on a fresh connection (raises OSError if the worker is gone)"""
+        client = ServerClient(self.socket_path)
+        try:
+            return client.request(cmd, timeout=timeout, start=False, on_partial=on_partial)
+        finally:
+            client.close()
+
+    def ping(self) -> bool:
+        try:
+            return bool(self.request({'action': 'ping'}, timeout=2).get('pong'))
+        except (OSError, ValueError):
+            return False
+
+    def stop(self, timeout: float = 10.0):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        try:
+            self.request({'action': 'shutdown'}, timeout=2)
+            self.proc.wait(timeout)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.proc.terminate()
+            try:
+                self.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+    def backlog_seconds(self) -> float:
+        return sum(job['cost'] for job in self.in_flight.values()) * self.rate
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'index': self.index,
+            'device': self.device['name'],
+            'pid': self.proc.pid if self.proc is not None else None,
+            'ready': self.ready,
+            'restarts': self.restarts,
+            'in_flight': list(self.in_flight),
+            'warm_tasks': list(self.warm),
+            'completed': self.completed,
+            'failed': self.failed,
+            'seconds_per_unit': round(self.rate, 4),
+            'backlog_seconds': round(self.backlog_seconds(), 1),
+        }
+
+
+def _monitor_workers():
+    """Start, health-check and restart workers until shutdown"""
+    while not _shutdown_requested.is_set():
+        now = time.time()
+        for worker in _workers:
+            if worker.proc is None:
+                if now >= worker.next_start:
+                    try:
+                        worker.start()
+                    except (OSError, subprocess.SubprocessError) as e:
+                        delay = min(RESTART_BACKOFF_MAX, 2 ** worker.restarts)
+                        worker.restarts += 1
+                        worker.next_start = now + delay
+                        log(f"Worker {worker.index} ({worker.device['name']}) failed to start ({e}), "
+                            f"retrying in {delay:.0f}s", "ERROR")
+            elif worker.proc.poll() is not None:
+                code, uptime = worker.proc.returncode, now - worker.started
+                with _cond:
+                    worker.ready = False
+                    worker.warm.clear()
+                    _stats['worker_restarts'] += 1
+                if uptime >= STABLE_SECONDS:
+                    worker.restarts = 0
+                delay = min(RESTART_BACKOFF_MAX, 2 ** worker.restarts - 1)
+                worker.restarts += 1
+                worker.proc = None
+                worker.next_start = now + delay
+                log(f"Worker {worker.index} ({worker.device['name']}) exited with code {code} "
+                    f"after {uptime:.0f}s, restarting in {delay:.0f}s", "WARNING")
+            elif not worker.ready and worker.ping():
+                with _cond:
+                    worker.ready = True
+                    _cond.notify_all()
+                log(f"Worker {worker.index} ({worker.device['name']}) ready")
+        _shutdown_requested.wait(MONITOR_INTERVAL)
+
+
+# ── Routing ──
+
+def _input_size(cmd: Dict[str, Any]) -> Optional[tuple]:
+    """(w, h) of the part of the input that gets restored, from the header only"""
+    if cmd.get('roi'):
+        roi = cmd['roi'].split(',') if isinstance(cmd['roi'], str) else cmd['roi']
+        margin = int(cmd.get('roi_margin', 32))
+        return int(float(roi[2])) + 2 * margin, int(float(roi[3])) + 2 * margin
+    try:
+        if cmd.get('image_raw'):
+            return read_header(cmd['image_raw'])[:2]
+        from PIL import Image
+        if cmd.get('image_path'):
+            with Image.open(cmd['image_path']) as image:
+                return image.size
+        with Image.open(io.BytesIO(base64.b64decode(cmd.get('image_base64', '')))) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def job_cost(cmd: Dict[str, Any]) -> float:
+    """Work units: output megapixels x sampling steps (a 512x512 input when unknown)"""
+    return cost_model.work(_input_size(cmd), int(cmd.get('upscale', 4)),
+                           cost_model.steps_for(cmd.get('quality', 'balanced')))
+
+
+def _predicted(job: Dict[str, Any]) -> float:
+    """Seconds the job would take on the fastest worker"""
+    return job['cost'] * min((w.rate for w in _workers), default=GPU_SECONDS_PER_UNIT)
+
+
+def _queue_order() -> list:
+    """Queued jobs by priority, then shortest predicted first with aging (holds _cond)"""
+    now = time.time()
+    return sorted(_pending, key=lambda job: cost_model.sjf_key(job['priority'], _predicted(job), job['created'], now))
+
+
+def _finish_estimate(worker: Worker, job: Dict[str, Any]) -> float:
+    cold = 0.0 if job['task'] in worker.warm else COLD_TASK_SECONDS
+    return worker.backlog_seconds() + job['cost'] * worker.rate + cold
+
+
+def _schedule():
+    """Hand queued jobs, in _queue_order(), to the best worker with a free slot (holds _cond)"""
+    _pending[:] = _queue_order()
+    while _pending:
+        free = [w for w in _workers if w.ready and len(w.in_flight) < WORKER_DEPTH]
+        if not free:
+            return
+        job = _pending.pop(0)
+        worker = min(free, key=lambda w: (_finish_estimate(w, job), len(w.in_flight), w.index))
+        job['status'] = 'running'
+        job['worker'] = worker.index
+        job['attempts'] += 1
+        if job['started'] is None:
+            job['started'] = time.time()
+        worker.in_flight[job['job_id']] = job
+        threading.Thread(target=_forward, args=(worker, job), name=f"forward-{job['job_id']}",
+                         daemon=True).start()
+
+
+def _scheduler_loop():
+    with _cond:
+        while not _shutdown_requested.is_set():
+            _schedule()
+            _cond.wait(1.0)
+
+
+def _forward(worker: Worker, job: Dict[str, Any]):
+    """Run one job on its worker; requeue it if the worker goes away underneath it.
+
+    A timeout is not a lost worker: the worker is still running the job, so
+    it is cancelled there and failed here rather than run a second time.
+    """
+    cmd = dict(job['cmd'], action='process', job_id=job['job_id'])
+    if job['send'] is None:
+        cmd.pop('progressive', None)
+    timeout = cmd.get('timeout', 24 * 3600)
+    try:
+        response = worker.request(cmd, timeout=timeout, on_partial=job['send'])
+    except socket.timeout:
+        try:
+            worker.request({'action': 'cancel', 'job_id': job['job_id']}, timeout=5)
+        except (OSError, ValueError):
+            pass  # gone after all; the monitor notices
+        with _cond:
+            worker.in_flight.pop(job['job_id'], None)
+            worker.failed += 1
+            if job['cancel_requested']:
+                _finish(job, 'cancelled')
+            else:
+                log(f"[{job['job_id']}] Timed out after {timeout}s on worker {worker.index}", "WARNING")
+                _finish(job, 'failed', {'success': False, 'job_id': job['job_id'],
+                                        'error': f"Timed out after {timeout}s on worker {worker.index}"})
+            _cond.notify_all()
+        return
+    except (OSError, ValueError) as e:
+        with _cond:
+            worker.in_flight.pop(job['job_id'], None)
+            worker.ready = False  # until the monitor has pinged or restarted it
+            if job['cancel_requested']:
+                _finish(job, 'cancelled')
+            elif job['attempts'] >= MAX_ATTEMPTS:
+                _finish(job, 'failed', {'success': False, 'job_id': job['job_id'],
+                                        'error': f"Worker lost {job['attempts']} times (last: {e})"})
+            else:
+                log(f"[{job['job_id']}] Worker {worker.index} lost ({e}), requeued", "WARNING")
+                job['status'] = 'queued'
+                _stats['jobs_requeued'] += 1
+                _pending.append(job)
+            _cond.notify_all()
+        return
+
+    with _cond:
+        worker.in_flight.pop(job['job_id'], None)
+        was_warm = job['task'] in worker.warm
+        worker.warm[job['task']] = time.time()
+        worker.warm.move_to_end(job['task'])
+        while len(worker.warm) > TASK_POOL_SIZE:
+            worker.warm.popitem(last=False)
+        if response.get('success'):
+            worker.completed += 1
+            # Cold runs include task setup, cache hits skip the model: neither says much about speed
+            if was_warm and not response.get('cached') and response.get('processing_time'):
+                per_unit = response['processing_time'] / max(job['cost'], 1e-6)
+                worker.rate += RATE_SMOOTHING * (per_unit - worker.rate)
+        else:
+            worker.failed += 1
+        if job['cancel_requested']:
+            if response.get('image_raw'):
+                _remove_quietly(response['image_raw'])
+            _finish(job, 'cancelled')
+        else:
+            _finish(job, 'done' if response.get('success') else 'failed', dict(response, worker=worker.index))
+        _cond.notify_all()
+
+
+def _remove_quietly(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+# ── Jobs ──
+
+def _finish(job: Dict[str, Any], status: str, result: Optional[Dict[str, Any]] = None):
+    """Mark a job finished (caller holds _cond)"""
+    job['status'] = status
+    job['finished'] = time.time()
+    job['result'] = result
+    if result is not None and not result.get('success'):
+        job['error'] = result.get('error')
+    job['cmd'].pop('image_base64', None)
+    job['send'] = None
+    key = {'done': 'jobs_completed', 'failed': 'jobs_failed', 'cancelled': 'jobs_cancelled'}[status]
+    _stats[key] += 1
+    job['done'].set()
+
+
+def _job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    summary = {k: job[k] for k in ('job_id', 'status', 'priority', 'created', 'started', 'finished',
+                                   'worker', 'attempts')}
+    summary.update(task=job['task'], upscale=int(job['cmd'].get('upscale', 4)),
+                   quality=job['cmd'].get('quality', 'balanced'), cost=round(job['cost'], 2),
+                   predicted_seconds=round(_predicted(job), 1))
+    if job['status'] == 'queued':
+        ordered = _queue_order()
+        summary['position'] = ordered.index(job) if job in ordered else -1
+    if job.get('error'):
+        summary['error'] = job['error']
+    return summary
+
+
+def _reap_jobs():
+    """Forget finished jobs older than JOB_TTL (caller holds _cond)"""
+    cutoff = time.time() - JOB_TTL
+    for job_id in [j for j, job in _jobs.items() if job['finished'] is not None and job['finished'] < cutoff]:
+        del _jobs[job_id]
+
+
+def submit_job(cmd: Dict[str, Any], send=None) -> Dict[str, Any]:
+    """Queue a job for the next free worker; higher priority first, then shortest predicted (with aging)"""
+    job_id = cmd.get('job_id') or f"job_{int(time.time() * 1000)}_{next(_job_seq)}"
+    params = {k: v for k, v in cmd.items() if k not in ('action', 'job_id', 'wait')}
+    job = {
+        'job_id': job_id,
+        'cmd': params,
+        'task': params.get('task', 'sr'),
+        'cost': job_cost(params),
+        'status': 'queued',
+        'priority': int(cmd.get('priority', 0)),
+        'seq': next(_job_seq),
+        'created': time.time(),
+        'started': None,
+        'finished': None,
+        'worker': None,
+        'attempts': 0,
+        'result': None,
+        'error': None,
+        'cancel_requested': False,
+        'send': send if cmd.get('progressive') else None,
+        'done': threading.Event(),
+    }
+    with _cond:
+        _reap_jobs()
+        if job_id in _jobs:
+            return {'success': False, 'error': f'Duplicate job_id: {job_id}', 'job_id': job_id}
+        if len(_pending) >= MAX_QUEUE:
+            return {'success': False, 'error': f'Queue full ({MAX_QUEUE} jobs)', 'job_id': job_id}
+        _jobs[job_id] = job
+        _pending.append(job)
+        _schedule()
+        return {'success': True, 'job_id': job_id, 'status': job['status'],
+                'position': _job_summary(job).get('position', -1), 'worker': job['worker']}
+
+
+def cancel_job(job_id: Optional[str]) -> Dict[str, Any]:
+    """Cancel a queued job here, or ask its worker to drop a running one"""
+    with _cond:
+        job = _jobs.get(job_id)
+        if job is None:
+            return {'success': False, 'error': f'Unknown job: {job_id}', 'job_id': job_id}
+        if job['status'] == 'queued':
+            _pending.remove(job)
+            _finish(job, 'cancelled')
+            worker = None
+        elif job['status'] == 'running':
+            job['cancel_requested'] = True
+            worker = _workers[job['worker']]
+        else:
+            return {'success': False, 'error': f"Job already {job['status']}", 'job_id': job_id}
+    if worker is not None:
+        try:
+            worker.request({'action': 'cancel', 'job_id': job_id}, timeout=5)
+        except (OSError, ValueError):
+            pass  # the worker is gone; _forward finishes the job as cancelled
+    return {'success': True, 'job_id': job_id, 'status': job['status'],
+            'cancel_requested': job['cancel_requested']}
+
+
+def job_result(job_id: Optional[str], wait: float = 0) -> Dict[str, Any]:
+    """Result of a finished job (optionally waiting); a delivered result is not kept"""
+    with _cond:
+        job = _jobs.get(job_id)
+    if job is None:
+        return {'success': False, 'error': f'Unknown job: {job_id}', 'job_id': job_id}
+    if wait:
+        job['done'].wait(float(wait))
+    with _cond:
+        if job['result'] is not None:
+            _jobs.pop(job_id, None)
+            return job['result']
+        summary = _job_summary(job)
+    summary['success'] = False
+    summary.setdefault('error', f"Job {summary['status']}")
+    return summary
+
+
+def status() -> Dict[str, Any]:
+    with _cond:
+        _reap_jobs()
+        stats = dict(_stats)
+        stats['jobs'] = {job_id: _job_summary(job) for job_id, job in _jobs.items()}
+        stats['queue_depth'] = len(_pending)
+        workers = [worker.summary() for worker in _workers]
+    return {
+        'ready': any(w['ready'] for w in workers),
+        'gpu': _gpu_info,
+        'models_loaded': any(w['warm_tasks'] for w in workers),
+        'dispatcher': True,
+        'workers': workers,
+        'stats': stats,
+        'pid': os.getpid(),
+    }
+
+
+def handle_command(cmd: Dict[str, Any], send=None) -> Dict[str, Any]:
+    action = cmd.get('action')
+    if action == 'status':
+        if cmd.get('job_id'):
+            with _cond:
+                job = _jobs.get(cmd['job_id'])
+                if job is not None:
+                    return _job_summary(job)
+            return {'success': False, 'error': f"Unknown job: {cmd['job_id']}", 'job_id': cmd['job_id']}
+        return status()
+    elif action == 'process':
+        submitted = submit_job(cmd, send)
+        if not submitted.get('success'):
+            return submitted
+        return job_result(submitted['job_id'], wait=cmd.get('timeout', 24 * 3600))
+    elif action == 'submit':
+        return submit_job(cmd)
+    elif action == 'cancel':
+        return cancel_job(cmd.get('job_id'))
+    elif action == 'result':
+        return job_result(cmd.get('job_id'), wait=cmd.get('wait', 0))
+    elif action == 'ping':
+        with _cond:
+            ready = any(w.ready for w in _workers)
+        return {'pong': True, 'ready': ready, 'pid': os.getpid()}
+    elif action == 'shutdown':
+        _shutdown_requested.set()
+        return {'shutdown': True}
+    return {'error': f'Unknown action: {action}'}
+
+
+# ── Socket server ──
+
+def _touch():
+    global _last_activity
+    _last_activity = time.time()
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """One client connection: JSON lines in, JSON lines out"""
+
+    def _send(self, response: Dict[str, Any]):
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        global _active_connections
+        with _cond:
+            _active_connections += 1
+        try:
+            for raw in self.rfile:
+                line = raw.decode('utf-8', errors='replace').strip()
+                if not line:
+                    continue
+                _touch()
+                try:
+                    cmd = json.loads(line)
+                    response = handle_command(cmd, self._send) if isinstance(cmd, dict) else \
+                        {'error': 'Command must be a JSON object'}
+                except json.JSONDecodeError as e:
+                    response = {'error': f'Invalid JSON: {e}'}
+                except Exception as e:
+                    log(f"Command error: {e}", "ERROR")
+                    response = {'error': str(e)}
+                _touch()
+                self._send(response)
+                if _shutdown_requested.is_set():
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with _cond:
+                _active_connections -= 1
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _idle_watchdog(server, idle_timeout: float):
+    while not _shutdown_requested.wait(1.0):
+        if idle_timeout <= 0:
+            continue
+        with _cond:
+            busy = _active_connections > 0 or any(
+                job['status'] in ('queued', 'running') for job in _jobs.values())
+        if not busy and time.time() - _last_activity > idle_timeout:
+            log(f"Idle for {idle_timeout:.0f}s, shutting down")
+            _shutdown_requested.set()
+    with _cond:
+        _cond.notify_all()
+    server.shutdown()
+
+
+def parse_args(argv):
+    opts = {'socket': DEFAULT_SOCKET_PATH, 'idle_timeout': DEFAULT_IDLE_TIMEOUT, 'devices': DEVICES,
+            'workers': None if WORKERS == 'auto' else int(WORKERS), 'worker_script': WORKER_SCRIPT}
+    i = 0
+    while i < len(argv):
+        if argv[i] == '--socket' and i + 1 < len(argv):
+            opts['socket'] = argv[i + 1]; i += 2
+        elif argv[i] == '--idle-timeout' and i + 1 < len(argv):
+            opts['idle_timeout'] = float(argv[i + 1]); i += 2
+        elif argv[i] == '--devices' and i + 1 < len(argv):
+            opts['devices'] = argv[i + 1]; i += 2
+        elif argv[i] == '--workers' and i + 1 < len(argv):
+            opts['workers'] = int(argv[i + 1]); i += 2
+        elif argv[i] == '--worker-script' and i + 1 < len(argv):
+            opts['worker_script'] = os.path.abspath(argv[i + 1]); i += 2
+        else:
+            i += 1
+    return opts
+
+
+def main(argv=None):
+    opts = parse_args(sys.argv[1:] if argv is None else argv)
+    devices = parse_devices(opts['devices']) if opts['devices'] else detect_devices(opts['workers'])
+    log(f"ARMscaler dispatcher starting: {len(devices)} worker(s) on {', '.join(d['name'] for d in devices)}")
+    _workers.extend(Worker(i, device, opts['worker_script']) for i, device in enumerate(devices))
+
+    threading.Thread(target=_monitor_workers, name='worker-monitor', daemon=True).start()
+    threading.Thread(target=_scheduler_loop, name='scheduler', daemon=True).start()
+
+    socket_path = opts['socket']
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = _UnixServer(socket_path, _CommandHandler)
+    os.chmod(socket_path, 0o600)
+    log(f"Listening on {socket_path} (idle timeout: {opts['idle_timeout']:.0f}s)")
+    threading.Thread(target=_idle_watchdog, args=(server, opts['idle_timeout']), daemon=True).start()
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.server_close()
+        _remove_quietly(socket_path)
+        _shutdown_requested.set()
+        for worker in _workers:
+            worker.stop()
+            _remove_quietly(worker.socket_path)
+        log("Dispatcher stopped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,7 +11,15 @@ import time
 import base64
 import io
 import tempfile
+import queue
+import copy
+import hashlib
+import itertools
+import contextlib
+import inspect
+import socketserver
 from pathlib import Path
+from collections import OrderedDict
 from typing import Optional, Dict, Any
 import threading
 
@@ -20,11 +28,14 @@ os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:512,expandable_segmen
 os.environ["NVIDIA_TF32_OVERRIDE"] = "1"
 os.environ["CUDA_LAUNCH_BLOCKING"] = "0"
 os.environ["CUBLAS_WORKSPACE_CONFIG"] = ":4096:8"
-os.environ["OMP_NUM_THREADS"] = "8"
-os.environ["MKL_NUM_THREADS"] = "8"
 os.environ["TORCH_CUDNN_V8_API_ENABLED"] = "1"
 os.environ["CUDA_MODULE_LOADING"] = "LAZY"
 
+# OMP/MKL threads and CPU affinity from this host's calibration profile,
+# scaled to the worker's share of the machine (explicit env values win)
+import cpu_tuning
+_cpu_plan = cpu_tuning.apply('torch')
+
 import torch
 import numpy as np
 from PIL import Image
@@ -38,15 +49,118 @@ SCRIPT_DIR = Path(__file__).parent.resolve()
 DIFFBIR_DIR = SCRIPT_DIR / 'diffbir_engine'
 sys.path.insert(0, str(DIFFBIR_DIR))
 
+from raw_transport import HEADER as RAW_HEADER, raw_path, write_raw, read_header, map_raw
+from result_cache import ResultCache, make_key, file_fingerprint
+from metrics import MetricsRegistry
+import profiling
+from profiling import JobProfiler, sample_job
+from tile_planner import plan_tiles, apply_plan, describe as describe_tiles
+import gigapixel
+import roi as roi_crop
+from stage_cache import StageCache
+import weight_cache
+import cost_model
+
 # Global state
 _model_cache: Dict[str, Any] = {}
 _server_ready = False
-_server_stats = {"jobs_completed": 0, "jobs_failed": 0, "total_time": 0.0}
+_server_stats = {"jobs_completed": 0, "jobs_failed": 0, "jobs_cancelled": 0, "total_time": 0.0}
 _server_lock = threading.Lock()
-_loop_instance = None
+_stdout_lock = threading.Lock()
+_loop_instance = None  # the task state serving the current job (the base loop until a job runs)
+_base_loop = None
+
+# Prepared per-task states: each shares the base loop's diffusion weights and
+# holds its own cleaner/pipeline, set up once. Least recently used is dropped.
+TASK_POOL_SIZE = int(os.environ.get('ARMSCALER_TASK_POOL', '3'))
+# DiffBIR's task-specific loop classes (diffbir.inference), used when available
+TASK_LOOPS = {'sr': 'BSRInferenceLoop', 'face': 'BFRInferenceLoop', 'denoise': 'BIDInferenceLoop',
+              'unaligned_face': 'UnAlignedBFRInferenceLoop'}
+_task_states: "OrderedDict[str, Any]" = OrderedDict()
+_task_counters: Dict[str, Dict[str, Any]] = {}
+
+# Hand decoded images straight to the pipeline instead of via a temp PNG.
+# Verified once against load_lq(); falls back to the file path on mismatch.
+DIRECT_IO = os.environ.get('ARMSCALER_DIRECT_IO', '1') != '0'
+_direct_lq_ok: Dict[tuple, bool] = {}  # (task, upscale) -> load_lq returns the decoded image as-is
+
+# Finished outputs keyed by input hash + every output-affecting parameter
+_result_cache = ResultCache(
+    'armscaler',
+    max_disk_bytes=int(os.environ.get('ARMSCALER_CACHE_MB', '2048')) << 20,
+    enabled=os.environ.get('ARMSCALER_CACHE', '1') != '0')
+_model_id: Optional[str] = None
+
+# Cleaner outputs (and VAE condition latents) keyed by input pixels, task,
+# upscale and tiling, so re-running an image at another preset skips to sampling
+_stage_cache = StageCache(
+    max_bytes=int(os.environ.get('ARMSCALER_STAGE_CACHE_MB', '1024')) << 20,
+    enabled=os.environ.get('ARMSCALER_STAGE_CACHE', '1') != '0')
+STAGE_CACHE_CONDITION = os.environ.get('ARMSCALER_STAGE_CACHE_CONDITION', '1') != '0'
+
+# Past job timings on this host: predicted duration / ETA per job and the queue order
+_cost_model = cost_model.CostModel()
+_device_name: Optional[str] = None
+
+# Job queue: one worker thread owns the model, everything else only enqueues.
+# Queue entries only wake the worker; it takes the queued job that sorts first
+# by priority, then predicted duration with aging (cost_model.sjf_key).
+MAX_QUEUE = int(os.environ.get('ARMSCALER_MAX_QUEUE', '32'))
+JOB_TTL = float(os.environ.get('ARMSCALER_JOB_TTL', '3600'))
+_job_queue: "queue.PriorityQueue" = queue.PriorityQueue(maxsize=MAX_QUEUE)
+_job_seq = itertools.count()
+_jobs: Dict[str, Dict[str, Any]] = {}
+_jobs_lock = threading.Lock()
+_worker_thread: Optional[threading.Thread] = None
+
+# Micro-batching: same task/upscale/quality/size jobs share one sampling loop
+BATCH_WINDOW = float(os.environ.get('ARMSCALER_BATCH_WINDOW', '0.05'))
+MAX_BATCH = int(os.environ.get('ARMSCALER_MAX_BATCH', '4'))
+BATCH_MEMORY_FRACTION = 0.5
+# Rough per-sample working set with tiling on: fp32 image, cleaner output and latents at output size
+BATCH_BYTES_PER_OUTPUT_PIXEL = 64
+
+# Tiling: planned per sampling loop to fit this much memory (0 = a fraction of what's free)
+TILE_BUDGET = int(os.environ.get('ARMSCALER_TILE_BUDGET_MB', '0')) << 20
+TILE_MEMORY_FRACTION = 0.8
+
+# Gigapixel (out-of-core) jobs: input tiles in, raw RGB canvas on disk out.
+# Tile and overlap are in output pixels; the canvas defaults to this directory.
+GIGAPIXEL_DIR = os.environ.get('ARMSCALER_GIGAPIXEL_DIR', tempfile.gettempdir())
+GIGAPIXEL_TILE = int(os.environ.get('ARMSCALER_GIGAPIXEL_TILE', '2048'))
+GIGAPIXEL_OVERLAP = int(os.environ.get('ARMSCALER_GIGAPIXEL_OVERLAP', '256'))
+
+# Progressive `process`: a turbo run on a copy downscaled to this longest side
+# (input pixels), emitted as a partial response before the requested preset
+PREVIEW_MAX_SIDE = int(os.environ.get('ARMSCALER_PREVIEW_MAX_SIDE', '512'))
+PREVIEW_QUALITY = 'turbo'
+PREVIEW_PRIORITY_BOOST = 1000  # previews jump ahead of full-quality work
+
+# Metrics: stage latency histograms per task/upscale/quality, job counters,
+# queue and memory gauges; optionally written to a text exposition file
+METRICS_FILE = os.environ.get('ARMSCALER_METRICS_FILE')
+METRICS_INTERVAL = float(os.environ.get('ARMSCALER_METRICS_INTERVAL', '15'))
+_metrics = MetricsRegistry(prefix='armscaler_')
+_stage_local = threading.local()
+
+# Profiling: `profile: true` on process/submit, or every Nth job (0 = off)
+PROFILE_EVERY = int(os.environ.get('ARMSCALER_PROFILE_EVERY', '0'))
+
+# Resident (socket) mode
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), 'armscaler_server.sock')
+DEFAULT_IDLE_TIMEOUT = 600.0
+_last_activity = time.time()
+_active_connections = 0
+_shutdown_requested = threading.Event()
 
 def log(msg: str, level: str = "INFO"):
-    print(json.dumps({"level": level, "message": msg, "timestamp": time.time()}), flush=True)
+    emit({"level": level, "message": msg, "timestamp": time.time()})
+
+def emit(obj: Dict[str, Any]):
+    """Write one JSON line to stdout (log lines and responses share the stream)"""
+    line = json.dumps(obj)
+    with _stdout_lock:
+        print(line, flush=True)
 
 def set_random_seed(seed=None):
     """Set random seed for reproducibility"""
@@ -81,14 +195,15 @@ QUALITY_PRESETS = {
 
 def load_models():
     """Lazy load DiffBIR models"""
-    global _loop_instance, _server_ready
+    global _loop_instance, _base_loop, _server_ready
     
     if _loop_instance is not None:
         return True
     
     try:
         log("Importing DiffBIR modules...")
-        from diffbir.inference.loop import InferenceLoop
+        with _metrics.span('load_seconds', stage='import'):
+            from diffbir.inference.loop import InferenceLoop
         
         log("Loading models into GPU memory (this takes ~30-60s)...")
         start = time.time()
@@ -125,7 +240,7 @@ def load_models():
         args.num_samples = 1
         args.batch_size = 1
         args.show_lq = False
-        # Tiling
+        # Tiling (defaults; replaced per sampling loop by the tile planner)
         args.cleaner_tiled = True
         args.cleaner_tile_size = 512
         args.cleaner_tile_stride = 256
@@ -142,8 +257,13 @@ def load_models():
         args.neg_prompt = ''
         args.n_samples = 1
         
-        # Load inference loop (this loads all models)
-        _loop_instance = InferenceLoop(args)
+        # Load inference loop (this loads all models), checkpoints via the mapped weight cache
+        with _metrics.span('load_seconds', stage='models'), weight_cache.patched(_precision) as loads:
+            _base_loop = InferenceLoop(args)
+        _log_weight_loads(loads)
+        _instrument_pipeline(_base_loop)
+        _install_stage_cache(_base_loop)
+        _loop_instance = _base_loop
         
         load_time = time.time() - start
         log(f"Models loaded in {load_time:.1f}s")
@@ -156,175 +276,1322 @@ def load_models():
         log(traceback.format_exc(), "ERROR")
         return False
 
-def process_image(image_base64: str, task: str = 'sr', upscale: int = 4, quality: str = 'balanced') -> Dict[str, Any]:
-    """Process a single image"""
+def _log_weight_loads(loads):
+    for entry in loads:
+        log(f"Weights {entry['file']}: {entry['seconds']:.2f}s from {entry['source']} "
+            f"({entry['bytes'] / 1e6:.0f} MB, {entry['precision']})")
+        _metrics.observe('weight_load_seconds', entry['seconds'], file=entry['file'], source=entry['source'])
+
+def _decode_input(item: Dict[str, Any]) -> Image.Image:
+    """Input image from a raw pixel file, a local path or base64 (the compatibility mode)"""
+    if item.get('image_raw'):
+        width, height, channels, mm = map_raw(item['image_raw'])
+        pixels = np.frombuffer(mm, dtype=np.uint8, count=width * height * channels,
+                               offset=RAW_HEADER.size).reshape(height, width, channels)
+        image = Image.fromarray(np.array(pixels[:, :, :3]))  # one copy out of the mapping
+        del pixels
+        mm.close()
+        return image
+    if item.get('image_path'):
+        return Image.open(item['image_path']).convert('RGB')
+    image_data = base64.b64decode(item.get('image_base64', ''))
+    return Image.open(io.BytesIO(image_data)).convert('RGB')
+
+def _build_task_state(task: str):
+    """A loop for `task` that shares the base loop's models except the cleaner.
+
+    With DiffBIR's task loop classes, the state is that class wrapped around
+    the base loop's attributes (cldm, diffusion, captioner) with its own
+    cleaner and pipeline loaded; otherwise it is a shallow copy of the base.
+    """
+    loop_cls = None
+    try:
+        import diffbir.inference as inference_module
+        loop_cls = getattr(inference_module, TASK_LOOPS.get(task, ''), None)
+    except ImportError:
+        pass
+    if loop_cls is None or isinstance(_base_loop, loop_cls):
+        state = copy.copy(_base_loop)
+    else:
+        state = loop_cls.__new__(loop_cls)
+        state.__dict__.update(_base_loop.__dict__)
+        state.args.task = task
+        with weight_cache.patched(state.args.precision) as loads:
+            state.load_cleaner()
+            state.load_pipeline()
+        _log_weight_loads(loads)
+        _instrument_pipeline(state)
+        _install_stage_cache(state)
+    state.args.task = task
+    state.setup()
+    return state
+
+def _task_state(task: str):
+    """Prepared loop for `task`: a pool lookup when warm, built and set up once when cold"""
+    counters = _task_counters.setdefault(task, {'warm': 0, 'cold': 0, 'setup_seconds': 0.0})
+    state = _task_states.get(task)
+    if state is not None:
+        _task_states.move_to_end(task)
+        with _server_lock:
+            counters['warm'] += 1
+        _metrics.inc('task_setup_total', task=task, state='warm')
+        return state
+    start = time.time()
+    state = _build_task_state(task)
+    elapsed = time.time() - start
+    _task_states[task] = state
+    while len(_task_states) > max(1, TASK_POOL_SIZE):
+        evicted, _ = _task_states.popitem(last=False)
+        log(f"Task pool: dropped {evicted}")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    with _server_lock:
+        counters['cold'] += 1
+        counters['setup_seconds'] += elapsed
+    _metrics.inc('task_setup_total', task=task, state='cold')
+    log(f"Task pool: prepared {task} in {elapsed:.2f}s ({', '.join(_task_states)} resident)")
+    return state
+
+def _configure_loop(task: str, upscale: int, preset: Dict[str, Any]):
+    """Switch to this task's prepared loop and point it at the preset (no setup when warm)"""
+    global _loop_instance
+    _loop_instance = _task_state(task)
+    _loop_instance.args.task = task
+    _loop_instance.args.upscale = upscale
+    _loop_instance.args.steps = preset['steps']
+    _loop_instance.args.cfg_scale = preset['cfg_scale']
+    _loop_instance.args.sampler = preset['sampler']
+    pipeline = getattr(_loop_instance, 'pipeline', None)
+    if hasattr(pipeline, 'upscale'):
+        pipeline.upscale = upscale  # DiffBIR's SR pipelines bind upscale at construction
+
+def _task_pool_stats() -> Dict[str, Any]:
+    with _server_lock:
+        counters = {task: dict(c, setup_seconds=round(c['setup_seconds'], 3))
+                    for task, c in _task_counters.items()}
+    return {'resident': list(_task_states), 'size': TASK_POOL_SIZE, 'tasks': counters}
+
+def _load_lq(input_image: Image.Image) -> list:
+    """Low-quality inputs for one image.
+
+    load_lq() only reads files back from args.input, so the decoded image is
+    already what it would yield. The first job of each task/upscale checks
+    that assumption against the real loader (each task's loop has its own);
+    after that the temp-dir PNG round trip is skipped for that pair.
+    """
+    key = (_loop_instance.args.task, _loop_instance.args.upscale)
+    direct = _direct_lq_ok.get(key)
+    if not DIRECT_IO or direct is False:
+        return _load_lq_from_file(input_image)
+    if direct is None:
+        from_file = _load_lq_from_file(input_image)
+        direct = _direct_lq_ok[key] = (len(from_file) == 1 and
+                                       np.array_equal(np.asarray(from_file[0]), np.asarray(input_image)))
+        log(f"Direct in-memory input for {key[0]} x{key[1]}: "
+            f"{'enabled' if direct else 'disabled (load_lq transforms input)'}")
+        return from_file
+    return [input_image]
+
+def _load_lq_from_file(input_image: Image.Image) -> list:
+    """Run the loop's own loader on one image (it expects a file on disk)"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        input_path = tmp_path / 'input.png'
+        output_dir = tmp_path / 'output'
+        output_dir.mkdir()
+        input_image.save(input_path)
+        _loop_instance.args.input = str(input_path)
+        _loop_instance.args.output = str(output_dir)
+        return list(_loop_instance.load_lq())
+
+def _pos_prompt(lq) -> str:
+    caption = _loop_instance.captioner(lq)
+    return ", ".join([text for text in [caption, _loop_instance.args.pos_prompt] if text])
+
+def _run_pipeline(lq_batch: np.ndarray, pos_prompt: str, labels: Optional[Dict[str, Any]] = None) -> list:
+    """One sampling loop over an [N, H, W, 3] batch; returns N samples"""
+    args = _loop_instance.args
+    _stage_local.labels = labels  # read by the stage hooks from _instrument_pipeline
+    _stage_local.stage_keys = _stage_keys(lq_batch) if _stage_cache.enabled else None
+    try:
+        with torch.no_grad():
+            with torch.autocast(args.device, torch.float16 if args.precision == 'fp16' else torch.float32):
+                samples = _loop_instance.pipeline.run(
+                    lq_batch,
+                    args.steps,
+                    args.strength,
+                    args.cleaner_tiled,
+                    args.cleaner_tile_size,
+                    args.cleaner_tile_stride,
+                    args.vae_encoder_tiled,
+                    args.vae_encoder_tile_size,
+                    args.vae_decoder_tiled,
+                    args.vae_decoder_tile_size,
+                    args.cldm_tiled,
+                    args.cldm_tile_size,
+                    args.cldm_tile_stride,
+                    pos_prompt,
+                    args.neg_prompt,
+                    args.cfg_scale,
+                    args.start_point_type,
+                    args.sampler,
+                    0,  # noise_aug
+                    False,  # rescale_cfg
+                    0.0,  # s_churn
+                    0.0,  # s_tmin
+                    float('inf'),  # s_tmax
+                    1.0,  # s_noise
+                    0.0,  # eta
+                    1,  # order
+                )
+    finally:
+        _stage_local.labels = None
+        _stage_local.stage_keys = None
+    return [Image.fromarray(s) if isinstance(s, np.ndarray) else s for s in samples]
+
+def _encode_png(result_img: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    result_img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def _encode_result(result_img: Image.Image, job_id: str, output: str = 'base64',
+                   png: Optional[bytes] = None) -> Dict[str, Any]:
+    """Response fields carrying the output image"""
+    if output == 'raw':
+        # Uncompressed RGB in shared memory; the client reads and deletes it
+        pixels = np.asarray(result_img.convert('RGB'))
+        path = write_raw(raw_path(f"armscaler_{job_id}"), pixels.shape[1], pixels.shape[0],
+                         np.ascontiguousarray(pixels))
+        return {'image_raw': path, 'image_format': 'rgb8'}
+    if png is None:
+        png = _encode_png(result_img)
+    return {'image_base64': base64.b64encode(png).decode('utf-8')}
+
+# ── Metrics ──
+
+def _sync_device():
+    """Wait for queued GPU work so a stage's time is its own, not the next one's"""
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+def _timed_stage(fn, stage: str, exclusive: bool = False):
+    """Wrap a pipeline method so each call lands in stage_seconds{stage}.
+
+    Only active inside _run_pipeline (labels set). An exclusive stage reports
+    its time minus the hooked stages nested inside it.
+    """
+    def timed(*args, **kwargs):
+        labels = getattr(_stage_local, 'labels', None)
+        if labels is None:
+            return fn(*args, **kwargs)
+        outer = getattr(_stage_local, 'nested', 0.0)
+        _stage_local.nested = 0.0
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _sync_device()
+            elapsed = time.perf_counter() - start
+            own = elapsed - _stage_local.nested if exclusive else elapsed
+            _metrics.observe('stage_seconds', own, stage=stage, **labels)
+            timings = getattr(_stage_local, 'timings', None)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + own
+            _stage_local.nested = outer + elapsed
+    timed.timed_stage = stage
+    timed.__wrapped__ = fn  # keeps the real signature visible to _call_key
+    return timed
+
+def _instrument_pipeline(loop):
+    """Time the cleaner, sampler and VAE separately where the pipeline exposes them"""
+    pipeline = getattr(loop, 'pipeline', None)
+    cldm = getattr(pipeline, 'cldm', None)
+    hooked = []
+    for owner, attr, stage, exclusive in ((pipeline, 'apply_cleaner', 'cleaner', False),
+                                          (pipeline, 'apply_cldm', 'sampler', True),
+                                          (cldm, 'prepare_condition', 'vae_encode', False),
+                                          (cldm, 'vae_decode', 'vae_decode', False)):
+        fn = getattr(owner, attr, None) if owner is not None else None
+        if callable(fn):
+            if not hasattr(fn, 'timed_stage'):  # models shared between task states are hooked once
+                setattr(owner, attr, _timed_stage(fn, stage, exclusive))
+            hooked.append(stage)
+    log(f"Pipeline stage timing: {', '.join(hooked) if hooked else 'pipeline.run only'}")
+
+# ── Stage cache ──
+
+def _stage_keys(lq_batch: np.ndarray) -> Dict[str, str]:
+    """Input keys for this loop's cleaner output and condition (steps/cfg/sampler excluded)"""
+    args = _loop_instance.args
+    digest = hashlib.sha256(np.ascontiguousarray(lq_batch)).hexdigest()
+    cleaner = (f"{digest}|{lq_batch.shape}|{args.task}|{args.upscale}|"
+               f"{args.cleaner_tiled}:{args.cleaner_tile_size}:{args.cleaner_tile_stride}")
+    return {'cleaner': cleaner, 'condition': cleaner}
+
+def _call_key(fn, args, kwargs) -> Optional[str]:
+    """The call's own arguments after the image (prompt, tiling), or None if they can't be keyed.
+
+    apply_cldm calls prepare_condition once per prompt (cond and uncond) on
+    the same image, so the prompt has to be part of the key.
+    """
+    try:
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+    except (TypeError, ValueError):
+        return None
+    bound.apply_defaults()
+    rest = list(bound.arguments.items())[1:]
+    if any(isinstance(v, (torch.Tensor, np.ndarray)) for _, v in rest):
+        return None
+    return repr(rest)
+
+def _cached_stage(fn, kind: str, by_call: bool = False):
+    """Wrap a pipeline method so a repeat call for the same input returns the stored output.
+
+    `by_call` adds the call's non-image arguments to the key.
+    """
+    def cached(*args, **kwargs):
+        keys = getattr(_stage_local, 'stage_keys', None)
+        key = keys.get(kind) if keys else None
+        if key is not None and by_call:
+            call = _call_key(fn, args, kwargs)
+            key = f"{key}|{call}" if call is not None else None
+        if key is None:
+            return fn(*args, **kwargs)
+        value = _stage_cache.get(kind, key)
+        if value is None:
+            value = fn(*args, **kwargs)
+            _stage_cache.put(kind, key, value)
+        return value
+    cached.cached_stage = kind
+    if hasattr(fn, 'timed_stage'):
+        cached.timed_stage = fn.timed_stage  # already timed underneath; don't time it twice
+    return cached
+
+def _install_stage_cache(loop):
+    """Cache the cleaner (and condition encoder) where the pipeline exposes them"""
+    pipeline = getattr(loop, 'pipeline', None)
+    cldm = getattr(pipeline, 'cldm', None)
+    targets = [(pipeline, 'apply_cleaner', 'cleaner', False)]
+    if STAGE_CACHE_CONDITION:
+        targets.append((cldm, 'prepare_condition', 'condition', True))
+    for owner, attr, kind, by_call in targets:
+        fn = getattr(owner, attr, None) if owner is not None else None
+        if callable(fn) and not hasattr(fn, 'cached_stage'):
+            setattr(owner, attr, _cached_stage(fn, kind, by_call))
+
+def _peak_rss_bytes() -> int:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+_gpu_peak_seen = 0
+
+def _gpu_peak_bytes() -> Optional[int]:
+    if not torch.cuda.is_available():
+        return None
+    return max(_gpu_peak_seen, torch.cuda.max_memory_allocated())
+
+def _reset_gpu_peak() -> Optional[int]:
+    """Start a fresh peak window (keeping the lifetime peak); returns the current allocation"""
+    global _gpu_peak_seen
+    if not torch.cuda.is_available():
+        return None
+    _gpu_peak_seen = max(_gpu_peak_seen, torch.cuda.max_memory_allocated())
+    torch.cuda.reset_peak_memory_stats()
+    return torch.cuda.memory_allocated()
+
+def _job_counts() -> Dict[tuple, int]:
+    with _jobs_lock:
+        counts = {'queued': 0, 'running': 0}
+        for job in _jobs.values():
+            if job['status'] in counts:
+                counts[job['status']] += 1
+    return counts
+
+_metrics.histogram('stage_seconds', 'Time per processing stage by task/upscale/quality')
+_metrics.histogram('job_seconds', 'Processing time per job, queue wait excluded')
+_metrics.histogram('queue_wait_seconds', 'Time from submit until a worker picks the job up')
+_metrics.histogram('load_seconds', 'DiffBIR import and model load time')
+_metrics.histogram('weight_load_seconds', 'Per-checkpoint load time, from the weight cache or the checkpoint')
+_metrics.histogram('batch_size', 'Jobs per sampling loop', buckets=(1, 2, 3, 4, 6, 8, 16))
+_metrics.histogram('tile_estimate_ratio', 'Measured CUDA peak of a sampling loop over the tile plan estimate',
+                   buckets=(0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0, 4.0))
+_metrics.counter('jobs_total', 'Finished jobs by status')
+_metrics.counter('requests_total', 'Commands received by action')
+_metrics.counter('profiled_jobs_total', 'Jobs run under the profiler')
+_metrics.counter('task_setup_total', 'Task state lookups: warm (pooled) or cold (built and set up)')
+_metrics.gauge('queue_depth', 'Jobs waiting for the worker', fn=lambda: _job_counts()['queued'])
+_metrics.gauge('jobs_running', 'Jobs on the worker', fn=lambda: _job_counts()['running'])
+_metrics.gauge('models_loaded', 'DiffBIR models resident', fn=lambda: int(_loop_instance is not None))
+_metrics.gauge('peak_rss_bytes', 'Peak resident memory of the server process', fn=_peak_rss_bytes)
+_metrics.gauge('gpu_peak_allocated_bytes', 'Peak CUDA memory allocated by torch', fn=_gpu_peak_bytes)
+
+METRIC_ACTIONS = {'status', 'process', 'submit', 'cancel', 'result', 'metrics', 'ping', 'shutdown'}
+
+def _write_metrics(path: str):
+    try:
+        _metrics.write_exposition(path)
+    except OSError as e:
+        log(f"Cannot write metrics to {path}: {e}", "WARNING")
+
+def _metrics_writer(path: str, interval: float):
+    """Rewrite the exposition file every `interval` seconds"""
+    _write_metrics(path)
+    while not _shutdown_requested.wait(interval):
+        _write_metrics(path)
+
+# ── Tiling ──
+
+def _tile_budget() -> int:
+    """Bytes a sampling loop may use on top of the resident models"""
+    if TILE_BUDGET:
+        return TILE_BUDGET
+    free = _available_memory()
+    if torch.cuda.is_available():
+        free += torch.cuda.memory_reserved() - torch.cuda.memory_allocated()  # cached by torch, reusable
+    return int(free * TILE_MEMORY_FRACTION)
+
+def _plan_tiles(members: list, upscale: int) -> Dict[str, Any]:
+    """Pick tile sizes for one batch of same-shape inputs and apply them to the loop"""
+    lq_h, lq_w = members[0][1].shape[:2]
+    region = members[0][3]
+    input_size = region['size'] if region else members[0][2]
+    plan = plan_tiles((lq_w, lq_h), (input_size['w'] * upscale, input_size['h'] * upscale),
+                      _tile_budget(), _loop_instance.args.precision, len(members))
+    apply_plan(_loop_instance.args, plan)
+    ids = ', '.join(m[0]['job_id'] for m in members)
+    log(f"[{ids}] Tiles: {describe_tiles(plan)}")
+    return plan
+
+def _log_tile_peak(plan: Dict[str, Any], baseline: Optional[int]):
+    """Measured CUDA peak of the loop next to the plan's estimate"""
+    if baseline is None:
+        return
+    measured = torch.cuda.max_memory_allocated() - baseline
+    log(f"Tile plan check: measured peak {measured / 2**20:.0f}MB, estimated {plan['peak_bytes'] / 2**20:.0f}MB")
+    if plan['peak_bytes']:
+        _metrics.observe('tile_estimate_ratio', measured / plan['peak_bytes'])
+
+# ── Result cache ──
+
+def _model_fingerprint() -> str:
+    """Identity of the weights in use (names, sizes, mtimes)"""
+    global _model_id
+    if _model_id is None:
+        weights = sorted((DIFFBIR_DIR / 'weights').glob('*.pth'))
+        _model_id = 'v2|' + file_fingerprint(*weights)
+    return _model_id
+
+def _input_bytes(item: Dict[str, Any]) -> bytes:
+    if item.get('image_raw'):
+        return Path(item['image_raw']).read_bytes()
+    if item.get('image_path'):
+        return Path(item['image_path']).read_bytes()
+    return base64.b64decode(item.get('image_base64', ''))
+
+def _cache_key(item: Dict[str, Any], task: str, upscale: int, quality: str) -> Optional[str]:
+    """Key for this item's output, or None when caching is off for it"""
+    if not _result_cache.enabled or not item.get('cache', True):
+        return None
+    if not item.get('cache_key'):
+        preset = QUALITY_PRESETS.get(quality, QUALITY_PRESETS['balanced'])
+        region = {}
+        if item.get('roi'):
+            region = {'roi': list(roi_crop.parse_roi(item['roi'])),
+                      'roi_margin': int(item.get('roi_margin', roi_crop.DEFAULT_MARGIN)),
+                      'roi_output': item.get('roi_output', 'full')}
+        item['cache_key'] = make_key(
+            _input_bytes(item), task=task, upscale=int(upscale), steps=preset['steps'],
+            cfg_scale=preset['cfg_scale'], sampler=preset['sampler'], seed=None,
+            model=_model_fingerprint(), **region)
+    return item['cache_key']
+
+def _cached_response(item: Dict[str, Any], task: str, upscale: int, quality: str) -> Optional[Dict[str, Any]]:
+    """Full response served from the cache, or None on a miss"""
+    start_time = time.time()
+    try:
+        key = _cache_key(item, task, upscale, quality)
+    except (OSError, ValueError):
+        return None  # unreadable input: let the normal path report it
+    data = _result_cache.get(key) if key else None
+    if data is None:
+        return None
+    
+    result_img = Image.open(io.BytesIO(data))
+    out_w, out_h = result_img.size
+    if item.get('output') == 'raw':
+        encoded = _encode_result(result_img.convert('RGB'), item['job_id'], 'raw')
+    else:
+        encoded = {'image_base64': base64.b64encode(data).decode('utf-8')}
+    input_size = _probe_size(item)
+    log(f"[{item['job_id']}] Cache hit: {out_w}x{out_h}")
+    extra = {'roi': dict(zip('xywh', roi_crop.parse_roi(item['roi'])))} if item.get('roi') else {}
+    return {
+        **extra,
+        'success': True,
+        **encoded,
+        'input_size': {'w': input_size[0], 'h': input_size[1]} if input_size else None,
+        'output_size': {'w': out_w, 'h': out_h},
+        'processing_time': round(time.time() - start_time, 3),
+        'inference_time': 0.0,
+        'cached': True,
+        'job_id': item['job_id']
+    }
+
+def _roi_region(item: Dict[str, Any], image: Image.Image) -> Optional[Dict[str, Any]]:
+    """Crop context for an item with a `roi`, or None to process the whole frame"""
+    if not item.get('roi'):
+        return None
+    roi = roi_crop.parse_roi(item['roi'])
+    margin = int(item.get('roi_margin', roi_crop.DEFAULT_MARGIN))
+    box = roi_crop.context_box(roi, image.size, margin)
+    return {'roi': roi, 'box': box, 'image': image, 'output': item.get('roi_output', 'full'),
+            'size': {'w': box[2] - box[0], 'h': box[3] - box[1]}}
+
+# ── Cost model ──
+
+def _device() -> str:
+    """Cost model device: the GPU's name, or cpu:<threads>"""
+    global _device_name
+    if _device_name is None:
+        _device_name = (torch.cuda.get_device_name(0) if torch.cuda.is_available()
+                        else f"cpu:{torch.get_num_threads()}")
+    return _device_name
+
+def _restored_size(params: Dict[str, Any], size: Optional[tuple]) -> Optional[tuple]:
+    """(w, h) of what goes through DiffBIR: the ROI plus its margin, else the whole input"""
+    if params.get('roi') and size:
+        try:
+            box = roi_crop.context_box(roi_crop.parse_roi(params['roi']), size,
+                                       int(params.get('roi_margin', roi_crop.DEFAULT_MARGIN)))
+            return box[2] - box[0], box[3] - box[1]
+        except (ValueError, TypeError):
+            pass
+    return size
+
+def _predict(params: Dict[str, Any], size: Optional[tuple]) -> float:
+    return _cost_model.predict(_device(), 'server', params['task'], params['upscale'], params['quality'],
+                               _restored_size(params, size))
+
+def _record_timings(members: list, plan: Dict[str, Any], timings: Dict[str, float], inference_time: float,
+                    task: str, upscale: int, quality: str, preset: Dict[str, Any]):
+    """One timing record per job of a finished sampling loop (the loop's time split evenly)"""
+    tiles = {stage: entry['tiles'] if entry['tiled'] else 0 for stage, entry in plan['stages'].items()}
+    stages = {stage: round(seconds / len(members), 3) for stage, seconds in timings.items()}
+    for _, _, input_size, region in members:
+        size = region['size'] if region else input_size
+        _cost_model.record(_device(), 'server', task, upscale, quality, (size['w'], size['h']),
+                           inference_time / len(members), steps=preset['steps'], batch=len(members),
+                           tiles=tiles, stages=stages)
+
+def process_image(image_base64: str = '', task: str = 'sr', upscale: int = 4, quality: str = 'balanced',
+                  job_id: Optional[str] = None, image_path: Optional[str] = None,
+                  image_raw: Optional[str] = None, output: str = 'base64', roi=None,
+                  roi_margin: int = roi_crop.DEFAULT_MARGIN, roi_output: str = 'full') -> Dict[str, Any]:
+    """Process a single image (or only its `roi` rectangle, x/y/w/h in input pixels)"""
+    job_id = job_id or f"job_{int(time.time() * 1000)}"
+    item = {'job_id': job_id, 'image_base64': image_base64, 'image_path': image_path,
+            'image_raw': image_raw, 'output': output, 'roi': roi, 'roi_margin': roi_margin,
+            'roi_output': roi_output}
+    return process_batch([item], task, upscale, quality)[0]
+
+def process_batch(items: list, task: str = 'sr', upscale: int = 4, quality: str = 'balanced',
+                  record: bool = False) -> list:
+    """Process several images that share task/upscale/quality.
+
+    Inputs whose low-quality tensors have the same shape (and prompt) go
+    through one batched pipeline.run; each item gets its own response.
+    Items carry job_id, one of image_base64/image_path/image_raw and output.
+    With `record`, each sampling loop's timings go into the cost model.
+    """
     global _server_stats
     
     start_time = time.time()
-    job_id = f"job_{int(start_time * 1000)}"
+    ids = ', '.join(item['job_id'] for item in items)
+    log(f"[{ids}] Starting {task} | {upscale}x | {quality}")
     
-    log(f"[{job_id}] Starting {task} | {upscale}x | {quality}")
+    responses: Dict[str, Dict[str, Any]] = {}
+    
+    def fail(job_id, error):
+        with _server_lock:
+            _server_stats["jobs_failed"] += 1
+        log(f"[{job_id}] Error: {error}", "ERROR")
+        responses[job_id] = {'success': False, 'error': str(error), 'job_id': job_id}
+    
+    # Serve repeats from the cache before touching the model
+    labels = {'task': task, 'upscale': upscale, 'quality': quality}
+    pending = []
+    for item in items:
+        with _metrics.span('stage_seconds', stage='cache_lookup', **labels):
+            hit = _cached_response(item, task, upscale, quality)
+        if hit is not None:
+            responses[item['job_id']] = hit
+        else:
+            pending.append(item)
+    if not pending:
+        return [responses[item['job_id']] for item in items]
     
     try:
         # Load models if needed
         if not load_models():
-            return {'success': False, 'error': 'Failed to load models', 'job_id': job_id}
-        
-        # Decode image
-        image_data = base64.b64decode(image_base64)
-        input_image = Image.open(io.BytesIO(image_data)).convert('RGB')
-        orig_w, orig_h = input_image.size
+            return [responses.get(item['job_id']) or
+                    {'success': False, 'error': 'Failed to load models', 'job_id': item['job_id']}
+                    for item in items]
         
         # Get quality preset
         preset = QUALITY_PRESETS.get(quality, QUALITY_PRESETS['balanced'])
+        with _metrics.span('stage_seconds', stage='setup', **labels):
+            _configure_loop(task, upscale, preset)
         
-        # Update loop args for this run
-        _loop_instance.args.task = task
-        _loop_instance.args.upscale = upscale
-        _loop_instance.args.steps = preset['steps']
-        _loop_instance.args.cfg_scale = preset['cfg_scale']
-        _loop_instance.args.sampler = preset['sampler']
-        
-        log(f"[{job_id}] Processing {orig_w}x{orig_h}...")
-        inference_start = time.time()
+        # Decode and load every input; group by (lq shape, prompt)
+        groups: Dict[tuple, list] = {}
+        for item in pending:
+            job_id = item['job_id']
+            try:
+                with _metrics.span('stage_seconds', stage='decode', **labels):
+                    input_image = _decode_input(item)
+                orig_w, orig_h = input_image.size
+                region = _roi_region(item, input_image)
+                if region:
+                    x0, y0, x1, y1 = region['box']
+                    log(f"[{job_id}] Processing ROI {x1 - x0}x{y1 - y0} at ({x0}, {y0}) of {orig_w}x{orig_h}...")
+                else:
+                    log(f"[{job_id}] Processing {orig_w}x{orig_h}...")
+                with _metrics.span('stage_seconds', stage='load_lq', **labels):
+                    lq = _load_lq(input_image.crop(region['box']) if region else input_image)[0]
+                    lq_array = np.array(lq)
+                with _metrics.span('stage_seconds', stage='caption', **labels):
+                    prompt = _pos_prompt(lq)
+                groups.setdefault((lq_array.shape, prompt), []).append(
+                    (item, lq_array, {'w': orig_w, 'h': orig_h}, region))
+            except Exception as e:
+                fail(job_id, e)
         
-        # Create temp directories
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            tmp_path = Path(tmp_dir)
-            input_path = tmp_path / 'input.png'
-            output_dir = tmp_path / 'output'
-            output_dir.mkdir()
-            
-            # Save input
-            input_image.save(input_path)
-            
-            # Set args
-            _loop_instance.args.input = str(input_path)
-            _loop_instance.args.output = str(output_dir)
-            
-            # Run inference
-            set_random_seed(None)
-            
-            _loop_instance.setup()
-            results = []
-            for lq in _loop_instance.load_lq():
-                caption = _loop_instance.captioner(lq)
-                pos_prompt = ", ".join([text for text in [caption, _loop_instance.args.pos_prompt] if text])
-                
-                lq_array = np.array(lq)
-                n_samples = _loop_instance.args.n_samples
-                batch_size = _loop_instance.args.batch_size
-                num_batches = (n_samples + batch_size - 1) // batch_size
-                
-                for i in range(num_batches):
-                    n_inputs = min((i + 1) * batch_size, n_samples) - i * batch_size
-                    with torch.no_grad():
-                        with torch.autocast(_loop_instance.args.device, torch.float16 if _loop_instance.args.precision == 'fp16' else torch.float32):
-                            batch_samples = _loop_instance.pipeline.run(
-                                np.tile(lq_array[None], (n_inputs, 1, 1, 1)),
-                                _loop_instance.args.steps,
-                                _loop_instance.args.strength,
-                                _loop_instance.args.cleaner_tiled,
-                                _loop_instance.args.cleaner_tile_size,
-                                _loop_instance.args.cleaner_tile_stride,
-                                _loop_instance.args.vae_encoder_tiled,
-                                _loop_instance.args.vae_encoder_tile_size,
-                                _loop_instance.args.vae_decoder_tiled,
-                                _loop_instance.args.vae_decoder_tile_size,
-                                _loop_instance.args.cldm_tiled,
-                                _loop_instance.args.cldm_tile_size,
-                                _loop_instance.args.cldm_tile_stride,
-                                pos_prompt,
-                                _loop_instance.args.neg_prompt,
-                                _loop_instance.args.cfg_scale,
-                                _loop_instance.args.start_point_type,
-                                _loop_instance.args.sampler,
-                                0,  # noise_aug
-                                False,  # rescale_cfg
-                                0.0,  # s_churn
-                                0.0,  # s_tmin
-                                float('inf'),  # s_tmax
-                                1.0,  # s_noise
-                                0.0,  # eta
-                                1,  # order
-                            )
-                    results.extend(batch_samples)
-            
+        # Run inference, one sampling loop per group
+        set_random_seed(None)
+        for (_, prompt), members in groups.items():
+            inference_start = time.time()
+            _metrics.observe('batch_size', len(members), **labels)
+            _stage_local.timings = {}
+            try:
+                plan = _plan_tiles(members, upscale)
+                baseline = _reset_gpu_peak()
+                with _metrics.span('stage_seconds', stage='pipeline', **labels):
+                    pipeline_start = time.perf_counter()
+                    samples = _run_pipeline(np.stack([m[1] for m in members]), prompt, labels)
+                    _sync_device()
+                    _stage_local.timings['pipeline'] = time.perf_counter() - pipeline_start
+                _log_tile_peak(plan, baseline)
+                if len(samples) != len(members):
+                    raise RuntimeError(f"Expected {len(members)} outputs, got {len(samples)}")
+            except Exception as e:
+                import traceback
+                log(traceback.format_exc(), "ERROR")
+                for member in members:
+                    fail(member[0]['job_id'], e)
+                continue
+            finally:
+                timings, _stage_local.timings = _stage_local.timings, None
             inference_time = time.time() - inference_start
+            if record:
+                _record_timings(members, plan, timings, inference_time, task, upscale, quality, preset)
             
-            # Save and encode result
-            if results:
-                result_img = results[0]
-                buffer = io.BytesIO()
-                result_img.save(buffer, format='PNG')
-                output_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            # Save and encode each result
+            for (item, _, input_size, region), result_img in zip(members, samples):
+                job_id = item['job_id']
+                output = item.get('output', 'base64')
+                try:
+                    if region:
+                        with _metrics.span('stage_seconds', stage='roi_compose', **labels):
+                            result_img = roi_crop.compose(region['image'], result_img, region['roi'],
+                                                          region['box'], upscale, region['output'])
+                    cache_key = _cache_key(item, task, upscale, quality)
+                    png = None
+                    if cache_key or output != 'raw':
+                        with _metrics.span('stage_seconds', stage='png_encode', **labels):
+                            png = _encode_png(result_img)
+                    with _metrics.span('stage_seconds', stage=f'{output}_encode', **labels):
+                        encoded = _encode_result(result_img, job_id, output, png)
+                    if cache_key:
+                        with _metrics.span('stage_seconds', stage='cache_store', **labels):
+                            _result_cache.put(cache_key, png)
+                except Exception as e:
+                    fail(job_id, e)
+                    continue
                 out_w, out_h = result_img.size
-            else:
-                raise RuntimeError("No output produced")
+                total_time = time.time() - start_time
+                
+                with _server_lock:
+                    _server_stats["jobs_completed"] += 1
+                    _server_stats["total_time"] += total_time
+                _metrics.observe('job_seconds', total_time, **labels)
+                
+                log(f"[{job_id}] Done: {out_w}x{out_h} in {total_time:.2f}s (batch of {len(members)})")
+                
+                responses[job_id] = {
+                    'success': True,
+                    **encoded,
+                    'input_size': input_size,
+                    'output_size': {'w': out_w, 'h': out_h},
+                    'processing_time': round(total_time, 2),
+                    'inference_time': round(inference_time, 2),
+                    'batch_size': len(members),
+                    'job_id': job_id
+                }
+                if region:
+                    responses[job_id]['roi'] = dict(zip('xywh', region['roi']))
         
+    except Exception as e:
+        import traceback
+        log(traceback.format_exc(), "ERROR")
+        for item in items:
+            if item['job_id'] not in responses:
+                fail(item['job_id'], e)
+    
+    for item in items:
+        if item['job_id'] not in responses:
+            fail(item['job_id'], "No output produced")
+    return [responses[item['job_id']] for item in items]
+
+def process_gigapixel(items: list, task: str = 'sr', upscale: int = 4, quality: str = 'balanced') -> list:
+    """Out-of-core processing: stream input tiles into a memory-mapped raw RGB canvas.
+
+    Each item's result is the canvas file (image_raw, in GIGAPIXEL_DIR or at
+    its output_path), so peak memory is a few tiles however large the image.
+    """
+    responses = []
+    for item in items:
+        job_id = item['job_id']
+        start_time = time.time()
+        labels = {'task': task, 'upscale': upscale, 'quality': quality}
+        source, cleanup, canvas = None, lambda: None, None
+        try:
+            if not load_models():
+                raise RuntimeError('Failed to load models')
+            with _metrics.span('stage_seconds', stage='setup', **labels):
+                _configure_loop(task, upscale, QUALITY_PRESETS.get(quality, QUALITY_PRESETS['balanced']))
+            with _metrics.span('stage_seconds', stage='decode', **labels):
+                source, cleanup = gigapixel.open_source(item, GIGAPIXEL_DIR)
+            in_h, in_w = source.shape[:2]
+            path = item.get('output_path') or os.path.join(GIGAPIXEL_DIR, f"armscaler_{job_id}.rgb")
+            canvas = gigapixel.RawCanvas(path, in_w * upscale, in_h * upscale)
+            tile = max(64, GIGAPIXEL_TILE // upscale // 8 * 8)
+            overlap = min(tile // 2, GIGAPIXEL_OVERLAP // upscale // 8 * 8)
+            log(f"[{job_id}] Gigapixel {in_w}x{in_h} -> {canvas.width}x{canvas.height}, "
+                f"tiles {tile}px (overlap {overlap}) into {path}")
+
+            def run_tile(pixels):
+                lq = np.array(_load_lq(Image.fromarray(pixels))[0])
+                member = (item, lq, {'w': pixels.shape[1], 'h': pixels.shape[0]}, None)
+                plan = _plan_tiles([member], upscale)
+                baseline = _reset_gpu_peak()
+                with _metrics.span('stage_seconds', stage='pipeline', **labels):
+                    sample = _run_pipeline(lq[None], _pos_prompt(lq), labels)[0]
+                    _sync_device()
+                _log_tile_peak(plan, baseline)
+                return np.asarray(sample.convert('RGB'))
+
+            inference_start = time.time()
+            tiles = gigapixel.upscale_tiled(source, canvas, upscale, tile, overlap, run_tile, log)
+            inference_time = time.time() - inference_start
+            canvas.close()
+        except Exception as e:
+            import traceback
+            log(traceback.format_exc(), "ERROR")
+            with _server_lock:
+                _server_stats["jobs_failed"] += 1
+            if canvas is not None:
+                canvas.close()
+                _remove_quietly(canvas.path)
+            responses.append({'success': False, 'error': str(e), 'job_id': job_id})
+            continue
+        finally:
+            source = None
+            cleanup()
         total_time = time.time() - start_time
-        
         with _server_lock:
             _server_stats["jobs_completed"] += 1
             _server_stats["total_time"] += total_time
-        
-        log(f"[{job_id}] Done: {out_w}x{out_h} in {total_time:.2f}s")
-        
-        return {
+        _metrics.observe('job_seconds', total_time, **labels)
+        log(f"[{job_id}] Done: {canvas.width}x{canvas.height} in {total_time:.2f}s ({tiles} tiles)")
+        responses.append({
             'success': True,
-            'image_base64': output_base64,
-            'input_size': {'w': orig_w, 'h': orig_h},
-            'output_size': {'w': out_w, 'h': out_h},
+            'image_raw': canvas.path,
+            'image_format': 'rgb8',
+            'gigapixel': True,
+            'tiles': tiles,
+            'input_size': {'w': in_w, 'h': in_h},
+            'output_size': {'w': canvas.width, 'h': canvas.height},
             'processing_time': round(total_time, 2),
             'inference_time': round(inference_time, 2),
             'job_id': job_id
-        }
-        
-    except Exception as e:
+        })
+    return responses
+
+# ── Job queue ──
+
+# Per-image fields passed through to process_batch (task/upscale/quality are per batch)
+ITEM_PARAMS = ('image_base64', 'image_path', 'image_raw', 'output', 'cache', 'cache_key', 'output_path',
+               'roi', 'roi_margin', 'roi_output')
+
+def _probe_size(params: Dict[str, Any]) -> Optional[tuple]:
+    """Image (w, h) from the header only; None if it can't be read"""
+    try:
+        if params.get('image_raw'):
+            return read_header(params['image_raw'])[:2]
+        if params.get('image_path'):
+            return Image.open(params['image_path']).size
+        return Image.open(io.BytesIO(base64.b64decode(params['image_base64']))).size
+    except Exception:
+        return None
+
+def _available_memory() -> int:
+    """Free bytes on the inference device"""
+    if torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info()
+        return free
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def _batch_key(job: Dict[str, Any]) -> tuple:
+    params = job['params']
+    return (params['task'], params['upscale'], params['quality'], job['input_size'], params['profile'],
+            params['gigapixel'])
+
+def _max_batch_size(job: Dict[str, Any]) -> int:
+    """How many jobs like this one fit in memory at once (1 = no batching)"""
+    if MAX_BATCH <= 1 or job['input_size'] is None or _loop_instance is None:
+        return 1
+    if job['params']['profile'] or job['params']['gigapixel']:
+        return 1  # a profile covers exactly one job; gigapixel jobs stream their own tiles
+    w, h = job['input_size']
+    upscale = job['params']['upscale']
+    per_sample = w * upscale * h * upscale * BATCH_BYTES_PER_OUTPUT_PIXEL
+    budget = _available_memory() * BATCH_MEMORY_FRACTION
+    return max(1, min(MAX_BATCH, int(budget // per_sample)))
+
+def _claim_batch(first: Dict[str, Any]) -> list:
+    """Collect queued jobs compatible with `first` for up to BATCH_WINDOW seconds"""
+    limit = _max_batch_size(first)
+    batch = [first]
+    if limit <= 1:
+        return batch
+    key = _batch_key(first)
+    deadline = time.time() + BATCH_WINDOW
+    while True:
+        with _jobs_lock:
+            # Same SJF order as the queue, so a batch doesn't pull long jobs ahead of short ones
+            candidates = [job for job in _queue_order() if _batch_key(job) == key]
+            for job in candidates[:limit - len(batch)]:
+                job['status'] = 'running'
+                job['started'] = time.time()
+                batch.append(job)
+        if len(batch) >= limit or time.time() >= deadline:
+            return batch
+        time.sleep(0.005)
+
+def _job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a job (no image data, no result payload; caller holds _jobs_lock)"""
+    summary = {k: job[k] for k in ('job_id', 'status', 'priority', 'created', 'started', 'finished')}
+    summary.update({k: job['params'][k] for k in ('task', 'upscale', 'quality')})
+    summary['predicted_seconds'] = round(job['predicted'], 1)
+    if job['status'] == 'queued':
+        order = _queue_order()
+        summary['position'] = order.index(job) if job in order else -1
+        summary['eta_seconds'] = round(_eta(job, order), 1)
+    elif job['status'] == 'running':
+        elapsed = time.time() - job['started']
+        summary['eta_seconds'] = round(max(0.0, job['predicted'] - elapsed), 1)
+        summary['progress'] = round(min(0.99, elapsed / max(job['predicted'], 1e-3)), 3)
+    if job.get('error'):
+        summary['error'] = job['error']
+    return summary
+
+def _queue_order() -> list:
+    """Queued jobs in the order the worker will take them (caller holds _jobs_lock)"""
+    now = time.time()
+    queued = [job for job in _jobs.values() if job['status'] == 'queued']
+    return sorted(queued, key=lambda job: cost_model.sjf_key(job['priority'], job['predicted'], job['created'], now))
+
+def _eta(job: Dict[str, Any], order: list) -> float:
+    """Seconds until a queued job is done: what's left of running work, the jobs ahead, then its own"""
+    now = time.time()
+    running = sum(max(0.0, j['predicted'] - (now - j['started'])) for j in _jobs.values() if j['status'] == 'running')
+    ahead = order[:order.index(job)] if job in order else order
+    return running + sum(j['predicted'] for j in ahead) + job['predicted']
+
+def _reap_jobs():
+    """Forget finished jobs older than JOB_TTL"""
+    cutoff = time.time() - JOB_TTL
+    with _jobs_lock:
+        expired = [job_id for job_id, job in _jobs.items()
+                   if job['finished'] is not None and job['finished'] < cutoff]
+        for job_id in expired:
+            del _jobs[job_id]
+
+def submit_job(cmd: Dict[str, Any]) -> Dict[str, Any]:
+    """Queue a job; higher priority runs first, then the shortest predicted job (with aging)"""
+    _reap_jobs()
+    params = {
+        'image_base64': cmd.get('image_base64', ''),
+        'image_path': cmd.get('image_path'),
+        'image_raw': cmd.get('image_raw'),
+        'output': cmd.get('output', 'base64'),
+        'cache': bool(cmd.get('cache', True)),
+        'cache_key': None,
+        'task': cmd.get('task', 'sr'),
+        'upscale': int(cmd.get('upscale', 4)),
+        'quality': cmd.get('quality', 'balanced'),
+        'profile': bool(cmd.get('profile')),
+        'gigapixel': bool(cmd.get('gigapixel')),
+        'output_path': cmd.get('output_path'),
+        'roi': cmd.get('roi'),
+        'roi_margin': cmd.get('roi_margin', roi_crop.DEFAULT_MARGIN),
+        'roi_output': cmd.get('roi_output', 'full'),
+    }
+    if params['profile'] or params['gigapixel']:
+        params['cache'] = False  # profile the real work, not a cache hit; never hold a gigapixel PNG
+    job_id = cmd.get('job_id') or f"job_{int(time.time() * 1000)}_{next(_job_seq)}"
+    priority = int(cmd.get('priority', 0))
+    input_size = _probe_size(params)
+    job = {
+        'job_id': job_id,
+        'status': 'queued',
+        'priority': priority,
+        'params': params,
+        'input_size': input_size,
+        'predicted': _predict(params, input_size),
+        'created': time.time(),
+        'started': None,
+        'finished': None,
+        'result': None,
+        'error': None,
+        'cancel_requested': False,
+        'done': threading.Event(),
+    }
+    with _jobs_lock:
+        if job_id in _jobs:
+            return {'success': False, 'error': f'Duplicate job_id: {job_id}', 'job_id': job_id}
+        _jobs[job_id] = job
+    
+    # Cache hits are answered here, without waiting behind queued work
+    item = dict(params, job_id=job_id)
+    hit = _cached_response(item, params['task'], params['upscale'], params['quality'])
+    params['cache_key'] = item.get('cache_key')  # hashed once, reused by the worker
+    if hit is not None:
+        with _jobs_lock:
+            job['started'] = time.time()
+            _finish_job(job, 'done', hit)
+        return {'success': True, 'job_id': job_id, 'status': 'done', 'position': -1, 'cached': True}
+    
+    if not params['profile'] and sample_job(PROFILE_EVERY):
+        params['profile'] = True
+    
+    try:
+        _job_queue.put_nowait((-priority, next(_job_seq), job_id))
+    except queue.Full:
+        with _jobs_lock:
+            del _jobs[job_id]
+        return {'success': False, 'error': f'Queue full ({MAX_QUEUE} jobs)', 'job_id': job_id}
+    _ensure_worker()
+    with _jobs_lock:
+        summary = _job_summary(job)
+    return {'success': True, 'job_id': job_id, 'status': summary['status'], 'position': summary.get('position', -1),
+            'predicted_seconds': summary['predicted_seconds'], 'eta_seconds': summary.get('eta_seconds')}
+
+def get_job(job_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def cancel_job(job_id: Optional[str]) -> Dict[str, Any]:
+    """Cancel a queued job; a running job finishes but its result is dropped"""
+    job = get_job(job_id)
+    if job is None:
+        return {'success': False, 'error': f'Unknown job: {job_id}', 'job_id': job_id}
+    with _jobs_lock:
+        if job['status'] == 'queued':
+            _finish_job(job, 'cancelled')
+        elif job['status'] == 'running':
+            job['cancel_requested'] = True
+        else:
+            return {'success': False, 'error': f"Job already {job['status']}", 'job_id': job_id}
+    return {'success': True, 'job_id': job_id, 'status': job['status'],
+            'cancel_requested': job['cancel_requested']}
+
+def job_result(job_id: Optional[str], wait: float = 0) -> Dict[str, Any]:
+    """Result of a finished job, optionally waiting up to `wait` seconds.
+
+    A delivered result is handed over, not kept: the job is forgotten, so
+    finished outputs don't sit in memory until JOB_TTL.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return {'success': False, 'error': f'Unknown job: {job_id}', 'job_id': job_id}
+    if wait:
+        job['done'].wait(float(wait))
+    with _jobs_lock:
+        if job['result'] is not None:
+            _jobs.pop(job_id, None)
+            return job['result']
+        summary = _job_summary(job)
+    summary['success'] = False
+    summary.setdefault('error', f"Job {summary['status']}")
+    return summary
+
+def _finish_job(job: Dict[str, Any], status: str, result: Optional[Dict[str, Any]] = None):
+    """Mark a job finished (caller holds _jobs_lock)"""
+    job['status'] = status
+    job['finished'] = time.time()
+    job['result'] = result
+    if result is not None and not result.get('success'):
+        job['error'] = result.get('error')
+    job['params']['image_base64'] = ''  # drop the input as soon as we're done with it
+    _metrics.inc('jobs_total', status=status, cached=str(bool(result and result.get('cached'))).lower())
+    if status == 'cancelled':
         with _server_lock:
-            _server_stats["jobs_failed"] += 1
-        log(f"[{job_id}] Error: {str(e)}", "ERROR")
-        import traceback
-        log(traceback.format_exc(), "ERROR")
-        return {
-            'success': False,
-            'error': str(e),
-            'job_id': job_id
-        }
+            _server_stats['jobs_cancelled'] += 1
+    job['done'].set()
+
+def _worker_loop():
+    """Single inference worker: the only thread that touches the model.
 
-def handle_command(cmd: Dict[str, Any]) -> Dict[str, Any]:
-    """Handle incoming commands"""
+    Each queue entry wakes the worker for one job: the queued job that sorts
+    first in _queue_order(), not necessarily the entry's own. Entries left
+    behind by jobs already claimed find nothing queued and are skipped.
+    """
+    while not _shutdown_requested.is_set():
+        try:
+            _job_queue.get(timeout=1.0)
+        except queue.Empty:
+            _reap_jobs()
+            continue
+        
+        with _jobs_lock:
+            order = _queue_order()
+            if not order:
+                continue
+            job = order[0]
+            job_id = job['job_id']
+            job['status'] = 'running'
+            job['started'] = time.time()
+        
+        batch = _claim_batch(job)
+        for j in batch:
+            _metrics.observe('queue_wait_seconds', j['started'] - j['created'])
+        params = job['params']
+        profiler = JobProfiler(job_id, torch_trace=True, log=log) if params['profile'] else None
+        run = process_gigapixel if params['gigapixel'] else process_batch
+        # Profiled runs are slower than real ones; keep them out of the cost model
+        extra = {} if params['gigapixel'] else {'record': not params['profile']}
+        with profiler or contextlib.nullcontext():
+            results = run(
+                [dict({k: j['params'][k] for k in ITEM_PARAMS}, job_id=j['job_id']) for j in batch],
+                task=params['task'], upscale=params['upscale'], quality=params['quality'], **extra)
+        if profiler is not None:
+            results[0] = dict(results[0], profile=profiler.summary())
+            _metrics.inc('profiled_jobs_total')
+            log(f"[{job_id}] Profile: {', '.join(profiler.files.values())}")
+        
+        with _jobs_lock:
+            for j, result in zip(batch, results):
+                if j['cancel_requested']:
+                    if result.get('image_raw'):
+                        _remove_quietly(result['image_raw'])
+                    _finish_job(j, 'cancelled')
+                else:
+                    _finish_job(j, 'done' if result.get('success') else 'failed', result)
+
+def _remove_quietly(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def _ensure_worker():
+    global _worker_thread
+    with _server_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=_worker_loop, name='inference-worker', daemon=True)
+            _worker_thread.start()
+
+def _busy() -> bool:
+    """True while any job is queued or running"""
+    with _jobs_lock:
+        return any(job['status'] in ('queued', 'running') for job in _jobs.values())
+
+def _touch():
+    global _last_activity
+    _last_activity = time.time()
+
+def _preview_input(cmd: Dict[str, Any]) -> Dict[str, Any]:
+    """Input fields for the preview job: the image scaled down to PREVIEW_MAX_SIDE"""
+    image = _decode_input(cmd)
+    if max(image.size) > PREVIEW_MAX_SIDE:
+        scale = PREVIEW_MAX_SIDE / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             Image.BICUBIC)
+    return {'image_base64': base64.b64encode(_encode_png(image)).decode('utf-8')}
+
+def process_progressive(cmd: Dict[str, Any], send) -> Dict[str, Any]:
+    """`process` with a preview: send a partial turbo result first, return the full one.
+
+    Both lines carry the full job's job_id, so the client can cancel the
+    expensive pass as soon as it has seen the preview.
+    """
+    preview = None
+    size = _probe_size(cmd)
+    # Nothing to gain when the full run is already a turbo run on a small image
+    if cmd.get('quality', 'balanced') != PREVIEW_QUALITY or (size and max(size) > PREVIEW_MAX_SIDE):
+        try:
+            preview_cmd = {k: cmd[k] for k in ('task', 'upscale', 'output') if k in cmd}
+            preview_cmd.update(_preview_input(cmd), quality=PREVIEW_QUALITY,
+                               priority=int(cmd.get('priority', 0)) + PREVIEW_PRIORITY_BOOST)
+            preview = submit_job(preview_cmd)
+        except Exception as e:
+            log(f"Preview skipped: {e}", "WARNING")
+    submitted = submit_job(cmd)
+    if not submitted.get('success'):
+        if preview and preview.get('success'):
+            cancel_job(preview['job_id'])
+        return submitted
+    job_id = submitted['job_id']
+    if preview and preview.get('success'):
+        result = job_result(preview['job_id'], wait=cmd.get('timeout', 24 * 3600))
+        send(dict(result, job_id=job_id, preview_job_id=preview['job_id'], stage='preview', partial=True))
+    result = job_result(job_id, wait=cmd.get('timeout', 24 * 3600))
+    return dict(result, stage='final')
+
+def handle_command(cmd: Dict[str, Any], send=None) -> Dict[str, Any]:
+    """Handle incoming commands.
+
+    `send` writes an extra response line to the same client ahead of the
+    returned one (used for progressive previews).
+    """
     action = cmd.get('action')
     
     if action == 'status':
+        if cmd.get('job_id'):
+            job = get_job(cmd['job_id'])
+            if job is None:
+                return {'success': False, 'error': f"Unknown job: {cmd['job_id']}", 'job_id': cmd['job_id']}
+            with _jobs_lock:
+                return _job_summary(job)
+        _reap_jobs()
+        with _server_lock:
+            stats = dict(_server_stats)
+        with _jobs_lock:
+            stats['jobs'] = {job_id: _job_summary(job) for job_id, job in _jobs.items()}
+            stats['queue_depth'] = sum(1 for job in _jobs.values() if job['status'] == 'queued')
         return {
             'ready': _server_ready,
             'gpu': get_gpu_info(),
-            'stats': _server_stats,
-            'models_loaded': _loop_instance is not None
+            'stats': stats,
+            'models_loaded': _loop_instance is not None,
+            'cache': _result_cache.stats(),
+            'task_pool': _task_pool_stats(),
+            'stage_cache': _stage_cache.stats(),
+            'weight_loads': weight_cache.load_times(),
+            'cost_model': _cost_model.stats(),
+            'cpu': dict(_cpu_plan, omp_threads=os.environ.get('OMP_NUM_THREADS')),
+            'pid': os.getpid()
         }
     
     elif action == 'process':
-        return process_image(
-            image_base64=cmd.get('image_base64', ''),
-            task=cmd.get('task', 'sr'),
-            upscale=cmd.get('upscale', 4),
-            quality=cmd.get('quality', 'balanced')
-        )
+        if cmd.get('progressive') and send is not None:
+            return process_progressive(cmd, send)
+        # Synchronous: queue behind other jobs, wait for our turn on the worker
+        submitted = submit_job(cmd)
+        if not submitted.get('success'):
+            return submitted
+        return job_result(submitted['job_id'], wait=cmd.get('timeout', 24 * 3600))
+    
+    elif action == 'submit':
+        return submit_job(cmd)
+    
+    elif action == 'cancel':
+        return cancel_job(cmd.get('job_id'))
+    
+    elif action == 'result':
+        return job_result(cmd.get('job_id'), wait=cmd.get('wait', 0))
+    
+    elif action == 'metrics':
+        if cmd.get('format') == 'text':
+            return {'success': True, 'text': _metrics.exposition()}
+        return {'success': True, 'metrics': _metrics.snapshot()}
     
     elif action == 'ping':
-        return {'pong': True, 'ready': _server_ready}
+        return {'pong': True, 'ready': _server_ready, 'pid': os.getpid()}
+    
+    elif action == 'shutdown':
+        _shutdown_requested.set()
+        return {'shutdown': True}
     
     else:
         return {'error': f'Unknown action: {action}'}
 
-def main():
+def parse_line(line: str):
+    """Decode one JSON-lines request: (cmd, None), (None, error response) or (None, None) if blank"""
+    line = line.strip()
+    if not line:
+        return None, None
+    try:
+        cmd = json.loads(line)
+    except json.JSONDecodeError as e:
+        return None, {'error': f'Invalid JSON: {e}'}
+    if not isinstance(cmd, dict):
+        return None, {'error': 'Command must be a JSON object'}
+    return cmd, None
+
+def dispatch(cmd: Dict[str, Any], send=None) -> Dict[str, Any]:
+    _touch()
+    action = cmd.get('action')
+    _metrics.inc('requests_total', action=action if action in METRIC_ACTIONS else 'unknown')
+    try:
+        return handle_command(cmd, send)
+    except Exception as e:
+        log(f"Command error: {e}", "ERROR")
+        return {'error': str(e)}
+    finally:
+        _touch()
+
+def dispatch_line(line: str, send=None) -> Optional[Dict[str, Any]]:
+    """Parse one JSON-lines request and return the response (None for blank lines)"""
+    cmd, error = parse_line(line)
+    if cmd is None:
+        return error
+    return dispatch(cmd, send)
+
+def _is_blocking(cmd: Dict[str, Any]) -> bool:
+    return cmd.get('action') == 'process' or (cmd.get('action') == 'result' and bool(cmd.get('wait')))
+
+def serve_stdio():
+    """Read commands from stdin, answer on stdout.
+
+    This is the reader thread: control commands are answered inline, commands
+    that wait for a job get their own thread so the reader never blocks.
+    """
+    waiters = []
+    for line in sys.stdin:
+        cmd, error = parse_line(line)
+        if error is not None:
+            emit(error)
+        elif cmd is not None and _is_blocking(cmd):
+            waiter = threading.Thread(target=lambda c=cmd: emit(dispatch(c, emit)), daemon=True)
+            waiter.start()
+            waiters.append(waiter)
+        elif cmd is not None:
+            emit(dispatch(cmd))
+        waiters = [w for w in waiters if w.is_alive()]
+        if _shutdown_requested.is_set():
+            break
+    
+    # stdin closed: finish what was asked for before exiting
+    for waiter in waiters:
+        waiter.join()
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """One client connection: JSON lines in, JSON lines out"""
+    
+    def _send(self, response: Dict[str, Any]):
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+        self.wfile.flush()
+    
+    def handle(self):
+        global _active_connections
+        with _server_lock:
+            _active_connections += 1
+        try:
+            for raw in self.rfile:
+                response = dispatch_line(raw.decode('utf-8', errors='replace'), self._send)
+                if response is None:
+                    continue
+                self._send(response)
+                if _shutdown_requested.is_set():
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with _server_lock:
+                _active_connections -= 1
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def _idle_watchdog(server, idle_timeout: float):
+    """Stop the server once it has been idle (no connections) for idle_timeout seconds"""
+    while not _shutdown_requested.wait(1.0):
+        if idle_timeout <= 0:
+            continue
+        with _server_lock:
+            busy = _active_connections > 0
+        busy = busy or _busy()
+        if not busy and time.time() - _last_activity > idle_timeout:
+            log(f"Idle for {idle_timeout:.0f}s, shutting down")
+            _shutdown_requested.set()
+    server.shutdown()
+
+def serve_socket(socket_path: str, idle_timeout: float):
+    """Serve JSON-lines commands on a Unix socket until shutdown or idle timeout"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    
+    server = _UnixServer(socket_path, _CommandHandler)
+    os.chmod(socket_path, 0o600)
+    log(f"Listening on {socket_path} (idle timeout: {idle_timeout:.0f}s)")
+    
+    watchdog = threading.Thread(target=_idle_watchdog, args=(server, idle_timeout), daemon=True)
+    watchdog.start()
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+        log("Server stopped")
+
+def parse_args(argv):
+    opts = {'socket': None, 'idle_timeout': DEFAULT_IDLE_TIMEOUT, 'metrics_file': METRICS_FILE}
+    i = 0
+    while i < len(argv):
+        if argv[i] == '--socket':
+            if i + 1 < len(argv) and not argv[i + 1].startswith('--'):
+                opts['socket'] = argv[i + 1]; i += 2
+            else:
+                opts['socket'] = DEFAULT_SOCKET_PATH; i += 1
+        elif argv[i] == '--idle-timeout' and i + 1 < len(argv):
+            opts['idle_timeout'] = float(argv[i + 1]); i += 2
+        elif argv[i] == '--metrics-file' and i + 1 < len(argv):
+            opts['metrics_file'] = argv[i + 1]; i += 2
+        elif argv[i] == '--profile-dir' and i + 1 < len(argv):
+            profiling.PROFILE_DIR = argv[i + 1]; i += 2
+        else:
+            i += 1
+    return opts
+
+def main(argv=None):
     """Main server loop"""
     global _server_ready
     
+    opts = parse_args(sys.argv[1:] if argv is None else argv)
+    
     log("ARMscaler Model Server v6 starting...")
     log(f"PyTorch: {torch.__version__}")
     log(f"CUDA available: {torch.cuda.is_available()}")
+    log(f"CPU threads: {cpu_tuning.describe(_cpu_plan)}")
     
     if torch.cuda.is_available():
         log(f"GPU: {torch.cuda.get_device_name(0)}")
@@ -337,23 +1604,20 @@ def main():
     
     log("Server ready. Models will load on first request.")
     _server_ready = True
+    _ensure_worker()
+    if opts['metrics_file']:
+        log(f"Metrics: {opts['metrics_file']} (every {METRICS_INTERVAL:.0f}s)")
+        threading.Thread(target=_metrics_writer, args=(opts['metrics_file'], METRICS_INTERVAL),
+                         name='metrics-writer', daemon=True).start()
     
     # Main command loop
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
-        
-        try:
-            cmd = json.loads(line)
-            response = handle_command(cmd)
-            print(json.dumps(response), flush=True)
-        except json.JSONDecodeError as e:
-            print(json.dumps({'error': f'Invalid JSON: {e}'}), flush=True)
-        except Exception as e:
-            log(f"Command error: {e}", "ERROR")
-            print(json.dumps({'error': str(e)}), flush=True)
+    if opts['socket']:
+        serve_socket(opts['socket'], opts['idle_timeout'])
+    else:
+        serve_stdio()
     
+    if opts['metrics_file']:
+        _write_metrics(opts['metrics_file'])
     return 0
 
 if __name__ == '__main__':
@@ -6,14 +6,30 @@ ARMscaler — Simple direct inference using DiffBIR's inference.py
 import sys
 import os
 import json
+import time
 import subprocess
 import tempfile
 import shutil
 from pathlib import Path
 
+import zygote
+import cost_model
+
 SCRIPT_DIR = Path(__file__).parent.resolve()
 DIFFBIR_DIR = SCRIPT_DIR / 'diffbir_engine'
 
+# Tiling budget: ARMSCALER_TILE_BUDGET_MB, else a fraction of VRAM left after the models
+TILE_BUDGET = int(os.environ.get('ARMSCALER_TILE_BUDGET_MB', '0')) << 20
+TILE_MEMORY_FRACTION = 0.8
+MODEL_BYTES = 6 << 30  # DiffBIR v2 weights in fp16 plus the CUDA context
+# Used when the GPU's memory is unknown
+DEFAULT_TILE_ARGS = [
+    '--cleaner_tiled', '--cleaner_tile_size', '512', '--cleaner_tile_stride', '256',
+    '--vae_encoder_tiled', '--vae_encoder_tile_size', '512',
+    '--vae_decoder_tiled', '--vae_decoder_tile_size', '512',
+    '--cldm_tiled', '--cldm_tile_size', '1024', '--cldm_tile_stride', '512',
+]
+
 def log(msg):
     print(f"  {msg}", file=sys.stderr, flush=True)
 
@@ -24,38 +40,57 @@ def check_setup():
         return False, "inference.py not found"
     return True, "OK"
 
-def get_gpu_info():
+def status(refresh=False):
+    """Setup + GPU status from the capability probe snapshot (no torch import)"""
+    import capability_probe
+    return capability_probe.status(refresh=refresh)
+
+def tile_budget():
+    if TILE_BUDGET:
+        return TILE_BUDGET
+    import capability_probe
+    try:
+        caps, _ = capability_probe.capabilities()
+        vram = caps['gpu'].get('vram_gb', 0) * 1024**3
+    except Exception:
+        vram = 0
+    return int(max(vram - MODEL_BYTES, 0) * TILE_MEMORY_FRACTION)
+
+def device_name():
+    """Cost model device: the GPU from the capability snapshot, else cpu"""
+    import capability_probe
     try:
-        import torch
-        if torch.cuda.is_available():
-            return {
-                'available': True,
-                'name': torch.cuda.get_device_name(0),
-                'vram_gb': round(torch.cuda.get_device_properties(0).total_memory / 1024**3, 1)
-            }
-    except:
+        caps, _ = capability_probe.capabilities()
+        if caps['gpu'].get('available'):
+            return caps['gpu']['name']
+    except Exception:
         pass
-    return {'available': False, 'name': 'CPU', 'vram_gb': 0}
+    return 'cpu'
 
-def status():
-    ok, msg = check_setup()
-    gpu = get_gpu_info()
-    weights_dir = DIFFBIR_DIR / 'weights'
-    models = len(list(weights_dir.glob('*.pth'))) if weights_dir.exists() else 0
-    return {
-        'available': ok, 'ready': ok, 'setup_complete': ok,
-        'message': msg, 'gpu': gpu, 'models_downloaded': models
-    }
-
-def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanced'):
-    """Run inference using DiffBIR's inference.py directly"""
+def plan_tiles(input_path, upscale):
+    """inference.py tiling flags sized for this image and the GPU's memory"""
+    from PIL import Image
+    import tile_planner
+    budget = tile_budget()
+    if budget <= 0:
+        log("Tiles: GPU memory unknown, using the default tiles")
+        return DEFAULT_TILE_ARGS
+    with Image.open(input_path) as img:
+        w, h = img.size
+    plan = tile_planner.plan_tiles((w, h), (w * upscale, h * upscale), budget, 'fp16')
+    log(f"Tiles: {tile_planner.describe(plan)}")
+    return tile_planner.plan_cli_args(plan)
+
+def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanced',
+                  roi=None, roi_margin=None, roi_crop=False):
+    """Run inference using DiffBIR's inference.py directly (only on `roi` if given)"""
     
     ok, msg = check_setup()
     if not ok:
         return False, msg
     
     # Quality presets
-    steps = {'turbo': 8, 'fast': 15, 'balanced': 25, 'quality': 40}.get(quality, 25)
+    steps = cost_model.steps_for(quality)
     
     # Create temp directories
     with tempfile.TemporaryDirectory() as tmp_dir:
@@ -64,11 +99,35 @@ def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanc
         input_dir.mkdir()
         output_dir.mkdir()
         
-        # Copy input to temp dir
+        # Copy input to temp dir (just the ROI and its context, if one is set)
         temp_input = input_dir / 'input.png'
-        shutil.copy2(input_path, temp_input)
+        region = None
+        if roi:
+            from PIL import Image
+            from roi import parse_roi, context_box, DEFAULT_MARGIN
+            try:
+                image = Image.open(input_path).convert('RGB')
+                rect = parse_roi(roi)
+                margin = DEFAULT_MARGIN if roi_margin is None else int(roi_margin)
+                box = context_box(rect, image.size, margin)
+            except (OSError, ValueError) as e:
+                return False, f"Bad ROI: {e}"
+            image.crop(box).save(temp_input)
+            region = (image, rect, box)
+            log(f"ROI {box[2] - box[0]}x{box[3] - box[1]} at ({box[0]}, {box[1]})")
+        else:
+            shutil.copy2(input_path, temp_input)
         
+        # Predicted from past one-shot runs on this host (server.js turns it into progress)
+        from PIL import Image
+        with Image.open(temp_input) as img:
+            size = img.size
+        device = device_name()
+        model = cost_model.CostModel()
+        predicted = model.predict(device, 'oneshot', task, upscale, quality, size)
+        timeout = cost_model.timeout(predicted)
         log(f"Running DiffBIR ({quality}, {steps} steps)...")
+        log(f"Predicted duration: {predicted:.0f}s (timeout {timeout:.0f}s)")
         
         env = os.environ.copy()
         env['PYTHONPATH'] = str(DIFFBIR_DIR) + ':' + env.get('PYTHONPATH', '')
@@ -76,9 +135,10 @@ def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanc
         env['PYTORCH_CUDA_ALLOC_CONF'] = 'max_split_size_mb:512,expandable_segments:True'
         env['NVIDIA_TF32_OVERRIDE'] = '1'
         
-        # Build command
-        cmd = [
-            sys.executable, '-u',
+        # Build command (forked from the warm zygote when one is running); cpu_tuning
+        # applies the host's torch thread count and pinning before inference.py starts
+        cmd = zygote.command([
+            str(SCRIPT_DIR / 'cpu_tuning.py'), 'run', 'torch',
             str(DIFFBIR_DIR / 'inference.py'),
             '--task', task,
             '--upscale', str(upscale),
@@ -91,27 +151,12 @@ def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanc
             '--precision', 'fp16',
             '--captioner', 'none',
             '--sampler', 'spaced',
-            # Tiling for memory efficiency
-            '--cleaner_tiled',
-            '--cleaner_tile_size', '512',
-            '--cleaner_tile_stride', '256',
-            '--vae_encoder_tiled',
-            '--vae_encoder_tile_size', '512',
-            '--vae_decoder_tiled',
-            '--vae_decoder_tile_size', '512',
-            '--cldm_tiled',
-            '--cldm_tile_size', '1024',
-            '--cldm_tile_stride', '512',
-        ]
+            # Tiling for memory efficiency, planned per image
+            *plan_tiles(temp_input, upscale),
+        ])
         
         try:
-            # Longer timeout for 4x upscale (larger output = more tiles)
-            timeout = 900 if upscale >= 4 else 600
-            if quality == 'quality':
-                timeout = 1200
-            elif quality == 'turbo':
-                timeout = 600  # Turbo should be fast but 4x needs time
-            
+            start = time.time()
             result = subprocess.run(
                 cmd,
                 capture_output=True,
@@ -133,8 +178,17 @@ def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanc
             outputs = list(output_dir.glob('*.png'))
             if not outputs:
                 return False, "No output produced"
+            model.record(device, 'oneshot', task, upscale, quality, size, time.time() - start)
             
-            shutil.copy2(outputs[0], output_path)
+            if region:
+                from PIL import Image
+                from roi import compose
+                image, rect, box = region
+                result_img = compose(image, Image.open(outputs[0]), rect, box, upscale,
+                                     'crop' if roi_crop else 'full')
+                result_img.save(output_path)
+            else:
+                shutil.copy2(outputs[0], output_path)
             return True, "OK"
             
         except subprocess.TimeoutExpired:
@@ -145,11 +199,12 @@ def run_inference(input_path, output_path, task='sr', upscale=4, quality='balanc
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         print(f"Usage: {sys.argv[0]} <input> <output> [--task sr] [--upscale 4] [--quality turbo]")
-        print(f"       {sys.argv[0]} --status")
+        print(f"       [--roi X,Y,W,H [--roi-margin PIXELS] [--roi-crop]]")
+        print(f"       {sys.argv[0]} --status [--refresh]")
         sys.exit(1)
 
     if sys.argv[1] == '--status':
-        print(json.dumps(status(), indent=2))
+        print(json.dumps(status(refresh='--refresh' in sys.argv), indent=2))
         sys.exit(0)
 
     input_path = sys.argv[1]
@@ -165,6 +220,12 @@ if __name__ == '__main__':
             kwargs['upscale'] = int(args[i + 1]); i += 2
         elif args[i] == '--quality' and i + 1 < len(args):
             kwargs['quality'] = args[i + 1]; i += 2
+        elif args[i] == '--roi' and i + 1 < len(args):
+            kwargs['roi'] = args[i + 1]; i += 2
+        elif args[i] == '--roi-margin' and i + 1 < len(args):
+            kwargs['roi_margin'] = int(args[i + 1]); i += 2
+        elif args[i] == '--roi-crop':
+            kwargs['roi_crop'] = True; i += 1
         else:
             i += 1
 
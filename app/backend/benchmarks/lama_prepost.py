@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+LaMa pre/post-processing microbenchmark (no model needed)
+
+Runs the crop → tensor → composite → encode path of inpaint_lama.py on a
+synthetic large image with many regions, once the old way (PIL copy of the
+whole image, per-channel float32 tensors, np.stack, full-crop blend + paste)
+and once the current way (one uint8 canvas, preallocated batch buffers,
+bbox-limited in-place blend). Each path runs in a fresh child process, so
+peak_rss_mb (VmHWM above the process's footprint before the run) counts
+PIL's image memory as well as numpy's. LaMa itself is replaced by a fixed
+function of its input so both paths see the same "model output".
+
+Usage: python3 benchmarks/lama_prepost.py [--size 7680x4320] [--regions 16] [--repeat 3]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import resource
+import subprocess
+import tempfile
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inpaint_lama
+from inpaint_lama import decode_canvas, prepare_region, fill_tensors, composite_region, _buffers, _encode_png
+
+inpaint_lama.log = lambda msg: None
+
+
+# ── Old implementation (before the canvas / batch-buffer rewrite) ──
+
+class PILCrops:
+    """Lets prepare_region (unchanged crop geometry) crop straight from a PIL image"""
+
+    def __init__(self, image):
+        self.image = image
+        self.shape = (image.height, image.width, 3)
+
+    def __getitem__(self, key):
+        rows, cols = key
+        return np.asarray(self.image.crop((cols.start, rows.start, cols.stop, rows.stop)))
+
+
+def legacy_tensors(region, lama_img, lama_mask):
+    img_np = np.array(lama_img).astype(np.float32) / 255.0
+    mask_np = np.array(lama_mask).astype(np.float32) / 255.0
+    mask_binary = (mask_np > 0.5).astype(np.float32)
+    for c in range(3):
+        img_np[:, :, c] *= (1.0 - mask_binary)
+    region['img_t'] = np.transpose(img_np, (2, 0, 1))
+    region['mask_t'] = mask_binary[np.newaxis, ...]
+
+
+def legacy_composite(output, region, out_uint8):
+    crop_x1, crop_y1, crop_x2, crop_y2 = region['crop']
+    result_crop = Image.fromarray(out_uint8, 'RGB').resize(
+        (crop_x2 - crop_x1, crop_y2 - crop_y1), Image.LANCZOS)
+    blur_r = max(1, min(region['padding'], 3))
+    mask_feathered = region['crop_mask'].filter(ImageFilter.GaussianBlur(radius=blur_r))
+    oa = np.array(output.crop(region['crop'])).astype(np.float32)
+    ra = np.array(result_crop).astype(np.float32)
+    alpha = (np.array(mask_feathered).astype(np.float32) / 255.0)[:, :, np.newaxis]
+    blended = np.clip(oa * (1.0 - alpha) + ra * alpha, 0, 255).astype(np.uint8)
+    output.paste(Image.fromarray(blended), (crop_x1, crop_y1))
+
+
+def fake_lama(img_batch):
+    """Stand-in for the model: deterministic, depends on the input"""
+    return [((1.0 - img) * 255).transpose(1, 2, 0).astype(np.uint8) for img in img_batch]
+
+
+# ── Benchmark ──
+
+def make_input(width, height, count):
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width]
+    pixels = np.stack([xx * 255 // width, yy * 255 // height, (xx ^ yy) & 255], axis=-1).astype(np.uint8)
+    pixels[::7, ::5] = rng.integers(0, 256, size=pixels[::7, ::5].shape, dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format='PNG', compress_level=1)
+    regions = []
+    for n in range(count):
+        w = int(rng.integers(60, 240))
+        h = int(rng.integers(30, 120))
+        regions.append((int(rng.integers(0, width - w)), int(rng.integers(0, height - h)), w, h))
+    return buf.getvalue(), regions
+
+
+def run_legacy(input_bytes, regions, timings):
+    t = time.perf_counter()
+    original = Image.open(io.BytesIO(input_bytes)).convert('RGB')
+    output = original.copy()
+    prepared = [prepare_region(PILCrops(original), *r) for r in regions]
+    timings['prepare'] += time.perf_counter() - t
+
+    t = time.perf_counter()
+    live = [r for r in prepared if not r['empty']]
+    for region in live:
+        lama_img = Image.fromarray(region['lama_img'])
+        lama_mask = Image.fromarray(region['lama_mask'].astype(np.uint8) * 255)
+        legacy_tensors(region, lama_img, lama_mask)
+    img_batch = np.stack([r['img_t'] for r in live])
+    np.stack([r['mask_t'] for r in live])
+    timings['tensors'] += time.perf_counter() - t
+
+    outputs = fake_lama(img_batch)
+
+    t = time.perf_counter()
+    for region, out in zip(live, outputs):
+        legacy_composite(output, region, out)
+    timings['composite'] += time.perf_counter() - t
+
+    t = time.perf_counter()
+    png = _encode_png(output)
+    timings['encode'] += time.perf_counter() - t
+    return png
+
+
+def run_current(input_bytes, regions, timings):
+    t = time.perf_counter()
+    canvas = decode_canvas(input_bytes)
+    prepared = [prepare_region(canvas, *r) for r in regions]
+    timings['prepare'] += time.perf_counter() - t
+
+    t = time.perf_counter()
+    live = [r for r in prepared if not r['empty']]
+    img_batch, mask_batch = _buffers.get(len(live))
+    for slot, region in enumerate(live):
+        fill_tensors(region, img_batch[slot], mask_batch[slot])
+    timings['tensors'] += time.perf_counter() - t
+
+    outputs = fake_lama(img_batch)
+
+    t = time.perf_counter()
+    for region, out in zip(live, outputs):
+        composite_region(canvas, region, out)
+    timings['composite'] += time.perf_counter() - t
+
+    t = time.perf_counter()
+    png = _encode_png(Image.fromarray(canvas))
+    timings['encode'] += time.perf_counter() - t
+    return png
+
+
+PATHS = {'legacy': run_legacy, 'current': run_current}
+
+
+def _rss_kb(field):
+    """VmRSS / VmHWM of this process in kB (ru_maxrss when /proc isn't there)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak():
+    """Restart VmHWM from the current RSS (Linux 4.0+); False if that isn't possible"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def run_child(name, input_path, regions, repeat):
+    """One path in this (fresh) process: stage timings and peak RSS above the starting footprint"""
+    with open(input_path, 'rb') as f:
+        input_bytes = f.read()
+    fn = PATHS[name]
+    timings = {'prepare': 0.0, 'tensors': 0.0, 'composite': 0.0, 'encode': 0.0}
+    baseline = _rss_kb('VmRSS')
+    reset = _reset_peak()
+    fn(input_bytes, regions, dict(timings))  # warm-up (buffers, allocator)
+    for _ in range(repeat):
+        png = fn(input_bytes, regions, timings)
+    result = {stage: round(total / repeat * 1000, 2) for stage, total in timings.items()}
+    result['total_ms'] = round(sum(timings.values()) / repeat * 1000, 2)
+    result['peak_rss_mb'] = round((_rss_kb('VmHWM') - baseline) / 1024, 1)
+    if not reset:
+        result['peak_rss_note'] = 'VmHWM could not be reset; includes startup'
+    result['png_sha256'] = hashlib.sha256(png).hexdigest()
+    return result
+
+
+def measure(name, input_path, regions, repeat):
+    """run_child() for one path in a fresh interpreter, so neither path sees the other's peak"""
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name, '--input', input_path,
+         '--region-list', json.dumps(regions), '--repeat', str(repeat)],
+        capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout)
+
+
+if __name__ == '__main__':
+    width, height, count, repeat = 7680, 4320, 16, 3
+    child = input_path = region_list = None
+    args = sys.argv[1:]
+    i = 0
+    while i < len(args):
+        if args[i] == '--size' and i + 1 < len(args):
+            width, height = (int(v) for v in args[i + 1].lower().split('x')); i += 2
+        elif args[i] == '--regions' and i + 1 < len(args):
+            count = int(args[i + 1]); i += 2
+        elif args[i] == '--repeat' and i + 1 < len(args):
+            repeat = int(args[i + 1]); i += 2
+        elif args[i] == '--child' and i + 1 < len(args):
+            child = args[i + 1]; i += 2
+        elif args[i] == '--input' and i + 1 < len(args):
+            input_path = args[i + 1]; i += 2
+        elif args[i] == '--region-list' and i + 1 < len(args):
+            region_list = [tuple(r) for r in json.loads(args[i + 1])]; i += 2
+        else:
+            i += 1
+
+    if child:
+        print(json.dumps(run_child(child, input_path, region_list, repeat)))
+        sys.exit(0)
+
+    input_bytes, regions = make_input(width, height, count)
+    with tempfile.NamedTemporaryFile(suffix='.png') as f:
+        f.write(input_bytes)
+        f.flush()
+        legacy = measure('legacy', f.name, regions, repeat)
+        current = measure('current', f.name, regions, repeat)
+    identical = legacy.pop('png_sha256') == current.pop('png_sha256')
+
+    print(json.dumps({
+        'image': f"{width}x{height}",
+        'regions': count,
+        'repeat': repeat,
+        'legacy': legacy,
+        'current': current,
+        'identical': identical,
+    }, indent=2))
+    sys.exit(0 if identical else 1)
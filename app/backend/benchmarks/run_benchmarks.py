@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for ARMscaler and LaMa — runs on a CPU-only box
+
+DiffBIR is replaced by the stub InferenceLoop in stub_models.py and LaMa by
+a tiny generated ONNX model (or --lama-model), so the numbers cover
+everything around the model: decode, setup, PNG encode, base64, raw
+transport, sockets, JSON lines and process spawn.
+
+Suites:
+  server     armscaler_server.process_image in-process, per stage
+  client     armscaler.run_inference against a resident stub server
+             (base64 and raw transport) plus server spawn-to-ready time
+  lama       inpaint_lama.inpaint on the tiny model, per stage
+  protocol   JSON-lines round trips: ping, and `process` / `inpaint`
+             requests to armscaler_server (stdio) and inpaint_server
+
+Every stage reports latency percentiles in ms; every size reports
+throughput and peak RSS. Results are saved as JSON; --compare diffs two runs.
+
+Usage:
+  python3 benchmarks/run_benchmarks.py [--suites server,client,lama,protocol]
+        [--sizes 512,1024,1920x1080,3840x2160,7680x4320] [--repeat 3]
+        [--upscale 2] [--lama-model PATH] [--output results.json]
+  python3 benchmarks/run_benchmarks.py --compare before.json after.json [--threshold 10]
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import platform
+import tempfile
+import subprocess
+
+# Keep the result caches out of the measurements
+os.environ.setdefault('ZARMA_CACHE_DIR', tempfile.mkdtemp(prefix='zarma_bench_cache_'))
+os.environ['ARMSCALER_CACHE'] = '0'
+os.environ['LAMA_CACHE'] = '0'
+
+import numpy as np
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import stub_models
+
+DEFAULT_SIZES = '512,1024,1920x1080,3840x2160,7680x4320'
+ALL_SUITES = ('server', 'client', 'lama', 'protocol')
+PING_COUNT = 200
+STUB_SERVER = os.path.join(BENCH_DIR, 'stub_models.py')
+INPAINT_SERVER = os.path.join(BACKEND_DIR, 'inpaint_server.py')
+
+
+def log(msg):
+    print(f"  {msg}", file=sys.stderr, flush=True)
+
+
+# ── Measurement helpers ──
+
+def summarize(values):
+    """Latency percentiles (ms) for a list of seconds"""
+    if not values:
+        return None
+    ms = np.asarray(values, dtype=np.float64) * 1000
+    return {
+        'count': int(ms.size),
+        'mean': round(float(ms.mean()), 3),
+        'min': round(float(ms.min()), 3),
+        'p50': round(float(np.percentile(ms, 50)), 3),
+        'p90': round(float(np.percentile(ms, 90)), 3),
+        'p95': round(float(np.percentile(ms, 95)), 3),
+        'p99': round(float(np.percentile(ms, 99)), 3),
+        'max': round(float(ms.max()), 3),
+    }
+
+
+def reset_peak_rss(pid='self'):
+    """Reset VmHWM so the next peak_rss_mb() covers only what follows (Linux)"""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb(pid='self'):
+    """Peak resident set size (VmHWM) of a process in MB; ru_maxrss as a fallback"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if pid == 'self':
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return None
+
+
+class StageTimer:
+    """Wraps functions on a module (or object) so each call adds to the current sample"""
+
+    def __init__(self):
+        self.sample = None
+        self._patched = []
+
+    def wrap(self, owner, name, stage):
+        original = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                if self.sample is not None:
+                    self.sample[stage] = self.sample.get(stage, 0.0) + time.perf_counter() - start
+
+        setattr(owner, name, timed)
+        self._patched.append((owner, name, original))
+
+    def restore(self):
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched = []
+
+
+def run_samples(fn, repeat, timer=None, warmup=1):
+    """Call fn() warmup+repeat times; returns (per-sample stage dicts, totals in s)"""
+    samples, totals = [], []
+    for n in range(warmup + repeat):
+        sample = {}
+        if timer is not None:
+            timer.sample = sample
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if timer is not None:
+            timer.sample = None
+        if n >= warmup:
+            samples.append(sample)
+            totals.append(elapsed)
+    return samples, totals
+
+
+def size_result(samples, totals, width, height, extra=None, other=True):
+    """Per-stage percentiles, total, throughput; 'other' is the untimed remainder"""
+    stages = sorted({stage for sample in samples for stage in sample})
+    result = {
+        'stages': {stage: summarize([sample.get(stage, 0.0) for sample in samples]) for stage in stages},
+        'total': summarize(totals),
+    }
+    if stages and other:
+        other = [total - sum(sample.values()) for sample, total in zip(samples, totals)]
+        result['stages']['other'] = summarize(other)
+    elapsed = sum(totals)
+    result['throughput'] = {
+        'images_per_s': round(len(totals) / elapsed, 3) if elapsed else None,
+        'input_megapixels_per_s': round(len(totals) * width * height / 1e6 / elapsed, 3) if elapsed else None,
+    }
+    result.update(extra or {})
+    return result
+
+
+# ── Inputs ──
+
+def parse_size(text):
+    if 'x' in text.lower():
+        width, height = text.lower().split('x')
+        return int(width), int(height)
+    return int(text), int(text)
+
+
+def make_image(width, height, path):
+    """Deterministic photo-ish test image (gradients + noise, so PNG can't cheat)"""
+    rng = np.random.default_rng(width * 31 + height)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[..., 0] = (xx / width * 255).astype(np.uint8)
+    pixels[..., 1] = (yy / height * 255).astype(np.uint8)
+    pixels[..., 2] = ((np.sin(xx / 37) + np.cos(yy / 23)) * 60 + 128).astype(np.uint8)
+    del xx, yy
+    pixels ^= rng.integers(0, 24, size=pixels.shape, dtype=np.uint8)
+    Image.fromarray(pixels).save(path, compress_level=1)
+    return path
+
+
+def watermark_region(width, height):
+    w, h = min(180, width // 3), min(80, height // 4)
+    return width - w - 20, height - h - 20, w, h
+
+
+# ── JSON-lines child processes ──
+
+class LineServer:
+    """A JSON-lines server on stdin/stdout; log lines ({"level": ...}) are skipped"""
+
+    def __init__(self, argv, env=None):
+        self.proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, env=env, text=True, bufsize=1)
+        self.last_line_bytes = 0
+
+    def request(self, cmd):
+        self.proc.stdin.write(json.dumps(cmd) + '\n')
+        self.proc.stdin.flush()
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise RuntimeError(f"Server exited (code {self.proc.poll()})")
+            if not line.startswith('{'):
+                continue
+            response = json.loads(line)
+            if 'level' in response and 'message' in response:
+                continue
+            self.last_line_bytes = len(line)
+            return response
+
+    def close(self):
+        try:
+            self.request({'action': 'shutdown'})
+        except (OSError, RuntimeError, ValueError):
+            pass
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+def _child_env(**extra):
+    env = os.environ.copy()
+    env['PYTHONUNBUFFERED'] = '1'
+    env.update(extra)
+    return env
+
+
+def _wait_for_socket(path, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            sock.sendall(b'{"action": "ping"}\n')
+            if b'pong' in sock.makefile('rb').readline():
+                return True
+        except OSError:
+            time.sleep(0.05)
+        finally:
+            sock.close()
+    return False
+
+
+# ── Suites ──
+
+def bench_server(images, repeat, upscale, **_):
+    """armscaler_server.process_image in-process with the stub loop"""
+    stub_models.install_stub_loop()
+    import armscaler_server
+    armscaler_server.log = lambda msg, level="INFO": None
+
+    timer = StageTimer()
+    for name, stage in (('_decode_input', 'decode'), ('_configure_loop', 'setup'),
+                        ('_load_lq', 'load_lq'), ('_pos_prompt', 'prompt'),
+                        ('_run_pipeline', 'pipeline'), ('_encode_png', 'png_encode'),
+                        ('_encode_result', 'result_encode')):
+        timer.wrap(armscaler_server, name, stage)
+
+    results = {}
+    try:
+        for label, (width, height, path) in images.items():
+            for output in ('base64', 'raw'):
+                log(f"server {label} output={output}")
+                with open(path, 'rb') as f:
+                    input_bytes = f.read()
+
+                def once():
+                    start = time.perf_counter()
+                    encoded = base64.b64encode(input_bytes).decode('ascii')
+                    timer.sample['input_b64'] = time.perf_counter() - start
+                    response = armscaler_server.process_image(encoded, 'sr', upscale, 'turbo', output=output)
+                    if not response.get('success'):
+                        raise RuntimeError(response.get('error'))
+                    if response.get('image_raw'):
+                        os.unlink(response['image_raw'])
+
+                reset_peak_rss()
+                samples, totals = run_samples(once, repeat, timer)
+                results[f"{label}/{output}"] = size_result(samples, totals, width, height,
+                                                           {'peak_rss_mb': peak_rss_mb()})
+    finally:
+        timer.restore()
+    return results
+
+
+def bench_client(images, repeat, upscale, workdir, **_):
+    """armscaler.run_inference against a resident stub server on a private socket"""
+    import armscaler
+    socket_path = os.path.join(workdir, 'armscaler_bench.sock')
+    env = _child_env(ARMSCALER_CACHE='0')
+
+    def spawn():
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        proc = subprocess.Popen([sys.executable, '-u', STUB_SERVER, '--socket', socket_path,
+                                 '--idle-timeout', '300'],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, env=env, start_new_session=True)
+        if not _wait_for_socket(socket_path):
+            proc.kill()
+            raise RuntimeError("Stub server did not start")
+        return proc
+
+    # Spawn-to-ready: interpreter + torch import + first ping
+    spawn_times = []
+    for _ in range(min(repeat, 3)):
+        start = time.perf_counter()
+        proc = spawn()
+        spawn_times.append(time.perf_counter() - start)
+        armscaler.ServerClient(socket_path).stop()
+        proc.wait(timeout=30)
+    results = {'spawn': {'total': summarize(spawn_times)}}
+
+    proc = spawn()
+    client = armscaler.ServerClient(socket_path)
+    armscaler._client = client
+    check_setup = armscaler.check_setup
+    armscaler.check_setup = lambda: (True, 'stub server')  # no DiffBIR checkout needed
+
+    timer = StageTimer()
+    timer.wrap(armscaler, '_read_input_base64', 'input_b64')
+    timer.wrap(client, 'request', 'roundtrip')
+    timer.wrap(armscaler, '_write_output', 'output_write')
+    try:
+        for label, (width, height, path) in images.items():
+            for transport in ('base64', 'raw'):
+                log(f"client {label} transport={transport}")
+                output_path = os.path.join(workdir, f"client_{label}.png")
+
+                def once():
+                    ok, msg = armscaler.run_inference(path, output_path, 'sr', upscale, 'turbo',
+                                                      transport=transport)
+                    if not ok:
+                        raise RuntimeError(msg)
+
+                reset_peak_rss(proc.pid)
+                samples, totals = run_samples(once, repeat, timer)
+                results[f"{label}/{transport}"] = size_result(
+                    samples, totals, width, height,
+                    {'server_peak_rss_mb': peak_rss_mb(proc.pid), 'peak_rss_mb': peak_rss_mb()})
+    finally:
+        timer.restore()
+        armscaler.check_setup = check_setup
+        client.stop()
+        proc.wait(timeout=30)
+    return results
+
+
+def bench_lama(images, repeat, lama_model, workdir, **_):
+    """inpaint_lama.inpaint (file to file) on one watermark-sized region"""
+    import inpaint_lama
+    inpaint_lama.log = lambda msg: None
+
+    timer = StageTimer()
+    for name, stage in (('prepare_region', 'prepare'), ('fill_tensors', 'tensors'),
+                        ('run_lama', 'model'), ('composite_region', 'composite'),
+                        ('_encode_png', 'png_encode')):
+        timer.wrap(inpaint_lama, name, stage)
+
+    start = time.perf_counter()
+    session = inpaint_lama.get_session(lama_model)
+    results = {'session_load': {'total': summarize([time.perf_counter() - start])}}
+    try:
+        for label, (width, height, path) in images.items():
+            log(f"lama {label}")
+            output_path = os.path.join(workdir, f"lama_{label}.png")
+            region = watermark_region(width, height)
+
+            def once():
+                inpaint_lama.inpaint(path, output_path, *region, model_path=lama_model,
+                                     use_cache=False, session=session)
+
+            reset_peak_rss()
+            samples, totals = run_samples(once, repeat, timer)
+            results[label] = size_result(samples, totals, width, height, {'peak_rss_mb': peak_rss_mb()})
+    finally:
+        timer.restore()
+    return results
+
+
+def bench_protocol(images, repeat, upscale, lama_model, **_):
+    """JSON-lines over stdio: control-message latency and request overhead per payload size"""
+    results = {}
+    servers = (
+        ('armscaler', [sys.executable, '-u', STUB_SERVER], _child_env(ARMSCALER_CACHE='0')),
+        ('inpaint', [sys.executable, '-u', INPAINT_SERVER, '--model', lama_model],
+         _child_env(LAMA_CACHE='0')),
+    )
+    for name, argv, env in servers:
+        log(f"protocol {name}")
+        server = LineServer(argv, env)
+        try:
+            server.request({'action': 'ping'})
+            pings = []
+            for _ in range(PING_COUNT):
+                start = time.perf_counter()
+                server.request({'action': 'ping'})
+                pings.append(time.perf_counter() - start)
+            results[f"{name}/ping"] = {'total': summarize(pings)}
+
+            for label, (width, height, path) in images.items():
+                with open(path, 'rb') as f:
+                    encoded = base64.b64encode(f.read()).decode('ascii')
+                if name == 'armscaler':
+                    cmd = {'action': 'process', 'image_base64': encoded, 'task': 'sr',
+                           'upscale': upscale, 'quality': 'turbo'}
+                else:
+                    x, y, w, h = watermark_region(width, height)
+                    cmd = {'action': 'inpaint', 'image_base64': encoded, 'x': x, 'y': y, 'w': w, 'h': h}
+                request_bytes = len(json.dumps(cmd))
+                response_bytes = []
+
+                # Round trip = server-side processing_time + everything else (JSON, pipes, base64)
+                samples, totals = [], []
+                for n in range(repeat + 1):
+                    start = time.perf_counter()
+                    response = server.request(cmd)
+                    roundtrip = time.perf_counter() - start
+                    if not response.get('success'):
+                        raise RuntimeError(response.get('error'))
+                    if n == 0:
+                        continue  # warm-up
+                    server_time = float(response.get('processing_time', 0))
+                    samples.append({'server': server_time, 'transport': max(0.0, roundtrip - server_time)})
+                    totals.append(roundtrip)
+                    response_bytes.append(server.last_line_bytes)
+                results[f"{name}/{label}"] = size_result(
+                    samples, totals, width, height,
+                    {'request_bytes': request_bytes,
+                     'response_bytes': int(np.median(response_bytes)),
+                     'server_peak_rss_mb': peak_rss_mb(server.proc.pid)},
+                    other=False)
+        finally:
+            server.close()
+    return results
+
+
+SUITES = {'server': bench_server, 'client': bench_client, 'lama': bench_lama, 'protocol': bench_protocol}
+
+
+# ── Reporting ──
+
+def metadata():
+    meta = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': Image.__version__,
+    }
+    for module in ('onnxruntime', 'torch'):
+        if module in sys.modules:
+            meta[module] = getattr(sys.modules[module], '__version__', None)
+    try:
+        meta['git_commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                            capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return meta
+
+
+def compare(before_path, after_path, threshold=10.0):
+    """Print p50 changes between two result files; returns the number of regressions"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    regressions = 0
+    print(f"{'suite':<10} {'case':<26} {'stage':<14} {'before p50':>11} {'after p50':>11} {'change':>8}")
+    for suite, cases in after.get('suites', {}).items():
+        base_cases = before.get('suites', {}).get(suite, {})
+        for case, result in cases.items():
+            base = base_cases.get(case)
+            if not isinstance(result, dict) or not isinstance(base, dict):
+                continue
+            rows = [('total', result.get('total'), base.get('total'))]
+            rows += [(stage, stats, base.get('stages', {}).get(stage))
+                     for stage, stats in result.get('stages', {}).items()]
+            for stage, new, old in rows:
+                if not new or not old or not old.get('p50'):
+                    continue
+                change = (new['p50'] - old['p50']) / old['p50'] * 100
+                flag = ''
+                if change > threshold and stage == 'total':
+                    flag = '  REGRESSION'
+                    regressions += 1
+                print(f"{suite:<10} {case:<26} {stage:<14} {old['p50']:>11.2f} {new['p50']:>11.2f} "
+                      f"{change:>+7.1f}%{flag}")
+            if result.get('peak_rss_mb') and base.get('peak_rss_mb'):
+                print(f"{suite:<10} {case:<26} {'peak_rss_mb':<14} {base['peak_rss_mb']:>11.1f} "
+                      f"{result['peak_rss_mb']:>11.1f}")
+    return regressions
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == '--compare':
+        if len(args) < 3:
+            print(f"Usage: {sys.argv[0]} --compare before.json after.json [--threshold 10]")
+            sys.exit(1)
+        threshold = float(args[args.index('--threshold') + 1]) if '--threshold' in args else 10.0
+        sys.exit(1 if compare(args[1], args[2], threshold) else 0)
+
+    suites = list(ALL_SUITES)
+    sizes = DEFAULT_SIZES
+    repeat = 3
+    upscale = 2
+    lama_model = None
+    output_path = None
+    i = 0
+    while i < len(args):
+        if args[i] == '--suites' and i + 1 < len(args):
+            suites = [s for s in args[i + 1].split(',') if s]; i += 2
+        elif args[i] == '--sizes' and i + 1 < len(args):
+            sizes = args[i + 1]; i += 2
+        elif args[i] == '--repeat' and i + 1 < len(args):
+            repeat = max(1, int(args[i + 1])); i += 2
+        elif args[i] == '--upscale' and i + 1 < len(args):
+            upscale = int(args[i + 1]); i += 2
+        elif args[i] == '--lama-model' and i + 1 < len(args):
+            lama_model = args[i + 1]; i += 2
+        elif args[i] == '--output' and i + 1 < len(args):
+            output_path = args[i + 1]; i += 2
+        else:
+            i += 1
+
+    unknown = [s for s in suites if s not in SUITES]
+    if unknown:
+        log(f"FAILED: unknown suite(s) {', '.join(unknown)} (have {', '.join(ALL_SUITES)})")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory(prefix='zarma_bench_') as workdir:
+        images = {}
+        for text in sizes.split(','):
+            width, height = parse_size(text)
+            label = f"{width}x{height}"
+            log(f"Generating {label} input...")
+            images[label] = (width, height, make_image(width, height, os.path.join(workdir, f"{label}.png")))
+
+        if lama_model is None and ({'lama', 'protocol'} & set(suites)):
+            try:
+                lama_model = stub_models.make_tiny_lama(os.path.join(workdir, 'tiny_lama.onnx'))
+            except ImportError:
+                log("onnx not installed: skipping lama/protocol suites (or pass --lama-model)")
+                suites = [s for s in suites if s not in ('lama', 'protocol')]
+
+        report = {'meta': {}, 'config': {'suites': suites, 'sizes': list(images), 'repeat': repeat,
+                                         'upscale': upscale, 'lama_model': lama_model,
+                                         'stub_ms_per_mp': stub_models.MS_PER_MEGAPIXEL},
+                  'suites': {}}
+        for suite in suites:
+            start = time.time()
+            try:
+                report['suites'][suite] = SUITES[suite](images=images, repeat=repeat, upscale=upscale,
+                                                        lama_model=lama_model, workdir=workdir)
+            except ImportError as e:
+                log(f"{suite}: skipped ({e})")
+                report['suites'][suite] = {'skipped': str(e)}
+            log(f"{suite}: {time.time() - start:.1f}s")
+        report['meta'] = metadata()
+
+    text = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, 'w') as f:
+            f.write(text + '\n')
+        log(f"Results: {output_path}")
+    else:
+        print(text)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+CPU stand-ins used by the benchmark suite
+
+  StubInferenceLoop   same surface armscaler_server uses from DiffBIR's
+                      InferenceLoop (args, setup, load_lq, captioner,
+                      pipeline.run); the "model" is a bicubic upscale, plus
+                      BENCH_STUB_MS_PER_MP of simulated compute if set
+  make_tiny_lama()    LaMa-shaped ONNX model (image [N,3,512,512], mask
+                      [N,1,512,512]) doing one 3x3 conv + blend; needs `onnx`
+
+Run directly, it is armscaler_server.py backed by the stub loop:
+
+    python3 benchmarks/stub_models.py [--socket PATH] [--idle-timeout S]
+"""
+
+import os
+import sys
+import time
+import types
+
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+MS_PER_MEGAPIXEL = float(os.environ.get('BENCH_STUB_MS_PER_MP', '0'))
+
+
+class StubPipeline:
+    """pipeline.run(lq [N,H,W,3] uint8, steps, ...) → N uint8 images, upscaled"""
+
+    def __init__(self, args):
+        self.args = args
+        self.calls = 0
+
+    def run(self, lq, steps, *rest):
+        self.calls += 1
+        samples = []
+        for image in lq:
+            h, w = image.shape[:2]
+            size = (w * int(self.args.upscale), h * int(self.args.upscale))
+            samples.append(np.asarray(Image.fromarray(image).resize(size, Image.BICUBIC)))
+            if MS_PER_MEGAPIXEL:
+                time.sleep(size[0] * size[1] / 1e6 * MS_PER_MEGAPIXEL / 1000)
+        return samples
+
+
+class StubInferenceLoop:
+    """Drop-in for diffbir.inference.loop.InferenceLoop, no weights, no GPU"""
+
+    def __init__(self, args):
+        self.args = args
+        self.pipeline = StubPipeline(args)
+        self.setup_calls = 0
+
+    def setup(self):
+        self.setup_calls += 1
+
+    def load_lq(self):
+        yield Image.open(self.args.input).convert('RGB')
+
+    def captioner(self, lq):
+        return ''
+
+
+def install_stub_loop():
+    """Make `from diffbir.inference.loop import InferenceLoop` return the stub"""
+    loop_module = types.ModuleType('diffbir.inference.loop')
+    loop_module.InferenceLoop = StubInferenceLoop
+    inference_module = types.ModuleType('diffbir.inference')
+    inference_module.loop = loop_module
+    diffbir_module = types.ModuleType('diffbir')
+    diffbir_module.inference = inference_module
+    sys.modules['diffbir'] = diffbir_module
+    sys.modules['diffbir.inference'] = inference_module
+    sys.modules['diffbir.inference.loop'] = loop_module
+
+
+def make_tiny_lama(path):
+    """Write a tiny LaMa-compatible ONNX model to path (dynamic batch); returns path"""
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    size = 512
+    weight = np.full((3, 1, 3, 3), 1.0 / 9, dtype=np.float32)  # per-channel box blur
+    nodes = [
+        helper.make_node('Conv', ['image', 'weight'], ['blurred'], group=3, pads=[1, 1, 1, 1]),
+        helper.make_node('Sub', ['one', 'mask'], ['keep']),
+        helper.make_node('Mul', ['image', 'keep'], ['kept']),
+        helper.make_node('Mul', ['blurred', 'mask'], ['filled']),
+        helper.make_node('Add', ['kept', 'filled'], ['output']),
+    ]
+    graph = helper.make_graph(
+        nodes, 'tiny_lama',
+        [helper.make_tensor_value_info('image', TensorProto.FLOAT, ['batch', 3, size, size]),
+         helper.make_tensor_value_info('mask', TensorProto.FLOAT, ['batch', 1, size, size])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, ['batch', 3, size, size])],
+        initializer=[numpy_helper.from_array(weight, 'weight'),
+                     numpy_helper.from_array(np.ones((1,), np.float32), 'one')])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+if __name__ == '__main__':
+    install_stub_loop()
+    import armscaler_server
+    if not armscaler_server.DIFFBIR_DIR.exists():
+        armscaler_server.DIFFBIR_DIR = armscaler_server.SCRIPT_DIR  # only checked for existence
+    sys.exit(armscaler_server.main(sys.argv[1:]))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+ARMscaler capability probe: hardware + setup status without importing torch.
+
+The expensive part (torch/CUDA device query, onnxruntime providers) runs
+once in a child process and is saved to a snapshot file. The snapshot is
+keyed by a cheap fingerprint: NVIDIA driver version, installed torch
+version (package metadata, not an import), interpreter, visible devices,
+and the DiffBIR weights directory mtime. Later status calls:
+
+  1. ask the resident armscaler_server.py if one is listening (it has
+     torch loaded already and knows whether the models are resident),
+  2. else answer from the snapshot if the fingerprint still matches,
+  3. else re-probe and rewrite the snapshot.
+
+    python3 capability_probe.py [--refresh] [--no-server]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+from pathlib import Path
+
+from result_cache import CACHE_ROOT
+import zygote
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+DIFFBIR_DIR = SCRIPT_DIR / 'diffbir_engine'
+SNAPSHOT_PATH = Path(os.environ.get('ARMSCALER_PROBE_SNAPSHOT', CACHE_ROOT / 'capabilities.json'))
+SOCKET_PATH = os.environ.get(
+    'ARMSCALER_SOCKET', os.path.join(tempfile.gettempdir(), 'armscaler_server.sock'))
+SERVER_TIMEOUT = 0.5
+PROBE_TIMEOUT = 120
+
+
+def check_setup():
+    if not DIFFBIR_DIR.exists():
+        return False, "DiffBIR not found"
+    if not (DIFFBIR_DIR / 'inference.py').exists():
+        return False, "inference.py not found"
+    return True, "OK"
+
+
+def _driver_version():
+    """NVIDIA kernel module version from /proc or /sys (None without a driver)"""
+    for path in ('/sys/module/nvidia/version', '/proc/driver/nvidia/version'):
+        try:
+            with open(path) as f:
+                return f.readline().strip()
+        except OSError:
+            continue
+    return None
+
+
+def _package_version(name):
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def fingerprint():
+    """Everything that would change the probe result, all readable in milliseconds"""
+    return {
+        'driver': _driver_version(),
+        'torch': _package_version('torch'),
+        'onnxruntime': _package_version('onnxruntime') or _package_version('onnxruntime-gpu'),
+        'python': sys.executable,
+        'cuda_visible_devices': os.environ.get('CUDA_VISIBLE_DEVICES'),
+        'weights_mtime': _mtime(DIFFBIR_DIR / 'weights'),
+        'inference_py': (DIFFBIR_DIR / 'inference.py').exists(),
+    }
+
+
+def detect():
+    """The slow probe (imports torch); run in a child process by probe()"""
+    result = {'gpu': {'available': False, 'name': 'CPU', 'vram_gb': 0}, 'devices': [],
+              'torch': None, 'cuda': None, 'onnx_providers': []}
+    try:
+        import torch
+        result['torch'] = torch.__version__
+        result['cuda'] = getattr(torch.version, 'cuda', None)
+        if torch.cuda.is_available():
+            for index in range(torch.cuda.device_count()):
+                props = torch.cuda.get_device_properties(index)
+                capability = torch.cuda.get_device_capability(index)
+                result['devices'].append({
+                    'index': index,
+                    'name': torch.cuda.get_device_name(index),
+                    'vram_gb': round(props.total_memory / 1024**3, 1),
+                    'cuda_capability': list(capability),
+                    'is_ampere': capability[0] >= 8,
+                })
+            result['gpu'] = dict(result['devices'][0], available=True)
+            del result['gpu']['index']
+    except Exception as e:
+        result['torch_error'] = str(e)
+    try:
+        import onnxruntime as ort
+        result['onnx_providers'] = ort.get_available_providers()
+    except Exception:
+        pass
+    return result
+
+
+def probe():
+    """Run detect() in a fresh interpreter so torch never lands in the caller"""
+    proc = subprocess.run(zygote.command([str(Path(__file__).resolve()), '--detect']),
+                          capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"Probe failed: {proc.stderr.strip()[-500:]}")
+    return json.loads(lines[-1])
+
+
+def load_snapshot():
+    try:
+        with open(SNAPSHOT_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_snapshot(snapshot):
+    SNAPSHOT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = SNAPSHOT_PATH.with_name(f"{SNAPSHOT_PATH.name}.tmp{os.getpid()}")
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(tmp, SNAPSHOT_PATH)
+
+
+def capabilities(refresh=False):
+    """(probe result, source): the snapshot if still valid, else a fresh probe"""
+    current = fingerprint()
+    snapshot = None if refresh else load_snapshot()
+    if snapshot is not None and snapshot.get('fingerprint') == current:
+        return snapshot, 'snapshot'
+    snapshot = dict(probe(), fingerprint=current, probed_at=time.time())
+    try:
+        save_snapshot(snapshot)
+    except OSError:
+        pass
+    return snapshot, 'probe'
+
+
+def ask_server(socket_path=SOCKET_PATH, timeout=SERVER_TIMEOUT):
+    """Status from a running armscaler_server.py, or None if none answers quickly"""
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(b'{"action": "status"}\n')
+        with sock.makefile('r', encoding='utf-8') as reader:
+            return json.loads(reader.readline())
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def _models_downloaded():
+    weights_dir = DIFFBIR_DIR / 'weights'
+    return len(list(weights_dir.glob('*.pth'))) if weights_dir.exists() else 0
+
+
+def status(refresh=False, use_server=True):
+    """Status dict for the UI (same keys as before, plus 'source')"""
+    ok, msg = check_setup()
+    result = {
+        'available': ok, 'ready': ok, 'setup_complete': ok,
+        'message': msg, 'models_downloaded': _models_downloaded(), 'models_loaded': False,
+    }
+
+    server = ask_server() if use_server and not refresh else None
+    if server is not None and 'gpu' in server:
+        result.update(gpu=server['gpu'], models_loaded=bool(server.get('models_loaded')),
+                      server_pid=server.get('pid'), source='server')
+        return result
+
+    try:
+        caps, source = capabilities(refresh)
+    except (OSError, RuntimeError, subprocess.SubprocessError) as e:
+        result.update(gpu={'available': False, 'name': 'Unknown', 'vram_gb': 0},
+                      source='error', probe_error=str(e))
+        return result
+    result.update(gpu=caps['gpu'], devices=caps.get('devices', []), torch=caps.get('torch'),
+                  cuda=caps.get('cuda'), onnx_providers=caps.get('onnx_providers', []),
+                  probed_at=caps.get('probed_at'), source=source)
+    return result
+
+
+if __name__ == '__main__':
+    if '--detect' in sys.argv:
+        print(json.dumps(detect()))
+        sys.exit(0)
+    print(json.dumps(status(refresh='--refresh' in sys.argv, use_server='--no-server' not in sys.argv)))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Job durations predicted from past runs.
+
+Every finished job appends one line to ~/.cache/zarma/job_timings.jsonl
+(ARMSCALER_TIMINGS): host, device, mode (server or oneshot), task, upscale,
+quality, steps, restored input size, batch, tile plan, stage timings and
+seconds per job. The file keeps roughly the newest MAX_RECORDS lines.
+
+A job's work is output megapixels x sampling steps. For each (device, mode,
+task) on this host, seconds = overhead + rate x work is fitted by least
+squares over the newest FIT_WINDOW runs. Fewer runs fall back to the
+device's other tasks, then to built-in priors. That gives:
+
+  predict()   expected seconds for a job before it runs
+  timeout()   a generous limit derived from a prediction
+  sjf_key()   shortest-job-first order with aging: each second spent
+              waiting takes AGING seconds off a job's predicted length, so a
+              long job is passed over for at most about its own duration
+
+    python3 cost_model.py [--device NAME] [--mode server|oneshot]   # fitted models
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+from pathlib import Path
+
+from result_cache import CACHE_ROOT
+
+STORE_PATH = Path(os.environ.get('ARMSCALER_TIMINGS', CACHE_ROOT / 'job_timings.jsonl'))
+ENABLED = os.environ.get('ARMSCALER_COST_MODEL', '1') != '0'
+MAX_RECORDS = 5000
+FIT_WINDOW = 200
+MIN_FIT_SAMPLES = 3
+PRESET_STEPS = {'turbo': 8, 'fast': 15, 'balanced': 25, 'quality': 40}
+DEFAULT_SIZE = (512, 512)  # when the input can't be measured
+
+# Priors until a device has history: seconds per output megapixel per step,
+# and fixed seconds per job (a one-shot run loads the models every time)
+PRIOR_RATE = {'gpu': 0.8, 'cpu': 30.0}
+PRIOR_OVERHEAD = {'server': 2.0, 'oneshot': 60.0}
+
+# Scheduling: 'sjf' (shortest predicted job first, with aging) or 'fifo'
+SCHEDULER = os.environ.get('ARMSCALER_SCHEDULER', 'sjf')
+AGING = float(os.environ.get('ARMSCALER_SJF_AGING', '1.0'))
+
+# Timeouts: a multiple of the prediction plus a margin, never below the minimum
+TIMEOUT_FACTOR = float(os.environ.get('ARMSCALER_TIMEOUT_FACTOR', '3'))
+TIMEOUT_MARGIN = 120.0
+MIN_TIMEOUT = 300.0
+
+
+def steps_for(quality):
+    return PRESET_STEPS.get(quality, PRESET_STEPS['balanced'])
+
+
+def work(input_size, upscale, steps):
+    """Output megapixels x sampling steps"""
+    width, height = input_size or DEFAULT_SIZE
+    return width * upscale * height * upscale / 1e6 * steps
+
+
+def timeout(predicted):
+    return max(MIN_TIMEOUT, predicted * TIMEOUT_FACTOR + TIMEOUT_MARGIN)
+
+
+def sjf_key(priority, predicted, created, now=None):
+    """Sort key for queued jobs: higher priority first, then shortest (aged) prediction"""
+    if SCHEDULER == 'fifo':
+        return (-priority, created)
+    waited = (now or time.time()) - created
+    return (-priority, predicted - AGING * waited, created)
+
+
+def fit(points):
+    """(overhead, rate) for seconds = overhead + rate x work over [(work, seconds)]"""
+    points = [(x, y) for x, y in points if x > 0 and y > 0]
+    if not points:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if n >= MIN_FIT_SAMPLES and var > 1e-9 * mean_x ** 2:
+        rate = sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+        overhead = mean_y - rate * mean_x
+        if rate > 0 and overhead >= 0:
+            return overhead, rate
+        if rate > 0:  # negative intercept: refit through the origin
+            return 0.0, sum(x * y for x, y in points) / sum(x * x for x, _ in points)
+    ratios = sorted(y / x for x, y in points)
+    return 0.0, ratios[len(ratios) // 2]
+
+
+class CostModel:
+    """Timing store plus fitted per-(device, mode, task) models for this host"""
+
+    def __init__(self, path=STORE_PATH, enabled=ENABLED):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.host = socket.gethostname()
+        self._records = None  # this host's runs, oldest first (loaded lazily)
+        self._lines = 0  # lines in the file, every host
+        self._fits = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._records is not None:
+            return
+        records = []
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('host') == self.host:
+                        records.append(record)
+        except OSError:
+            pass
+        self._records = records[-MAX_RECORDS:]
+
+    def record(self, device, mode, task, upscale, quality, input_size, seconds, steps=None, **extra):
+        """Store one finished job (`extra`: batch, tiles, stages, ...)"""
+        if not self.enabled or seconds <= 0:
+            return
+        steps = steps or steps_for(quality)
+        entry = dict(extra, host=self.host, time=round(time.time(), 1), device=device, mode=mode,
+                     task=task, upscale=upscale, quality=quality, steps=steps,
+                     input_size=list(input_size) if input_size else None,
+                     work=round(work(input_size, upscale, steps), 4), seconds=round(seconds, 3))
+        with self._lock:
+            self._load()
+            self._records.append(entry)
+            del self._records[:-MAX_RECORDS]
+            self._fits.clear()
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+                self._lines += 1
+                if self._lines > 2 * MAX_RECORDS:
+                    self._compact()
+            except OSError as e:
+                print(f"  Cost model: could not write {self.path}: {e}", file=sys.stderr, flush=True)
+
+    def _compact(self):
+        """Rewrite the file with its newest MAX_RECORDS lines (caller holds the lock)"""
+        with open(self.path) as f:
+            lines = f.readlines()[-MAX_RECORDS:]
+        tmp = self.path.with_name(self.path.name + f'.{os.getpid()}')
+        with open(tmp, 'w') as f:
+            f.writelines(lines)
+        os.replace(tmp, self.path)
+        self._lines = len(lines)
+
+    def model(self, device, mode, task):
+        """{'overhead', 'rate', 'samples', 'basis'} for a job on this host"""
+        key = (device, mode, task)
+        with self._lock:
+            if key in self._fits:
+                return self._fits[key]
+            self._load()
+            records = self._records if self.enabled else []
+            result = None
+            for basis, match in (('task', lambda r: r.get('task') == task), ('device', lambda r: True)):
+                points = [(r['work'], r['seconds']) for r in records
+                          if r.get('device') == device and r.get('mode') == mode and match(r)][-FIT_WINDOW:]
+                fitted = fit(points)
+                if fitted and (basis == 'device' or len(points) >= MIN_FIT_SAMPLES):
+                    result = {'overhead': fitted[0], 'rate': fitted[1], 'samples': len(points), 'basis': basis}
+                    break
+            if result is None:
+                rate = PRIOR_RATE['cpu' if str(device).startswith('cpu') else 'gpu']
+                result = {'overhead': PRIOR_OVERHEAD.get(mode, 0.0), 'rate': rate, 'samples': 0, 'basis': 'prior'}
+            self._fits[key] = result
+            return result
+
+    def predict(self, device, mode, task, upscale, quality, input_size, steps=None):
+        """Expected seconds for one job"""
+        fitted = self.model(device, mode, task)
+        return fitted['overhead'] + fitted['rate'] * work(input_size, upscale, steps or steps_for(quality))
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            groups = sorted({(r.get('device'), r.get('mode'), r.get('task')) for r in self._records},
+                            key=lambda g: tuple(str(v) for v in g))
+        models = {'|'.join(str(v) for v in group): self.model(*group) for group in groups}
+        return {'enabled': self.enabled, 'scheduler': SCHEDULER, 'records': len(self._records),
+                'models': {k: dict(v, overhead=round(v['overhead'], 2), rate=round(v['rate'], 4))
+                           for k, v in models.items()}}
+
+
+def main(argv):
+    device = mode = None
+    i = 0
+    while i < len(argv):
+        if argv[i] == '--device' and i + 1 < len(argv):
+            device = argv[i + 1]
+            i += 2
+        elif argv[i] == '--mode' and i + 1 < len(argv):
+            mode = argv[i + 1]
+            i += 2
+        else:
+            print(f"Usage: {sys.argv[0]} [--device NAME] [--mode server|oneshot]", file=sys.stderr)
+            return 1
+    stats = CostModel().stats()
+    stats['models'] = {k: v for k, v in stats['models'].items()
+                       if (device is None or k.split('|')[0] == device)
+                       and (mode is None or k.split('|')[1] == mode)}
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+CPU thread settings for the two engines (torch for DiffBIR, onnxruntime for
+LaMa), from a per-host calibration profile.
+
+`calibrate` times representative kernels (3x3 conv, matmul, attention,
+group norm) and a LaMa pass at several thread counts and core layouts, each
+in a fresh child process, and stores every measurement per host in
+~/.cache/zarma/cpu_profile.json (ZARMA_CPU_PROFILE). Layouts:
+
+  unpinned  threads only, the scheduler places them
+  physical  pinned to one logical CPU per physical core
+  smt       pinned with hyperthread siblings packed together
+
+At startup each engine calls `apply(engine)`, which picks the fastest
+measured setting that fits the cores this process may use (within 5%, the
+one with fewer threads). When ZARMA_CPU_SHARE=N processes share those cores
+each gets 1/N of them, and a process that knows its ZARMA_CPU_SLOT (the
+dispatcher sets both) is pinned to its own slice. Without a profile the
+thread count is the number of physical cores available. Explicit
+OMP_NUM_THREADS / MKL_NUM_THREADS still win, ZARMA_CPU_THREADS forces a
+count, and ZARMA_CPU_TUNING=0 restores the old fixed 8 threads.
+
+    python3 cpu_tuning.py calibrate [--engines torch,onnx] [--variant V] [--repeats N] [--max-threads N]
+    python3 cpu_tuning.py show [--engine torch|onnx]
+    python3 cpu_tuning.py run torch|onnx SCRIPT [ARGS...]
+
+`run` applies the plan and then runs SCRIPT as __main__, for one-shot
+children (DiffBIR's inference.py) that don't call `apply` themselves.
+"""
+
+import os
+import sys
+import json
+import time
+import runpy
+import socket
+import subprocess
+from pathlib import Path
+
+from result_cache import CACHE_ROOT
+
+PROFILE_PATH = Path(os.environ.get('ZARMA_CPU_PROFILE', CACHE_ROOT / 'cpu_profile.json'))
+ENABLED = os.environ.get('ZARMA_CPU_TUNING', '1') != '0'
+ENGINES = ('torch', 'onnx')
+LAYOUTS = ('unpinned', 'physical', 'smt')
+FALLBACK_THREADS = 8  # the fixed count used before calibration existed
+TIE_MARGIN = 0.05  # within this of the fastest, fewer threads wins
+DEFAULT_REPEATS = 5
+BENCH_TIMEOUT = 600
+
+_plans = {}  # engine -> plan, fixed at first use (apply() narrows the affinity)
+
+
+def log(msg):
+    print(f"  {msg}", file=sys.stderr, flush=True)
+
+
+# ── Host and topology ──
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return 'unknown'
+
+
+def host_key():
+    """Profiles are per host: name, CPU model and logical CPU count"""
+    return f"{socket.gethostname()}|{_cpu_model()}|{os.cpu_count()}"
+
+
+def _siblings(cpu):
+    try:
+        with open(f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list') as f:
+            spec = f.read().strip()
+    except OSError:
+        return (cpu,)
+    cpus = []
+    for part in spec.split(','):
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return tuple(cpus)
+
+
+def physical_cores(cpus):
+    """`cpus` grouped by physical core, in order: [[0, 32], [1, 33], ...]"""
+    allowed, groups, seen = set(cpus), [], set()
+    for cpu in sorted(cpus):
+        if cpu in seen:
+            continue
+        group = [c for c in _siblings(cpu) if c in allowed] or [cpu]
+        seen.update(group)
+        groups.append(group)
+    return groups
+
+
+def layout_cores(cpus, layout, threads):
+    """The CPUs to pin `threads` threads to under `layout` (None = don't pin)"""
+    groups = physical_cores(cpus)
+    if layout == 'physical':
+        return [group[0] for group in groups][:threads] if threads <= len(groups) else None
+    if layout == 'smt':
+        return [cpu for group in groups for cpu in group][:threads]
+    return None
+
+
+def _share():
+    share = max(1, int(os.environ.get('ZARMA_CPU_SHARE', '1') or 1))
+    slot = os.environ.get('ZARMA_CPU_SLOT')
+    return share, (int(slot) % share if slot not in (None, '') else None)
+
+
+def _available():
+    """(CPUs this process may use, whether they are its own slice)"""
+    cpus = sorted(os.sched_getaffinity(0))
+    share, slot = _share()
+    if share == 1:
+        return cpus, False
+    groups = physical_cores(cpus)
+    if slot is None or len(groups) < share:
+        return cpus, False
+    start, end = slot * len(groups) // share, (slot + 1) * len(groups) // share
+    return [cpu for group in groups[start:end] for cpu in group], True
+
+
+# ── Profile ──
+
+def load_profile():
+    try:
+        with open(PROFILE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def host_profile():
+    return load_profile().get('hosts', {}).get(host_key())
+
+
+def save_host_profile(entry):
+    profile = load_profile()
+    profile.setdefault('hosts', {})[host_key()] = entry
+    PROFILE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = PROFILE_PATH.with_name(PROFILE_PATH.name + f'.{os.getpid()}')
+    with open(tmp, 'w') as f:
+        json.dump(profile, f, indent=1)
+    os.replace(tmp, PROFILE_PATH)
+
+
+def best(results, max_threads):
+    """Fastest measurement with at most `max_threads` threads (fewer threads on a near tie)"""
+    fits = [r for r in results if r['threads'] <= max_threads and r.get('seconds')]
+    if not fits:
+        return None
+    fastest = min(r['seconds'] for r in fits)
+    close = [r for r in fits if r['seconds'] <= fastest * (1 + TIE_MARGIN)]
+    return min(close, key=lambda r: (r['threads'], r['seconds']))
+
+
+def plan(engine):
+    """{'threads', 'inter_op', 'layout', 'cores' (to pin to, or None), 'source'} for this process"""
+    if engine in _plans:
+        return _plans[engine]
+    cpus, own_slice = _available()
+    share, _ = _share()
+    budget = len(cpus) if own_slice else max(1, len(cpus) // share)
+    result = {'threads': None, 'inter_op': 1, 'layout': 'unpinned', 'cores': None, 'source': None}
+    forced = os.environ.get('ZARMA_CPU_THREADS')
+    if not ENABLED:
+        result.update(threads=FALLBACK_THREADS, source='fixed')
+    elif forced:
+        result.update(threads=int(forced), source='ZARMA_CPU_THREADS')
+    else:
+        entry = host_profile() or {}
+        choice = best(entry.get(engine, []), budget)
+        if choice:
+            result.update(threads=choice['threads'], layout=choice['layout'], source='profile')
+        else:
+            physical = len(physical_cores(cpus))
+            result.update(threads=max(1, physical if own_slice else physical // share), source='default')
+        if result['layout'] != 'unpinned':
+            result['cores'] = layout_cores(cpus, result['layout'], result['threads'])
+        if result['cores'] is None and own_slice:
+            result['cores'] = cpus
+    _plans[engine] = result
+    return result
+
+
+def apply(engine):
+    """Thread env defaults and CPU affinity for `engine`; call before importing torch/onnxruntime.
+
+    The env only counts until torch reads it at import, so an already
+    imported torch (e.g. in a zygote child) gets set_num_threads as well.
+    """
+    chosen = plan(engine)
+    if engine == 'torch':
+        os.environ.setdefault('OMP_NUM_THREADS', str(chosen['threads']))
+        os.environ.setdefault('MKL_NUM_THREADS', str(chosen['threads']))
+    if chosen['cores']:
+        try:
+            os.sched_setaffinity(0, chosen['cores'])
+        except OSError as e:
+            log(f"CPU tuning: could not pin to {chosen['cores']}: {e}")
+    if engine == 'torch' and 'torch' in sys.modules:
+        _set_torch_threads(sys.modules['torch'], chosen)
+    return chosen
+
+
+def _set_torch_threads(torch, chosen):
+    """torch's intra-op threads from OMP_NUM_THREADS (explicit settings still win), else the plan"""
+    threads = os.environ.get('OMP_NUM_THREADS', '')
+    torch.set_num_threads(int(threads) if threads.isdigit() and int(threads) > 0 else chosen['threads'])
+
+
+def run_script(engine, argv):
+    """Apply the plan for `engine`, then run argv[0] as __main__ with argv"""
+    chosen = apply(engine)
+    if engine == 'torch':
+        import torch  # the script imports it anyway
+        _set_torch_threads(torch, chosen)
+    log(f"CPU threads: {describe(chosen)}")
+    sys.argv = list(argv)
+    sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+    runpy.run_path(argv[0], run_name='__main__')
+    return 0
+
+
+def describe(chosen):
+    pinned = f", pinned to {len(chosen['cores'])} CPU(s)" if chosen['cores'] else ''
+    return f"{chosen['threads']} thread(s), {chosen['layout']}{pinned} ({chosen['source']})"
+
+
+# ── Calibration ──
+
+def _time(fn, repeats):
+    fn()  # warm-up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def _bench_torch(threads, repeats):
+    import torch
+    import torch.nn.functional as F
+    torch.set_num_threads(threads)
+    x = torch.randn(1, 64, 128, 128)
+    weight = torch.randn(64, 64, 3, 3)
+    a = torch.randn(1024, 1024)
+    q = torch.randn(1, 8, 1024, 64)
+
+    def step():
+        with torch.inference_mode():
+            F.conv2d(x, weight, padding=1)
+            a @ a
+            F.scaled_dot_product_attention(q, q, q)
+            F.group_norm(x, 32)
+
+    return _time(step, repeats)
+
+
+def _bench_onnx(threads, repeats, variant=None):
+    import numpy as np
+    import inpaint_lama
+    model = inpaint_lama.resolve_model_path(variant=variant)
+    session = inpaint_lama.load_model(model, optimized_cache=False)
+    inputs = session.get_inputs()
+    img = np.random.rand(1, 3, inpaint_lama.LAMA_SIZE, inpaint_lama.LAMA_SIZE).astype(np.float32)
+    mask = np.zeros((1, 1, inpaint_lama.LAMA_SIZE, inpaint_lama.LAMA_SIZE), np.float32)
+    mask[:, :, 192:320, 192:320] = 1
+    feed = {inputs[0].name: img, inputs[1].name: mask}
+    return _time(lambda: session.run(None, feed), repeats)
+
+
+def _candidates(max_threads):
+    cpus = sorted(os.sched_getaffinity(0))
+    limit = min(max_threads or len(cpus), len(cpus))
+    physical = len(physical_cores(cpus))
+    counts = {limit, physical if physical <= limit else limit}
+    n = 1
+    while n < limit:
+        counts.add(n)
+        n *= 2
+    for threads in sorted(counts):
+        yield threads, 'unpinned', None
+        cores = layout_cores(cpus, 'physical', threads)
+        if cores:
+            yield threads, 'physical', cores
+        if physical < len(cpus):
+            yield threads, 'smt', layout_cores(cpus, 'smt', threads)
+
+
+def _measure(engine, threads, cores, repeats, variant):
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads),
+               ZARMA_CPU_THREADS=str(threads), CUDA_VISIBLE_DEVICES='')
+    env.pop('ZARMA_CPU_SHARE', None)
+    env.pop('ZARMA_CPU_SLOT', None)
+    cmd = [sys.executable, str(Path(__file__).resolve()), '_bench', engine, str(threads), str(repeats)]
+    if variant:
+        cmd.append(variant)
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env, timeout=BENCH_TIMEOUT,
+                          preexec_fn=(lambda: os.sched_setaffinity(0, cores)) if cores else None)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(proc.stderr.strip()[-300:] or f"exit {proc.returncode}")
+    return json.loads(lines[-1])['seconds']
+
+
+def calibrate(engines=ENGINES, repeats=DEFAULT_REPEATS, max_threads=None, variant=None):
+    entry = dict(host_profile() or {}, host=host_key(), cpus=os.cpu_count(), calibrated=time.time())
+    for engine in engines:
+        results = []
+        log(f"Calibrating {engine}...")
+        for threads, layout, cores in _candidates(max_threads):
+            try:
+                seconds = _measure(engine, threads, cores, repeats, variant)
+            except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+                log(f"  {threads:3d} thread(s) {layout:9s} failed: {e}")
+                continue
+            results.append({'threads': threads, 'layout': layout, 'seconds': round(seconds, 5)})
+            log(f"  {threads:3d} thread(s) {layout:9s} {seconds * 1000:9.1f} ms")
+        if results:
+            entry[engine] = results
+            choice = best(results, len(os.sched_getaffinity(0)))
+            log(f"Best for {engine}: {choice['threads']} thread(s), {choice['layout']}")
+    save_host_profile(entry)
+    log(f"Profile saved to {PROFILE_PATH}")
+    return entry
+
+
+def main(argv):
+    if argv and argv[0] == '_bench':
+        engine, threads, repeats = argv[1], int(argv[2]), int(argv[3])
+        variant = argv[4] if len(argv) > 4 else None
+        seconds = _bench_torch(threads, repeats) if engine == 'torch' else _bench_onnx(threads, repeats, variant)
+        print(json.dumps({'seconds': seconds}))
+        return 0
+    if argv and argv[0] == 'run':
+        if len(argv) < 3 or argv[1] not in ENGINES:
+            print(f"Usage: {sys.argv[0]} run torch|onnx SCRIPT [ARGS...]", file=sys.stderr)
+            return 1
+        return run_script(argv[1], argv[2:])
+    if not argv or argv[0] not in ('calibrate', 'show'):
+        print(f"Usage: {sys.argv[0]} calibrate [--engines torch,onnx] [--variant V] [--repeats N] [--max-threads N]",
+              file=sys.stderr)
+        print(f"       {sys.argv[0]} show [--engine torch|onnx]", file=sys.stderr)
+        print(f"       {sys.argv[0]} run torch|onnx SCRIPT [ARGS...]", file=sys.stderr)
+        return 1
+    opts = {'engines': ENGINES, 'variant': None, 'repeats': DEFAULT_REPEATS, 'max_threads': None}
+    i = 1
+    while i < len(argv):
+        if argv[i] == '--engines' and i + 1 < len(argv):
+            opts['engines'] = tuple(e for e in argv[i + 1].split(',') if e)
+            i += 2
+        elif argv[i] == '--engine' and i + 1 < len(argv):
+            opts['engines'] = (argv[i + 1],)
+            i += 2
+        elif argv[i] == '--variant' and i + 1 < len(argv):
+            opts['variant'] = argv[i + 1]
+            i += 2
+        elif argv[i] == '--repeats' and i + 1 < len(argv):
+            opts['repeats'] = int(argv[i + 1])
+            i += 2
+        elif argv[i] == '--max-threads' and i + 1 < len(argv):
+            opts['max_threads'] = int(argv[i + 1])
+            i += 2
+        else:
+            print(f"Unknown option: {argv[i]}", file=sys.stderr)
+            return 1
+    unknown = [e for e in opts['engines'] if e not in ENGINES]
+    if unknown:
+        print(f"Unknown engine: {', '.join(unknown)} (expected {', '.join(ENGINES)})", file=sys.stderr)
+        return 1
+    if argv[0] == 'calibrate':
+        calibrate(opts['engines'], opts['repeats'], opts['max_threads'], opts['variant'])
+        return 0
+    print(json.dumps({'host': host_key(), 'profile': host_profile(),
+                      'plans': {engine: plan(engine) for engine in opts['engines']}}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Out-of-core tiling for images whose upscaled result doesn't fit in RAM.
+
+The input is mapped (raw and uncompressed RGB files) or decoded once and
+spilled to a raw file on disk, then read one tile at a time. Each processed
+tile is feather-blended into a memory-mapped raw RGB canvas (raw_transport
+format) in raster order: only its left and top overlap bands are blended,
+the rest is copied. Finished rows are flushed and dropped from the page
+cache, so peak memory follows the tile size, not the output size. A
+compressed input is the exception: its decoded pixels are held while they
+are spilled.
+"""
+
+import os
+import io
+import mmap
+import base64
+
+import numpy as np
+from PIL import Image
+
+from raw_transport import HEADER, create_raw, read_header
+
+ALIGN = 8
+SPILL_STRIP_BYTES = 16 << 20  # decoded rows copied to the spill file at a time
+
+
+def tile_spans(length, tile, overlap):
+    """(start, end) spans covering `length`; the last one is shifted inward to stay full size"""
+    if length <= tile:
+        return [(0, length)]
+    stride = max(ALIGN, tile - overlap)
+    spans = []
+    start = 0
+    while True:
+        if start + tile >= length:
+            spans.append((length - tile, length))
+            return spans
+        spans.append((start, start + tile))
+        start += stride
+
+
+class RawCanvas:
+    """Writable (H, W, 3) uint8 view of a raw RGB file, backed by a shared mapping"""
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.width = width
+        self.height = height
+        create_raw(path, width, height)
+        with open(path, 'r+b') as f:
+            self._mm = mmap.mmap(f.fileno(), 0)
+        self.pixels = np.ndarray((height, width, 3), np.uint8, buffer=self._mm, offset=HEADER.size)
+
+    def release(self, rows):
+        """Write back rows [0, rows) and drop them from this process's resident set"""
+        self._mm.flush()
+        end = (HEADER.size + rows * self.width * 3) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end and hasattr(self._mm, 'madvise'):
+            self._mm.madvise(mmap.MADV_DONTNEED, 0, end)
+
+    def close(self):
+        self.pixels = None
+        self._mm.flush()
+        self._mm.close()
+
+
+def _ramp(length, overlap):
+    """Weights of the incoming tile along one axis: 0 -> 1 across the overlap, then 1"""
+    weights = np.ones(length, np.float32)
+    if overlap:
+        weights[:overlap] = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+    return weights
+
+
+def _mix(dst, src, weight):
+    dst[...] = (dst * (1 - weight) + src * weight + 0.5).astype(np.uint8)
+
+
+def blend_tile(canvas, tile, x, y, left, top):
+    """Write `tile` at (x, y), blending the `left`/`top` pixels already written by neighbours"""
+    h, w = tile.shape[:2]
+    region = canvas[y:y + h, x:x + w]
+    region[top:, left:] = tile[top:, left:]
+    wy, wx = _ramp(h, top), _ramp(w, left)
+    if top:
+        _mix(region[:top], tile[:top], np.minimum.outer(wy[:top], wx)[..., None])
+    if left:
+        _mix(region[top:, :left], tile[top:, :left], np.minimum.outer(wy[top:], wx[:left])[..., None])
+
+
+def _mappable(image):
+    """Pixel data offset if `image` is stored as uncompressed top-down RGB (PPM, plain TIFF), else None"""
+    if image.mode != 'RGB' or len(image.tile) != 1:
+        return None
+    codec, extents, offset, args = image.tile[0][:4]
+    rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+    width, height = image.size
+    if (codec != 'raw' or tuple(extents) != (0, 0, width, height) or rawmode != 'RGB'
+            or stride not in (0, width * 3) or orientation != 1):
+        return None
+    return offset
+
+
+def open_source(item, spill_dir):
+    """(H, W, 3) read-only pixel view of a job's input, and a cleanup callable.
+
+    Raw inputs, and files that store uncompressed RGB rows (PPM, plain TIFF),
+    are mapped directly. Compressed formats (PNG, JPEG, ...) can't be decoded
+    a strip at a time, so they are decoded once in memory - the input, not
+    the upscaled output - and spilled in row strips to a raw file in
+    spill_dir, so tiles never need the decoded copy.
+    """
+    if item.get('image_raw'):
+        width, height, channels = read_header(item['image_raw'])
+        pixels = np.memmap(item['image_raw'], np.uint8, 'r', offset=HEADER.size,
+                           shape=(height, width, channels))[:, :, :3]
+        return pixels, lambda: None
+    if item.get('image_path'):
+        image = Image.open(item['image_path'])
+        offset = _mappable(image)
+        if offset is not None:
+            width, height = image.size
+            image.close()
+            pixels = np.memmap(item['image_path'], np.uint8, 'r', offset=offset, shape=(height, width, 3))
+            return pixels, lambda: None
+    else:
+        image = Image.open(io.BytesIO(base64.b64decode(item.get('image_base64', ''))))
+    image = image.convert('RGB')
+    width, height = image.size
+    spill = os.path.join(spill_dir, f"armscaler_{item['job_id']}_input.rgb")
+    create_raw(spill, width, height)
+    target = np.memmap(spill, np.uint8, 'r+', offset=HEADER.size, shape=(height, width, 3))
+    rows = max(1, SPILL_STRIP_BYTES // (width * 3))
+    for top in range(0, height, rows):
+        target[top:top + rows] = np.asarray(image.crop((0, top, width, min(height, top + rows))))
+    target.flush()
+    del target, image
+    pixels = np.memmap(spill, np.uint8, 'r', offset=HEADER.size, shape=(height, width, 3))
+
+    def cleanup():
+        try:
+            os.unlink(spill)
+        except OSError:
+            pass
+    return pixels, cleanup
+
+
+def upscale_tiled(source, canvas, upscale, tile, overlap, run_tile, log=None):
+    """Run every input tile through run_tile (uint8 [h, w, 3] -> upscaled array) into canvas.
+
+    tile/overlap are in input pixels. Returns the number of tiles processed.
+    """
+    height, width = source.shape[:2]
+    rows, cols = tile_spans(height, tile, overlap), tile_spans(width, tile, overlap)
+    done = 0
+    for row, (y0, y1) in enumerate(rows):
+        top = (rows[row - 1][1] - y0) * upscale if row else 0
+        for col, (x0, x1) in enumerate(cols):
+            left = (cols[col - 1][1] - x0) * upscale if col else 0
+            out = run_tile(np.array(source[y0:y1, x0:x1]))
+            expected = ((x1 - x0) * upscale, (y1 - y0) * upscale)
+            if (out.shape[1], out.shape[0]) != expected:
+                out = np.asarray(Image.fromarray(out).resize(expected, Image.BICUBIC))
+            blend_tile(canvas.pixels, out, x0 * upscale, y0 * upscale, left, top)
+            done += 1
+        # Rows above the next tile row's overlap are final
+        canvas.release(rows[row + 1][0] * upscale if row + 1 < len(rows) else canvas.height)
+        if log:
+            log(f"Gigapixel: row {row + 1}/{len(rows)} ({done}/{len(rows) * len(cols)} tiles)")
+    return done
@@ -20,22 +20,58 @@ Pipeline:
 
 import sys
 import os
+import io
 import numpy as np
 from PIL import Image, ImageFilter, ImageDraw
 
+from result_cache import CACHE_ROOT, ResultCache, make_key, file_fingerprint
+import cpu_tuning
+
 LAMA_SIZE = 512
 WATERMARK_SIZE = 60
 REFINE_THRESHOLD = 80
+BATCH_SIZE = int(os.environ.get('LAMA_BATCH_SIZE', '8'))
+CANVAS_STRIP_BYTES = 1 << 20  # decoded rows copied into the canvas at a time
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+# Reduced-precision copies of lama_fp32.onnx, built and scored by lama_variants.py
+VARIANTS = ('fp32', 'fp16', 'int8_dynamic', 'int8_static')
+DEFAULT_VARIANT = os.environ.get('LAMA_VARIANT', 'fp32')
+DEFAULT_MODEL_PATH = os.path.join(MODELS_DIR, 'lama_fp32.onnx')
+
+# Graph-optimized copies of the model, so cold starts skip ORT_ENABLE_ALL
+OPTIMIZED_DIR = CACHE_ROOT / 'onnx'
+
+_sessions = {}
+
+
+class _BatchBuffers:
+    """Reusable [N,3,512,512] / [N,1,512,512] float32 input tensors (grown, never shrunk)"""
+
+    def __init__(self):
+        self.img = np.empty((0, 3, LAMA_SIZE, LAMA_SIZE), np.float32)
+        self.mask = np.empty((0, 1, LAMA_SIZE, LAMA_SIZE), np.float32)
+
+    def get(self, n):
+        if n > len(self.img):
+            self.img = np.empty((n, 3, LAMA_SIZE, LAMA_SIZE), np.float32)
+            self.mask = np.empty((n, 1, LAMA_SIZE, LAMA_SIZE), np.float32)
+        return self.img[:n], self.mask[:n]
+
+
+_buffers = _BatchBuffers()
+
+_result_cache = ResultCache(
+    'lama',
+    max_disk_bytes=int(os.environ.get('LAMA_CACHE_MB', '1024')) << 20,
+    enabled=os.environ.get('LAMA_CACHE', '1') != '0')
 
 
 def log(msg):
     print(f"  {msg}", file=sys.stderr)
 
 
-def load_model(model_path):
+def _providers():
     import onnxruntime as ort
-    opts = ort.SessionOptions()
-    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
     providers = ['CPUExecutionProvider']
     try:
         avail = ort.get_available_providers()
@@ -46,7 +82,116 @@ def load_model(model_path):
             log("GPU: CPU")
     except Exception:
         pass
-    return ort.InferenceSession(model_path, opts, providers=providers)
+    return providers
+
+
+def _optimized_path(model_path, providers):
+    """Optimized graph location, keyed by model file, ORT version and providers"""
+    import onnxruntime as ort
+    key = make_key(b'', model=file_fingerprint(model_path), ort=ort.__version__, providers=providers)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return OPTIMIZED_DIR / f"{stem}.{key[:16]}.onnx"
+
+
+def load_model(model_path, optimized_cache=True, profile_prefix=None):
+    """Create an InferenceSession; reuses a serialized optimized graph when one exists.
+
+    profile_prefix turns on onnxruntime profiling (session.end_profiling()
+    returns the trace path), so such a session is never shared.
+    """
+    import onnxruntime as ort
+
+    threads = cpu_tuning.plan('onnx')
+
+    def options(level):
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = level
+        opts.intra_op_num_threads = threads['threads']
+        opts.inter_op_num_threads = threads['inter_op']
+        if profile_prefix:
+            opts.enable_profiling = True
+            opts.profile_file_prefix = profile_prefix
+        return opts
+
+    providers = _providers()
+    full = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if not optimized_cache:
+        return ort.InferenceSession(model_path, options(full), providers=providers)
+
+    optimized = _optimized_path(model_path, providers)
+    if optimized.exists():
+        try:
+            session = ort.InferenceSession(str(optimized),
+                                           options(ort.GraphOptimizationLevel.ORT_DISABLE_ALL),
+                                           providers=providers)
+            log(f"Optimized graph: {optimized.name}")
+            return session
+        except Exception as e:
+            log(f"Optimized graph unusable ({e}), rebuilding")
+            optimized.unlink(missing_ok=True)
+
+    tmp = optimized.with_name(f"{optimized.name}.tmp{os.getpid()}")
+    try:
+        optimized.parent.mkdir(parents=True, exist_ok=True)
+        opts = options(full)
+        opts.optimized_model_filepath = str(tmp)
+        session = ort.InferenceSession(model_path, opts, providers=providers)
+        os.replace(tmp, optimized)
+        log(f"Saved optimized graph: {optimized.name}")
+        return session
+    except Exception as e:
+        log(f"Could not save optimized graph ({e})")
+        tmp.unlink(missing_ok=True)
+        return ort.InferenceSession(model_path, options(full), providers=providers)
+
+
+def get_session(model_path):
+    """Session for model_path, created once per process and kept warm"""
+    key = (os.path.abspath(model_path), file_fingerprint(model_path))
+    session = _sessions.get(key)
+    if session is None:
+        log("Loading LaMa model...")
+        session = load_model(model_path)
+        _sessions[key] = session
+    return session
+
+
+def run_profiled(job, model_path=None, profile_dir=None, variant=None):
+    """Run job(session) under cProfile + stack sampling, with onnxruntime profiling on.
+
+    Writes .pstats, .collapsed and .trace.json into profile_dir; returns their paths.
+    """
+    import time
+    from profiling import JobProfiler
+    model_path = resolve_model_path(model_path, variant)
+    profiler = JobProfiler(f"lama_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}", profile_dir, log=log)
+    os.makedirs(profiler.directory, exist_ok=True)
+    session = load_model(model_path, profile_prefix=os.path.join(profiler.directory, profiler.name))
+    with profiler:
+        job(session)
+    profiler.add_trace(session.end_profiling())
+    log(f"Profile: {', '.join(profiler.files.values())}")
+    return profiler.summary()
+
+
+def variant_path(variant):
+    """models/lama_<variant>.onnx"""
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown LaMa variant: {variant} (one of {', '.join(VARIANTS)})")
+    return os.path.join(MODELS_DIR, f"lama_{variant}.onnx")
+
+
+def resolve_model_path(model_path=None, variant=None):
+    """An explicit model_path wins; otherwise the file for `variant` (default LAMA_VARIANT)"""
+    if model_path is None:
+        variant = variant or DEFAULT_VARIANT
+        model_path = variant_path(variant)
+        if not os.path.exists(model_path) and variant != 'fp32':
+            raise FileNotFoundError(f"Model not found: {model_path} "
+                                    f"(build it with: python3 lama_variants.py build --variants {variant})")
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model not found: {model_path}")
+    return model_path
 
 
 def refine_to_corner(img_w, img_h, x, y, w, h):
@@ -78,22 +223,164 @@ def refine_to_corner(img_w, img_h, x, y, w, h):
     return cx, cy, cw, ch
 
 
-def inpaint(input_path, output_path, x, y, w, h, padding=5, model_path=None, debug=False):
-    debug_dir = os.path.dirname(output_path) or '.'
+def inpaint(input_path, output_path, x, y, w, h, padding=5, model_path=None, debug=False,
+            use_cache=True, session=None, variant=None):
+    """File-to-file wrapper around inpaint_bytes().
+
+    variant picks models/lama_<variant>.onnx (fp32, fp16, int8_dynamic,
+    int8_static) when model_path is not given.
+    """
+    with open(input_path, 'rb') as f:
+        input_bytes = f.read()
+    png = inpaint_bytes(input_bytes, x, y, w, h, padding=padding, model_path=model_path,
+                        debug_dir=(os.path.dirname(output_path) or '.') if debug else None,
+                        use_cache=use_cache, session=session, variant=variant)
+    with open(output_path, 'wb') as f:
+        f.write(png)
+    log(f"Output: {output_path}")
+    log("Done!")
+
+
+def _encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def inpaint_bytes(input_bytes, x, y, w, h, padding=5, model_path=None, debug_dir=None,
+                  use_cache=True, session=None, variant=None):
+    """Remove the watermark in (x, y, w, h); encoded image in, PNG bytes out.
+
+    session: an already-loaded InferenceSession (the resident server passes
+    its warm one); defaults to get_session(model_path).
+    """
+    job = {'input_bytes': input_bytes, 'regions': [(x, y, w, h)]}
+    return inpaint_batch([job], padding=padding, model_path=model_path, debug_dir=debug_dir,
+                         use_cache=use_cache, session=session, variant=variant)[0]
+
+
+def inpaint_batch(jobs, padding=5, model_path=None, batch_size=None, debug_dir=None,
+                  use_cache=True, session=None, variant=None):
+    """Every job's output as PNG bytes, in job order (see iter_inpaint_batch)"""
+    results = [None] * len(jobs)
+    for index, png in iter_inpaint_batch(jobs, padding=padding, model_path=model_path,
+                                         batch_size=batch_size, debug_dir=debug_dir,
+                                         use_cache=use_cache, session=session, variant=variant):
+        results[index] = png
+    return results
+
+
+def iter_inpaint_batch(jobs, padding=5, model_path=None, batch_size=None, debug_dir=None,
+                       use_cache=True, session=None, variant=None):
+    """Remove watermarks from many (image, regions) jobs; yields (job index, PNG bytes).
+
+    A job is a dict with 'input_bytes' or 'input' (path) and 'regions', a list
+    of (x, y, w, h) or (x, y, w, h, padding). Every region's 512x512 crop is
+    stacked into one [N,3,512,512] tensor for LaMa (chunked by batch_size and
+    by what the model's batch dimension allows). Jobs are decoded and flushed
+    a batch at a time, so memory stays bounded for long frame sequences.
+    """
+    debug = debug_dir is not None
+    batch_size = max(1, int(batch_size or BATCH_SIZE))
 
     # ── Find model ──
-    if model_path is None:
-        model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                  'models', 'lama_fp32.onnx')
-    if not os.path.exists(model_path):
-        log(f"ERROR: Model not found: {model_path}")
-        sys.exit(1)
+    model_path = resolve_model_path(model_path, variant)
     log(f"Model: {os.path.basename(model_path)} ({os.path.getsize(model_path) // 1024 // 1024}MB)")
-
-    # ── Load image ──
-    original = Image.open(input_path).convert('RGB')
-    orig_w, orig_h = original.size
-    log(f"Image: {orig_w}x{orig_h}")
+    model_id = file_fingerprint(model_path)
+
+    pending = []  # (index, cache_key, canvas [H,W,3] uint8, prepared regions)
+    pending_crops = 0
+
+    def flush():
+        nonlocal session
+        crops = [(entry, region) for entry in pending for region in entry[3] if not region['empty']]
+        if crops:
+            if session is None:
+                session = get_session(model_path)
+            img_batch, mask_batch = _buffers.get(len(crops))
+            for slot, (_, region) in enumerate(crops):
+                fill_tensors(region, img_batch[slot], mask_batch[slot], debug_dir)
+            outputs = run_lama(session, img_batch, mask_batch, batch_size)
+            for (entry, region), out_uint8 in zip(crops, outputs):
+                composite_region(entry[2], region, out_uint8, debug_dir)
+        finished = []
+        for index, cache_key, canvas, _ in pending:
+            png = _encode_png(Image.fromarray(canvas))
+            if cache_key:
+                _result_cache.put(cache_key, png)
+            finished.append((index, png))
+        pending.clear()
+        return finished
+
+    for index, job in enumerate(jobs):
+        if 'input_bytes' in job:
+            input_bytes = job['input_bytes']
+        else:
+            with open(job['input'], 'rb') as f:
+                input_bytes = f.read()
+        regions = [tuple(int(v) for v in r) for r in job['regions']]
+        job_padding = int(job.get('padding', padding))
+
+        # ── Result cache: same input bytes + regions + model → same output ──
+        cache_key = None
+        if use_cache and not debug and _result_cache.enabled:
+            cache_key = make_key(input_bytes, regions=regions, padding=job_padding, model=model_id)
+            cached = _result_cache.get(cache_key)
+            if cached is not None:
+                log("Cache hit")
+                yield index, cached
+                continue
+
+        # ── Load image ──
+        # Decoded once into the writable canvas that becomes the output; all
+        # crops are taken before any region is composited back.
+        canvas = decode_canvas(input_bytes)
+        log(f"Image: {canvas.shape[1]}x{canvas.shape[0]}")
+
+        prepared = []
+        for n, region in enumerate(regions):
+            x, y, w, h = region[:4]
+            region_padding = region[4] if len(region) > 4 else job_padding
+            tag = f"_r{n}" if n else ''
+            prepared.append(prepare_region(canvas, x, y, w, h, region_padding,
+                                           debug_dir=debug_dir, tag=tag))
+        pending.append((index, cache_key, canvas, prepared))
+        pending_crops += sum(1 for r in prepared if not r['empty'])
+
+        if pending_crops >= batch_size:
+            yield from flush()
+            pending_crops = 0
+
+    if pending:
+        yield from flush()
+
+
+def decode_canvas(input_bytes):
+    """Writable [H, W, 3] uint8 canvas of an encoded image.
+
+    np.array(image) packs the whole image with tobytes() and then copies it
+    again. Filling the canvas a cache-sized strip at a time skips that
+    full-size temporary. convert('RGB') copies even when the image is RGB
+    already, so it only runs for other modes.
+    """
+    image = Image.open(io.BytesIO(input_bytes))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    width, height = image.size
+    canvas = np.empty((height, width, 3), np.uint8)
+    rows = max(1, CANVAS_STRIP_BYTES // (width * 3))
+    for top in range(0, height, rows):
+        canvas[top:top + rows] = np.asarray(image.crop((0, top, width, min(height, top + rows))))
+    return canvas
+
+
+def prepare_region(canvas, x, y, w, h, padding=5, debug_dir=None, tag=''):
+    """Crop and mask one watermark region of `canvas` ([H,W,3] uint8).
+
+    Keeps the 512×512 crop as uint8; fill_tensors() writes it into the batch.
+    """
+    debug = debug_dir is not None
+    orig_h, orig_w = canvas.shape[:2]
     log(f"Input region: ({x},{y}) {w}x{h}")
 
     # ── Step 1: Refine to actual watermark ──
@@ -130,7 +417,7 @@ def inpaint(input_path, output_path, x, y, w, h, padding=5, model_path=None, deb
     log(f"Crop: ({crop_x1},{crop_y1})-({crop_x2},{crop_y2}) = {crop_w}x{crop_h}")
 
     # ── Step 4: Extract crop and create mask ──
-    crop_img = original.crop((crop_x1, crop_y1, crop_x2, crop_y2))
+    crop_img = Image.fromarray(canvas[crop_y1:crop_y2, crop_x1:crop_x2])
 
     crop_mask = Image.new('L', (crop_w, crop_h), 0)
     draw = ImageDraw.Draw(crop_mask)
@@ -140,8 +427,8 @@ def inpaint(input_path, output_path, x, y, w, h, padding=5, model_path=None, deb
     ], fill=255)
 
     if debug:
-        crop_img.save(os.path.join(debug_dir, 'debug_01_crop.png'))
-        crop_mask.save(os.path.join(debug_dir, 'debug_02_mask.png'))
+        crop_img.save(os.path.join(debug_dir, f'debug_01_crop{tag}.png'))
+        crop_mask.save(os.path.join(debug_dir, f'debug_02_mask{tag}.png'))
 
     # ── Step 5: Resize to 512×512 ──
     lama_img = crop_img.resize((LAMA_SIZE, LAMA_SIZE), Image.LANCZOS)
@@ -149,110 +436,253 @@ def inpaint(input_path, output_path, x, y, w, h, padding=5, model_path=None, deb
 
     log(f"Resize: {crop_w}x{crop_h} -> {LAMA_SIZE}x{LAMA_SIZE}")
 
-    mask_px = (np.array(lama_mask) > 128).sum()
+    lama_mask_np = np.asarray(lama_mask)
+    mask_px = int(np.count_nonzero(lama_mask_np > 128))
     log(f"LaMa mask: {mask_px} pixels")
 
-    if mask_px == 0:
-        log("WARNING: Empty mask. Copying original.")
-        original.save(output_path, 'PNG', compress_level=1)
-        return
+    region = {
+        'crop': (crop_x1, crop_y1, crop_x2, crop_y2),
+        'crop_mask': crop_mask,
+        'padding': padding,
+        'tag': tag,
+        'empty': mask_px == 0,
+    }
+    if region['empty']:
+        log("WARNING: Empty mask. Keeping original region.")
+        return region
+
+    region['lama_img'] = np.asarray(lama_img)          # [512, 512, 3] uint8
+    region['lama_mask'] = lama_mask_np >= 128           # [512, 512] bool (same as /255 > 0.5)
+    return region
 
+
+def fill_tensors(region, img_slot, mask_slot, debug_dir=None):
+    """Write one region into its batch slots: img_slot [3,512,512], mask_slot [1,512,512]"""
     # ── Step 6: Prepare tensors ──
-    img_np = np.array(lama_img).astype(np.float32) / 255.0   # [512, 512, 3]
-    mask_np = np.array(lama_mask).astype(np.float32) / 255.0  # [512, 512]
-    mask_binary = (mask_np > 0.5).astype(np.float32)
+    mask_slot[0] = region['lama_mask']
 
     # *** THE KEY FIX: Zero out masked pixels ***
     # LaMa needs masked pixels blanked so it knows to regenerate them.
     # Without this, LaMa preserves the watermark as "valid content".
-    for c in range(3):
-        img_np[:, :, c] *= (1.0 - mask_binary)
+    # One broadcast multiply over all channels, straight into the batch buffer.
+    keep = 1.0 - mask_slot[0]
+    np.multiply(region['lama_img'].transpose(2, 0, 1), keep, out=img_slot)
+    img_slot /= 255.0
 
-    if debug:
+    if debug_dir is not None:
         # Save the zeroed input to verify
-        zeroed_vis = (img_np * 255).astype(np.uint8)
-        Image.fromarray(zeroed_vis).save(os.path.join(debug_dir, 'debug_03_lama_input_zeroed.png'))
-        lama_mask.save(os.path.join(debug_dir, 'debug_04_lama_mask.png'))
+        zeroed_vis = (img_slot.transpose(1, 2, 0) * 255).astype(np.uint8)
+        Image.fromarray(zeroed_vis).save(os.path.join(debug_dir, f"debug_03_lama_input_zeroed{region['tag']}.png"))
+        Image.fromarray(region['lama_mask'].astype(np.uint8) * 255).save(
+            os.path.join(debug_dir, f"debug_04_lama_mask{region['tag']}.png"))
 
-    img_t = np.transpose(img_np, (2, 0, 1))[np.newaxis, ...]     # [1, 3, 512, 512]
-    mask_t = mask_binary[np.newaxis, np.newaxis, ...]              # [1, 1, 512, 512]
 
-    # ── Step 7: Run LaMa ──
-    log("Loading LaMa model...")
-    session = load_model(model_path)
+def _session_batch_limit(session):
+    """Largest batch the model accepts (None = dynamic batch dimension)"""
+    dim = session.get_inputs()[0].shape[0]
+    return dim if isinstance(dim, int) and dim > 0 else None
+
+
+def run_lama(session, img_batch, mask_batch, batch_size=None):
+    """LaMa over [N,3,512,512] / [N,1,512,512]; returns N uint8 [512,512,3] images"""
     inp = [i.name for i in session.get_inputs()]
     out = [o.name for o in session.get_outputs()]
 
-    log("Running inference...")
-    result = session.run(out, {inp[0]: img_t, inp[1]: mask_t})
+    chunk = max(1, int(batch_size or BATCH_SIZE))
+    limit = _session_batch_limit(session)
+    if limit is not None:
+        chunk = min(chunk, limit)
+
+    # ── Step 7: Run LaMa ──
+    log(f"Running inference on {len(img_batch)} crop(s), batch {chunk}...")
+    results = []
+    for start in range(0, len(img_batch), chunk):
+        result = session.run(out, {inp[0]: img_batch[start:start + chunk],
+                                   inp[1]: mask_batch[start:start + chunk]})
+        raw = result[0]
+        log(f"Output: shape={raw.shape} range=[{raw.min():.3f}, {raw.max():.3f}]")
+
+        results.extend(decode_output(out_img) for out_img in raw)
+    return results
 
-    raw = result[0]
-    log(f"Output: shape={raw.shape} range=[{raw.min():.3f}, {raw.max():.3f}]")
 
-    # Decode output
-    out_img = raw[0]
+def decode_output(out_img):
+    """One LaMa output ([3,512,512] or [512,512,3], 0-1 or 0-255) as uint8 [512,512,3]"""
     if out_img.shape[0] == 3:
         out_img = np.transpose(out_img, (1, 2, 0))
 
     if out_img.max() <= 1.5:
-        out_uint8 = np.clip(out_img * 255, 0, 255).astype(np.uint8)
-    else:
-        out_uint8 = np.clip(out_img, 0, 255).astype(np.uint8)
+        return np.clip(out_img * 255, 0, 255).astype(np.uint8)
+    return np.clip(out_img, 0, 255).astype(np.uint8)
+
+
+def composite_region(canvas, region, out_uint8, debug_dir=None):
+    """Blend LaMa's 512×512 result for one region into `canvas` ([H,W,3] uint8, in place).
+
+    Only the feathered mask's bounding box is touched; outside it alpha is 0
+    and the pixels would come out unchanged anyway.
+    """
+    debug = debug_dir is not None
+    tag = region['tag']
+    crop_x1, crop_y1, crop_x2, crop_y2 = region['crop']
+    crop_w = crop_x2 - crop_x1
+    crop_h = crop_y2 - crop_y1
 
     lama_result_512 = Image.fromarray(out_uint8, 'RGB')
 
     if debug:
-        lama_result_512.save(os.path.join(debug_dir, 'debug_05_lama_output.png'))
+        lama_result_512.save(os.path.join(debug_dir, f'debug_05_lama_output{tag}.png'))
 
     # ── Step 8: Resize result back to crop size ──
     result_crop = lama_result_512.resize((crop_w, crop_h), Image.LANCZOS)
 
     if debug:
-        result_crop.save(os.path.join(debug_dir, 'debug_06_result_crop.png'))
+        result_crop.save(os.path.join(debug_dir, f'debug_06_result_crop{tag}.png'))
 
     # ── Step 9: Composite with feathered mask ──
-    blur_r = max(1, min(padding, 3))
-    mask_feathered = crop_mask.filter(ImageFilter.GaussianBlur(radius=blur_r))
+    # Blends against the current canvas, so earlier regions in the same image survive
+    blur_r = max(1, min(region['padding'], 3))
+    mask_feathered = region['crop_mask'].filter(ImageFilter.GaussianBlur(radius=blur_r))
+    bbox = mask_feathered.getbbox()
+    if bbox is None:
+        return
+    bx1, by1, bx2, by2 = bbox
 
-    orig_crop = original.crop((crop_x1, crop_y1, crop_x2, crop_y2))
+    target = canvas[crop_y1 + by1:crop_y1 + by2, crop_x1 + bx1:crop_x1 + bx2]
+    alpha = np.asarray(mask_feathered)[by1:by2, bx1:bx2, np.newaxis].astype(np.float32) / 255.0
+    ra = np.asarray(result_crop)[by1:by2, bx1:bx2]
 
-    oa = np.array(orig_crop).astype(np.float32)
-    ra = np.array(result_crop).astype(np.float32)
-    alpha = np.array(mask_feathered).astype(np.float32) / 255.0
-    alpha = alpha[:, :, np.newaxis]
+    blended = target * (1.0 - alpha)
+    blended += ra * alpha
+    np.clip(blended, 0, 255, out=blended)
 
-    blended = oa * (1.0 - alpha) + ra * alpha
-    blended = np.clip(blended, 0, 255).astype(np.uint8)
+    # ── Step 10: Write back into the canvas ──
+    target[...] = blended
 
     if debug:
-        Image.fromarray(blended).save(os.path.join(debug_dir, 'debug_07_blended.png'))
-
-    # ── Step 10: Paste back into original ──
-    output = original.copy()
-    output.paste(Image.fromarray(blended), (crop_x1, crop_y1))
-
-    output.save(output_path, 'PNG', compress_level=1)
-    log(f"Output: {output_path}")
+        Image.fromarray(canvas[crop_y1:crop_y2, crop_x1:crop_x2]).save(
+            os.path.join(debug_dir, f'debug_07_blended{tag}.png'))
+
+
+def load_manifest(path):
+    """Jobs from a batch manifest.
+
+    {"padding": 5, "regions": [[x, y, w, h], ...],        # defaults for every job
+     "jobs": [{"input": "a.png", "output": "a_out.png", "regions": [...]}, ...],
+     "input_glob": "frames/*.png", "output_dir": "out/"}  # same regions on many frames
+    """
+    import json
+    import glob
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+
+    default_regions = manifest.get('regions', [])
+    jobs = []
+    for job in manifest.get('jobs', []):
+        jobs.append({
+            'input': job['input'],
+            'output': job['output'],
+            'regions': job.get('regions', default_regions),
+            'padding': job.get('padding', manifest.get('padding', 5)),
+        })
+    if manifest.get('input_glob'):
+        output_dir = manifest.get('output_dir', '.')
+        os.makedirs(output_dir, exist_ok=True)
+        for input_path in sorted(glob.glob(manifest['input_glob'])):
+            stem = os.path.splitext(os.path.basename(input_path))[0]
+            jobs.append({
+                'input': input_path,
+                'output': os.path.join(output_dir, f"{stem}.png"),
+                'regions': default_regions,
+                'padding': manifest.get('padding', 5),
+            })
+    return jobs
+
+
+def run_manifest(manifest_path, model_path=None, batch_size=None, use_cache=True, session=None,
+                 variant=None):
+    """CLI batch mode: process every job in the manifest, writing each output as it finishes"""
+    jobs = load_manifest(manifest_path)
+    log(f"Batch: {len(jobs)} image(s), {sum(len(j['regions']) for j in jobs)} region(s)")
+    for index, png in iter_inpaint_batch(jobs, model_path=model_path, batch_size=batch_size,
+                                         use_cache=use_cache, session=session, variant=variant):
+        with open(jobs[index]['output'], 'wb') as f:
+            f.write(png)
+        log(f"Output: {jobs[index]['output']}")
     log("Done!")
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 7:
-        print(f"Usage: {sys.argv[0]} input output x y w h [padding] [model_path] [--debug]",
+    cpu_tuning.apply('onnx')
+    # --profile: cProfile + stack samples + onnxruntime trace for this run (never cached)
+    profile = '--profile' in sys.argv
+    profile_dir = None
+    argv = [a for a in sys.argv[1:] if a != '--profile']
+    if '--profile-dir' in argv and argv.index('--profile-dir') + 1 < len(argv):
+        i = argv.index('--profile-dir')
+        profile_dir = argv[i + 1]
+        del argv[i:i + 2]
+    # --variant NAME: models/lama_NAME.onnx (fp32, fp16, int8_dynamic, int8_static)
+    variant = None
+    if '--variant' in argv and argv.index('--variant') + 1 < len(argv):
+        i = argv.index('--variant')
+        variant = argv[i + 1]
+        del argv[i:i + 2]
+
+    def run(job, model_path):
+        if profile:
+            run_profiled(job, model_path, profile_dir, variant)
+        else:
+            job(None)
+
+    if '--batch' in argv:
+        opts = argv
+        model_path = opts[opts.index('--model') + 1] if '--model' in opts else None
+        try:
+            run(lambda session: run_manifest(
+                opts[opts.index('--batch') + 1],
+                model_path=model_path,
+                batch_size=int(opts[opts.index('--batch-size') + 1]) if '--batch-size' in opts else None,
+                use_cache='--no-cache' not in opts and not profile,
+                session=session,
+                variant=variant,
+            ), model_path)
+        except (FileNotFoundError, ValueError) as e:
+            log(f"ERROR: {e}")
+            sys.exit(1)
+        sys.exit(0)
+
+    if len(argv) < 6:
+        print(f"Usage: {sys.argv[0]} input output x y w h [padding] [model_path] [--debug] [--no-cache]",
+              file=sys.stderr)
+        print(f"       {sys.argv[0]} --batch manifest.json [--model path] [--batch-size N] [--no-cache]",
+              file=sys.stderr)
+        print(f"       either form: [--variant fp32|fp16|int8_dynamic|int8_static] [--profile] [--profile-dir DIR]",
               file=sys.stderr)
         sys.exit(1)
 
-    debug_mode = '--debug' in sys.argv
-    args = [a for a in sys.argv[1:] if a != '--debug']
-
-    inpaint(
-        input_path=args[0],
-        output_path=args[1],
-        x=int(args[2]),
-        y=int(args[3]),
-        w=int(args[4]),
-        h=int(args[5]),
-        padding=int(args[6]) if len(args) > 6 else 5,
-        model_path=args[7] if len(args) > 7 else None,
-        debug=debug_mode,
-    )
+    debug_mode = '--debug' in argv
+    no_cache = '--no-cache' in argv
+    args = [a for a in argv if a not in ('--debug', '--no-cache')]
+    model_path = args[7] if len(args) > 7 else None
+
+    try:
+        run(lambda session: inpaint(
+            input_path=args[0],
+            output_path=args[1],
+            x=int(args[2]),
+            y=int(args[3]),
+            w=int(args[4]),
+            h=int(args[5]),
+            padding=int(args[6]) if len(args) > 6 else 5,
+            model_path=model_path,
+            debug=debug_mode,
+            use_cache=not no_cache and not profile,
+            session=session,
+            variant=variant,
+        ), model_path)
+    except (FileNotFoundError, ValueError) as e:
+        log(f"ERROR: {e}")
+        sys.exit(1)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+LaMa Persistent Inpaint Server
+Creates the ONNX session ONCE and keeps it warm; same JSON-lines protocol
+as armscaler_server.py (one command per stdin line, one response per line).
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import threading
+from collections import deque
+from typing import Optional, Dict, Any
+
+import cpu_tuning
+import inpaint_lama
+from inpaint_lama import iter_inpaint_batch, get_session, resolve_model_path
+
+LATENCY_WINDOW = 256
+
+_server_stats = {"requests": 0, "requests_failed": 0, "total_time": 0.0, "load_time": None}
+_latencies = deque(maxlen=LATENCY_WINDOW)
+_server_lock = threading.Lock()
+_stdout_lock = threading.Lock()
+_model_path: Optional[str] = None
+_shutdown_requested = threading.Event()
+
+
+def log(msg: str, level: str = "INFO"):
+    emit({"level": level, "message": msg, "timestamp": time.time()})
+
+
+def emit(obj: Dict[str, Any]):
+    line = json.dumps(obj)
+    with _stdout_lock:
+        print(line, flush=True)
+
+
+def load_models(model_path: Optional[str] = None) -> bool:
+    """Create (or reuse) the session for model_path and record how long it took"""
+    global _model_path
+    try:
+        model_path = resolve_model_path(model_path or _model_path)
+        known = len(inpaint_lama._sessions)
+        start = time.time()
+        get_session(model_path)
+        load_time = time.time() - start
+        if len(inpaint_lama._sessions) > known:
+            with _server_lock:
+                _server_stats["load_time"] = round(load_time, 3)
+            log(f"Session ready in {load_time:.2f}s ({os.path.basename(model_path)})")
+        if _model_path is None:
+            _model_path = model_path
+        return True
+    except Exception as e:
+        log(f"Failed to load model: {e}", "ERROR")
+        return False
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+
+def _latency_stats() -> Dict[str, Any]:
+    with _server_lock:
+        values = list(_latencies)
+    return {
+        'count': len(values),
+        'last': round(values[-1], 4) if values else None,
+        'mean': round(sum(values) / len(values), 4) if values else None,
+        'p50': _percentile(values, 0.50),
+        'p95': _percentile(values, 0.95),
+        'max': round(max(values), 4) if values else None,
+    }
+
+
+def _job_from_command(job: Dict[str, Any]) -> Dict[str, Any]:
+    """inpaint_lama job dict from request fields (input_path or image_base64, regions or x/y/w/h)"""
+    if job.get('input_path'):
+        with open(job['input_path'], 'rb') as f:
+            input_bytes = f.read()
+    else:
+        data = job.get('image_base64', '')
+        if data.startswith('data:'):
+            data = data.split(',', 1)[1]
+        input_bytes = base64.b64decode(data)
+
+    regions = job.get('regions') or [(job['x'], job['y'], job['w'], job['h'])]
+    converted = {'input_bytes': input_bytes, 'regions': regions}
+    if 'padding' in job:
+        converted['padding'] = int(job['padding'])
+    return converted
+
+
+def _job_response(job: Dict[str, Any], png: bytes) -> Dict[str, Any]:
+    if job.get('output_path'):
+        with open(job['output_path'], 'wb') as f:
+            f.write(png)
+        return {'success': True, 'output_path': job['output_path']}
+    return {'success': True, 'image_base64': base64.b64encode(png).decode('utf-8')}
+
+
+def process_inpaint(cmd: Dict[str, Any]) -> Dict[str, Any]:
+    """Watermark removal for one image (`inpaint`) or many (`inpaint_batch`, cmd['jobs']).
+
+    Input/output as base64 or file paths; every region of every job goes
+    through LaMa in shared batches.
+    """
+    start_time = time.time()
+    request_id = cmd.get('id')
+    try:
+        model_path = cmd.get('model_path') or _model_path
+        if cmd.get('variant') and not cmd.get('model_path'):
+            model_path = resolve_model_path(None, cmd['variant'])
+        if not load_models(model_path):
+            raise RuntimeError('Failed to load model')
+
+        batch_mode = cmd.get('action') == 'inpaint_batch'
+        requested = cmd['jobs'] if batch_mode else [cmd]
+        jobs = [_job_from_command(job) for job in requested]
+
+        results = [None] * len(jobs)
+        for index, png in iter_inpaint_batch(
+                jobs,
+                padding=int(cmd.get('padding', 5)),
+                model_path=model_path,
+                batch_size=cmd.get('batch_size'),
+                use_cache=bool(cmd.get('cache', True)),
+                session=get_session(resolve_model_path(model_path))):
+            jobs[index]['input_bytes'] = b''
+            results[index] = _job_response(requested[index], png)
+
+        if batch_mode:
+            response = {'success': True, 'id': request_id, 'results': results}
+        else:
+            response = dict(results[0], id=request_id)
+
+        elapsed = time.time() - start_time
+        with _server_lock:
+            _server_stats["requests"] += 1
+            _server_stats["total_time"] += elapsed
+            _latencies.append(elapsed)
+        response['processing_time'] = round(elapsed, 4)
+        return response
+
+    except Exception as e:
+        with _server_lock:
+            _server_stats["requests_failed"] += 1
+        log(f"Inpaint error: {e}", "ERROR")
+        return {'success': False, 'error': str(e), 'id': request_id}
+
+
+def handle_command(cmd: Dict[str, Any]) -> Dict[str, Any]:
+    """Handle incoming commands"""
+    action = cmd.get('action')
+
+    if action in ('inpaint', 'inpaint_batch'):
+        return process_inpaint(cmd)
+
+    elif action == 'status':
+        with _server_lock:
+            stats = dict(_server_stats)
+        return {
+            'ready': True,
+            'model': _model_path,
+            'session_loaded': bool(inpaint_lama._sessions),
+            'stats': stats,
+            'latency': _latency_stats(),
+            'cache': inpaint_lama._result_cache.stats(),
+            'pid': os.getpid(),
+            'id': cmd.get('id'),
+        }
+
+    elif action == 'ping':
+        return {'pong': True, 'pid': os.getpid(), 'id': cmd.get('id')}
+
+    elif action == 'shutdown':
+        _shutdown_requested.set()
+        return {'shutdown': True, 'id': cmd.get('id')}
+
+    else:
+        return {'error': f'Unknown action: {action}', 'id': cmd.get('id')}
+
+
+def serve_stdio():
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            cmd = json.loads(line)
+            emit(handle_command(cmd))
+        except json.JSONDecodeError as e:
+            emit({'error': f'Invalid JSON: {e}'})
+        except Exception as e:
+            log(f"Command error: {e}", "ERROR")
+            emit({'error': str(e)})
+        if _shutdown_requested.is_set():
+            break
+
+
+def main(argv=None):
+    """Main server loop"""
+    global _model_path
+    argv = sys.argv[1:] if argv is None else argv
+
+    preload = '--no-preload' not in argv
+    if '--model' in argv and argv.index('--model') + 1 < len(argv):
+        _model_path = argv[argv.index('--model') + 1]
+    elif '--variant' in argv and argv.index('--variant') + 1 < len(argv):
+        _model_path = inpaint_lama.variant_path(argv[argv.index('--variant') + 1])
+
+    log("LaMa Inpaint Server starting...")
+    log(f"CPU threads: {cpu_tuning.describe(cpu_tuning.apply('onnx'))}")
+    if preload:
+        load_models(_model_path)
+    log("Server ready.")
+
+    serve_stdio()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
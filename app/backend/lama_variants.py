@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Reduced-precision LaMa variants and the accuracy gate for choosing one.
+
+Builds, next to models/lama_fp32.onnx:
+
+  lama_fp16.onnx          weights and activations in fp16 (inputs/outputs stay
+                          fp32); meant for CUDA, CPU mostly casts back
+  lama_int8_dynamic.onnx  int8 weights, activations quantized per call
+  lama_int8_static.onnx   int8 weights and activations (QDQ, per-channel),
+                          activation ranges calibrated on our own masked crops
+
+Calibration and evaluation crops are the exact 512x512 LaMa inputs that
+inpaint_lama builds (prepare_region + fill_tensors) from a batch manifest
+or a folder of watermarked images. `evaluate` runs every variant on the
+CPU provider and scores it against fp32 inside the mask only (PSNR, SSIM),
+next to its per-crop latency and file size; variants under --min-psnr /
+--min-ssim fail the gate (exit status 1).
+
+    python3 lama_variants.py build [--variants fp16,int8_dynamic,int8_static]
+        (--calibration manifest.json | --calibration-dir DIR) [--samples 64]
+    python3 lama_variants.py evaluate (--calibration manifest.json | --calibration-dir DIR)
+        [--variants ...] [--samples 16] [--repeat 3] [--threads N] [--output report.json]
+        [--min-psnr 35] [--min-ssim 0.97]
+
+Select a variant with `inpaint_lama.py --variant NAME`, inpaint(variant=...),
+the inpaint_server `variant` field / --variant flag, or LAMA_VARIANT.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from inpaint_lama import (VARIANTS, WATERMARK_SIZE, LAMA_SIZE, decode_output, fill_tensors,
+                          load_manifest, log, prepare_region, variant_path)
+
+DEFAULT_SAMPLES = 64
+EVAL_SAMPLES = 16
+MIN_PSNR = 35.0
+MIN_SSIM = 0.97
+SSIM_WINDOW = 7
+IMAGE_PATTERNS = ('*.png', '*.jpg', '*.jpeg', '*.webp')
+
+
+# ── Masked crops ──
+
+def calibration_jobs(manifest=None, image_dir=None, padding=5):
+    """Jobs ({'input', 'regions', 'padding'}) from a manifest or a folder.
+
+    Folder images get the bottom-right WATERMARK_SIZE corner as their region,
+    where our watermarks sit.
+    """
+    if manifest:
+        return load_manifest(manifest)
+    jobs = []
+    for pattern in IMAGE_PATTERNS:
+        for path in glob.glob(os.path.join(image_dir, pattern)):
+            with Image.open(path) as image:
+                width, height = image.size
+            jobs.append({'input': path, 'padding': padding,
+                         'regions': [(width - WATERMARK_SIZE, height - WATERMARK_SIZE,
+                                      WATERMARK_SIZE, WATERMARK_SIZE)]})
+    return sorted(jobs, key=lambda job: job['input'])
+
+
+def masked_crops(jobs, limit=None):
+    """LaMa inputs for up to `limit` regions, spread evenly over the jobs.
+
+    Each crop is {'image': [3,512,512] f32, 'mask': [1,512,512] f32,
+    'region_mask': [512,512] bool}.
+    """
+    regions = [(job, region) for job in jobs for region in job['regions']]
+    if limit and len(regions) > limit:
+        regions = [regions[int(i * len(regions) / limit)] for i in range(limit)]
+    crops = []
+    path = canvas = None
+    for job, region in regions:
+        if job['input'] != path:
+            path, canvas = job['input'], np.array(Image.open(job['input']).convert('RGB'))
+        x, y, w, h = (int(v) for v in region[:4])
+        padding = int(region[4]) if len(region) > 4 else int(job.get('padding', 5))
+        prepared = prepare_region(canvas, x, y, w, h, padding)
+        if prepared['empty']:
+            continue
+        image = np.empty((3, LAMA_SIZE, LAMA_SIZE), np.float32)
+        mask = np.empty((1, LAMA_SIZE, LAMA_SIZE), np.float32)
+        fill_tensors(prepared, image, mask)
+        crops.append({'image': image, 'mask': mask, 'region_mask': prepared['lama_mask']})
+    if not crops:
+        raise ValueError("No masked crops found for calibration")
+    return crops
+
+
+# ── Building variants ──
+
+def _input_names(model_path):
+    session = _cpu_session(model_path)
+    return [i.name for i in session.get_inputs()]
+
+
+def _feeds(crops, names):
+    return [{names[0]: crop['image'][None], names[1]: crop['mask'][None]} for crop in crops]
+
+
+def build_fp16(source, target):
+    import onnx
+    try:
+        from onnxconverter_common.float16 import convert_float_to_float16
+    except ImportError:
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+    model = convert_float_to_float16(onnx.load(source), keep_io_types=True)
+    onnx.save(model, target)
+
+
+def _pre_process(source, target):
+    """Shape-inferred, optimized copy of source for the quantizer (source itself if that fails)"""
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    prepared = f"{target}.pre.onnx"
+    try:
+        quant_pre_process(source, prepared, skip_symbolic_shape=True)
+        return prepared
+    except Exception as e:
+        log(f"Pre-processing skipped ({e})")
+        return source
+
+
+def _quantize(source, target, quantize):
+    prepared = _pre_process(source, target)
+    try:
+        quantize(prepared)
+    finally:
+        if prepared != source and os.path.exists(prepared):
+            os.unlink(prepared)
+
+
+def build_int8_dynamic(source, target):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    _quantize(source, target, lambda prepared: quantize_dynamic(
+        prepared, target, weight_type=QuantType.QInt8))
+
+
+def build_int8_static(source, target, crops):
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                          QuantType, quantize_static)
+
+    class CropReader(CalibrationDataReader):
+        def __init__(self, feeds):
+            self._feeds = iter(feeds)
+
+        def get_next(self):
+            return next(self._feeds, None)
+
+    reader = CropReader(_feeds(crops, _input_names(source)))
+    _quantize(source, target, lambda prepared: quantize_static(
+        prepared, target, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax))
+
+
+def build(variants, crops=None, source=None):
+    """Write each variant next to the fp32 model; returns {variant: path}"""
+    source = source or variant_path('fp32')
+    built = {}
+    for variant in variants:
+        if variant == 'fp32':
+            continue
+        target = variant_path(variant)
+        tmp = f"{target}.tmp{os.getpid()}"
+        start = time.time()
+        try:
+            if variant == 'fp16':
+                build_fp16(source, tmp)
+            elif variant == 'int8_dynamic':
+                build_int8_dynamic(source, tmp)
+            else:
+                if not crops:
+                    raise ValueError("int8_static needs calibration crops")
+                log(f"Calibrating on {len(crops)} crop(s)...")
+                build_int8_static(source, tmp, crops)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        log(f"Built {os.path.basename(target)} ({os.path.getsize(target) / 2**20:.1f}MB) "
+            f"in {time.time() - start:.1f}s")
+        built[variant] = target
+    return built
+
+
+# ── Accuracy gate ──
+
+def _cpu_session(model_path, threads=None):
+    import onnxruntime as ort
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        opts.intra_op_num_threads = threads
+    return ort.InferenceSession(model_path, opts, providers=['CPUExecutionProvider'])
+
+
+def masked_psnr(output, reference, mask):
+    """PSNR in dB over the pixels where mask is set (None when identical)"""
+    diff = output[mask].astype(np.float64) - reference[mask].astype(np.float64)
+    mse = float(np.mean(diff * diff))
+    return None if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def _box_mean(values, size):
+    """Mean over a size x size window around every pixel (edge-padded), per channel"""
+    pad = size // 2
+    padded = np.pad(values, ((pad, pad), (pad, pad), (0, 0)), mode='edge')
+    summed = padded.cumsum(0).cumsum(1)
+    summed = np.pad(summed, ((1, 0), (1, 0), (0, 0)))
+    h, w = values.shape[:2]
+    total = (summed[size:size + h, size:size + w] - summed[:h, size:size + w]
+             - summed[size:size + h, :w] + summed[:h, :w])
+    return total / (size * size)
+
+
+def masked_ssim(output, reference, mask, window=SSIM_WINDOW):
+    """Mean SSIM (uniform window, per channel) over the pixels where mask is set"""
+    x = output.astype(np.float64)
+    y = reference.astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mx, my = _box_mean(x, window), _box_mean(y, window)
+    vx = _box_mean(x * x, window) - mx * mx
+    vy = _box_mean(y * y, window) - my * my
+    cov = _box_mean(x * y, window) - mx * my
+    ssim = ((2 * mx * my + c1) * (2 * cov + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))
+    return float(ssim[mask].mean())
+
+
+def _run(session, feed):
+    start = time.perf_counter()
+    raw = session.run(None, feed)[0][0]
+    return decode_output(raw), (time.perf_counter() - start) * 1000
+
+
+def evaluate(variants, crops, repeat=3, threads=None, min_psnr=MIN_PSNR, min_ssim=MIN_SSIM):
+    """{variant: scores}: accuracy against fp32 inside the mask and CPU latency per crop"""
+    reference_session = _cpu_session(variant_path('fp32'), threads)
+    feeds = _feeds(crops, [i.name for i in reference_session.get_inputs()])
+    references = [_run(reference_session, feed)[0] for feed in feeds]
+    del reference_session
+
+    report = {}
+    for variant in variants:
+        path = variant_path(variant)
+        if not os.path.exists(path):
+            report[variant] = {'missing': True, 'passes': False}
+            continue
+        session = _cpu_session(path, threads)
+        _run(session, feeds[0])  # warm-up
+        latencies, psnrs, ssims = [], [], []
+        for feed, crop, reference in zip(feeds, crops, references):
+            runs = [_run(session, feed) for _ in range(max(1, repeat))]
+            output = runs[0][0]
+            latencies.append(min(ms for _, ms in runs))
+            psnrs.append(masked_psnr(output, reference, crop['region_mask']))
+            ssims.append(masked_ssim(output, reference, crop['region_mask']))
+        del session
+
+        finite = [p for p in psnrs if p is not None]
+        worst_psnr = min(finite) if finite else None
+        scores = {
+            'size_mb': round(os.path.getsize(path) / 2**20, 1),
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 1),
+            'latency_ms_mean': round(float(np.mean(latencies)), 1),
+            'psnr_mean': round(float(np.mean(finite)), 2) if finite else None,
+            'psnr_min': round(worst_psnr, 2) if worst_psnr is not None else None,
+            'ssim_mean': round(float(np.mean(ssims)), 4),
+            'ssim_min': round(float(np.min(ssims)), 4),
+        }
+        scores['passes'] = ((worst_psnr is None or worst_psnr >= min_psnr)
+                            and scores['ssim_min'] >= min_ssim)
+        report[variant] = scores
+    baseline = report.get('fp32', {}).get('latency_ms_p50')
+    for scores in report.values():
+        if baseline and scores.get('latency_ms_p50'):
+            scores['speedup'] = round(baseline / scores['latency_ms_p50'], 2)
+    return report
+
+
+def format_report(report):
+    lines = [f"{'variant':<14}{'size MB':>9}{'p50 ms':>9}{'speedup':>9}{'PSNR min':>10}"
+             f"{'SSIM min':>10}  gate"]
+    for variant, s in report.items():
+        if s.get('missing'):
+            lines.append(f"{variant:<14}  (not built)")
+            continue
+        psnr = 'identical' if s['psnr_min'] is None else f"{s['psnr_min']:.2f}"
+        lines.append(f"{variant:<14}{s['size_mb']:>9}{s['latency_ms_p50']:>9}"
+                     f"{s.get('speedup', ''):>9}{psnr:>10}{s['ssim_min']:>10}  "
+                     f"{'pass' if s['passes'] else 'FAIL'}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('build', 'evaluate'):
+        print(f"Usage: {sys.argv[0]} build [--variants fp16,int8_dynamic,int8_static] "
+              f"(--calibration manifest.json | --calibration-dir DIR) [--samples {DEFAULT_SAMPLES}]",
+              file=sys.stderr)
+        print(f"       {sys.argv[0]} evaluate (--calibration manifest.json | --calibration-dir DIR) "
+              f"[--variants ...] [--samples {EVAL_SAMPLES}] [--repeat 3] [--threads N] "
+              f"[--output report.json] [--min-psnr {MIN_PSNR:g}] [--min-ssim {MIN_SSIM:g}]",
+              file=sys.stderr)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    opts = {'variants': None, 'calibration': None, 'calibration_dir': None, 'samples': None,
+            'repeat': 3, 'threads': None, 'output': None, 'min_psnr': MIN_PSNR, 'min_ssim': MIN_SSIM}
+    args = sys.argv[2:]
+    i = 0
+    while i < len(args):
+        key = args[i][2:].replace('-', '_') if args[i].startswith('--') else None
+        if key in opts and i + 1 < len(args):
+            opts[key] = args[i + 1]
+            i += 2
+        else:
+            i += 1
+
+    if opts['variants']:
+        variants = opts['variants'].split(',')
+    else:
+        variants = [v for v in VARIANTS if v != 'fp32'] if command == 'build' else list(VARIANTS)
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown:
+        log(f"ERROR: unknown variant(s) {', '.join(unknown)} (one of {', '.join(VARIANTS)})")
+        sys.exit(1)
+
+    crops = None
+    if opts['calibration'] or opts['calibration_dir']:
+        default_samples = DEFAULT_SAMPLES if command == 'build' else EVAL_SAMPLES
+        crops = masked_crops(calibration_jobs(opts['calibration'], opts['calibration_dir']),
+                             int(opts['samples'] or default_samples))
+        log(f"Masked crops: {len(crops)}")
+    elif command == 'evaluate' or 'int8_static' in variants:
+        log("ERROR: --calibration or --calibration-dir is required")
+        sys.exit(1)
+
+    if command == 'build':
+        print(json.dumps(build(variants, crops), indent=2))
+        sys.exit(0)
+
+    threads = int(opts['threads']) if opts['threads'] else None
+    report = evaluate(variants, crops, repeat=int(opts['repeat']), threads=threads,
+                      min_psnr=float(opts['min_psnr']), min_ssim=float(opts['min_ssim']))
+    print(format_report(report), file=sys.stderr)
+    if opts['output']:
+        with open(opts['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if all(s['passes'] for s in report.values()) else 1)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+In-process metrics: counters, gauges and fixed-bucket histograms.
+
+Cheap enough to leave on: an update is one lock, one dict lookup and (for
+histograms) one bisect. Gauges can also be callbacks, evaluated only when
+metrics are read. Output is a JSON snapshot (with bucket-interpolated
+p50/p95/p99) or the Prometheus text exposition format, optionally written
+atomically to a file for a textfile scraper.
+"""
+
+import os
+import time
+import bisect
+import threading
+
+# Seconds; wide enough for a 10 ms base64 decode and a 5 min quality run
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class _Span:
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Named metric families, each a set of label-keyed series"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._families = {}   # name -> {'type', 'help', 'buckets', 'series': {labels: value}}
+        self._callbacks = {}  # gauge name -> fn() returning a number or {labels tuple: number}
+        self._lock = threading.Lock()
+
+    def _family(self, name, kind, help='', buckets=None):
+        family = self._families.get(name)
+        if family is None:
+            family = {'type': kind, 'help': help, 'buckets': tuple(buckets or LATENCY_BUCKETS),
+                      'series': {}}
+            self._families[name] = family
+        return family
+
+    # ── Declaration (optional for counters/gauges, sets help text and buckets) ──
+
+    def counter(self, name, help=''):
+        with self._lock:
+            self._family(name, 'counter', help)
+
+    def gauge(self, name, help='', fn=None):
+        with self._lock:
+            self._family(name, 'gauge', help)
+            if fn is not None:
+                self._callbacks[name] = fn
+
+    def histogram(self, name, help='', buckets=None):
+        with self._lock:
+            self._family(name, 'histogram', help, buckets)
+
+    # ── Updates ──
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._family(name, 'counter')['series']
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._family(name, 'gauge')['series'][key] = value
+
+    def set_max(self, name, value, **labels):
+        """Gauge that only goes up (peaks)"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._family(name, 'gauge')['series']
+            if value > series.get(key, float('-inf')):
+                series[key] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._family(name, 'histogram')
+            entry = family['series'].get(key)
+            if entry is None:
+                entry = family['series'][key] = [[0] * (len(family['buckets']) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(family['buckets'], value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def span(self, name, **labels):
+        """`with registry.span('stage_seconds', stage='decode'):` observes the elapsed time"""
+        return _Span(self, name, labels)
+
+    # ── Reading ──
+
+    def _collect(self):
+        """Copy of every family with callback gauges evaluated"""
+        with self._lock:
+            callbacks = list(self._callbacks.items())
+        values = {}
+        for name, fn in callbacks:
+            try:
+                values[name] = fn()
+            except Exception:
+                values[name] = None
+        with self._lock:
+            for name, value in values.items():
+                if value is None:
+                    continue
+                series = self._families[name]['series']
+                if isinstance(value, dict):
+                    series.clear()
+                    series.update(value)
+                else:
+                    series[()] = value
+            return {name: dict(family, series={key: ([list(v[0]), v[1], v[2]]
+                                                     if family['type'] == 'histogram' else v)
+                                               for key, v in family['series'].items()})
+                    for name, family in self._families.items()}
+
+    def snapshot(self):
+        """JSON-friendly view; histograms carry counts per bucket and estimated quantiles"""
+        result = {}
+        for name, family in sorted(self._collect().items()):
+            series = []
+            for key, value in sorted(family['series'].items()):
+                entry = {'labels': dict(key)}
+                if family['type'] == 'histogram':
+                    counts, total, count = value[0], value[1], value[2]
+                    entry.update({
+                        'count': count,
+                        'sum': round(total, 6),
+                        'mean': round(total / count, 6) if count else None,
+                        'p50': _quantile(family['buckets'], counts, count, 0.50),
+                        'p95': _quantile(family['buckets'], counts, count, 0.95),
+                        'p99': _quantile(family['buckets'], counts, count, 0.99),
+                        'buckets': {_le(b): c for b, c in
+                                    zip(family['buckets'] + (float('inf'),), _cumulative(counts))},
+                    })
+                else:
+                    entry['value'] = value
+                series.append(entry)
+            result[self.prefix + name] = {'type': family['type'], 'help': family['help'], 'series': series}
+        return result
+
+    def exposition(self):
+        """Prometheus text format"""
+        lines = []
+        for name, family in sorted(self._collect().items()):
+            full = self.prefix + name
+            if family['help']:
+                lines.append(f"# HELP {full} {family['help']}")
+            lines.append(f"# TYPE {full} {family['type']}")
+            for key, value in sorted(family['series'].items()):
+                if family['type'] == 'histogram':
+                    counts, total, count = value[0], value[1], value[2]
+                    for bound, cumulative in zip(family['buckets'] + (float('inf'),), _cumulative(counts)):
+                        lines.append(f"{full}_bucket{_labels(key + (('le', _le(bound)),))} {cumulative}")
+                    lines.append(f"{full}_sum{_labels(key)} {total:.6f}")
+                    lines.append(f"{full}_count{_labels(key)} {count}")
+                else:
+                    lines.append(f"{full}{_labels(key)} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def write_exposition(self, path):
+        """Atomically replace `path` with the current exposition"""
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, 'w') as f:
+            f.write(self.exposition())
+        os.replace(tmp, path)
+
+
+def _cumulative(counts):
+    running, result = 0, []
+    for c in counts:
+        running += c
+        result.append(running)
+    return result
+
+
+def _quantile(buckets, counts, count, q):
+    """Linear interpolation inside the bucket holding the q-th observation"""
+    if not count:
+        return None
+    target = q * count
+    running = 0
+    for i, c in enumerate(counts):
+        if c and running + c >= target:
+            lower = buckets[i - 1] if i > 0 else 0.0
+            if i >= len(buckets):
+                return lower  # beyond the last bound: all we know is "more than"
+            return round(lower + (buckets[i] - lower) * (target - running) / c, 6)
+        running += c
+    return buckets[-1]
+
+
+def _le(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _labels(key):
+    if not key:
+        return ''
+    parts = []
+    for k, v in key:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
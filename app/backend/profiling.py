@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Per-job profiling for ARMscaler and LaMa.
+
+JobProfiler wraps one job and leaves these files in the profile directory:
+
+  <name>.pstats      cProfile function statistics (python -m pstats / snakeviz)
+  <name>.collapsed   stack samples of the profiled thread, one "a;b;c count"
+                     line per stack (flamegraph.pl, speedscope, inferno)
+  <name>.trace.json  Chrome trace (chrome://tracing, Perfetto) from
+                     torch.profiler, or an external one such as onnxruntime's
+
+Off unless asked for; sample_job() gives an every-Nth-job decision for a
+low-rate profile stream in production.
+"""
+
+import os
+import sys
+import time
+import shutil
+import cProfile
+import tempfile
+import itertools
+import threading
+from collections import Counter
+
+PROFILE_DIR = os.environ.get('ZARMA_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'zarma_profiles'))
+SAMPLE_INTERVAL = 0.005
+
+_job_counter = itertools.count(1)
+
+
+def sample_job(every):
+    """True for every `every`-th call (never when every <= 0)"""
+    n = next(_job_counter)
+    return every > 0 and n % every == 0
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack every `interval` seconds"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class JobProfiler:
+    """`with JobProfiler('job_123', torch_trace=True) as prof: ...` then prof.files"""
+
+    def __init__(self, name, directory=None, torch_trace=False, interval=SAMPLE_INTERVAL, log=None):
+        self.name = name
+        self.directory = directory or PROFILE_DIR
+        self.torch_trace = torch_trace
+        self.interval = interval
+        self.log = log or (lambda msg: None)
+        self.files = {}
+        self.elapsed = None
+        self._profile = None
+        self._sampler = None
+        self._torch_profiler = None
+        self._start = None
+
+    def _path(self, suffix):
+        return os.path.join(self.directory, f"{self.name}{suffix}")
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.torch_trace:
+            self._start_torch()
+        self._sampler = _StackSampler(threading.get_ident(), self.interval)
+        self._sampler.start()
+        self._profile = cProfile.Profile()
+        self._start = time.perf_counter()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._profile.disable()
+        self.elapsed = time.perf_counter() - self._start
+        self._sampler.stop()
+
+        self._profile.dump_stats(self._path('.pstats'))
+        self.files['pstats'] = self._path('.pstats')
+
+        with open(self._path('.collapsed'), 'w') as f:
+            for stack, count in self._sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.files['collapsed'] = self._path('.collapsed')
+
+        if self._torch_profiler is not None:
+            try:
+                self._torch_profiler.__exit__(*exc)
+                self._torch_profiler.export_chrome_trace(self._path('.trace.json'))
+                self.files['trace'] = self._path('.trace.json')
+            except Exception as e:
+                self.log(f"torch.profiler trace failed: {e}")
+        return False
+
+    def _start_torch(self):
+        try:
+            import torch
+            from torch.profiler import profile, ProfilerActivity
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            self._torch_profiler = profile(activities=activities, record_shapes=True)
+            self._torch_profiler.__enter__()
+        except Exception as e:
+            self._torch_profiler = None
+            self.log(f"torch.profiler unavailable: {e}")
+
+    def add_trace(self, path):
+        """Adopt an externally written Chrome trace (e.g. onnxruntime's) as this job's trace"""
+        if path and os.path.exists(path):
+            target = self._path('.trace.json')
+            shutil.move(path, target)
+            self.files['trace'] = target
+
+    def summary(self):
+        """Response field: file paths plus wall time and sample count"""
+        return dict(self.files, name=self.name,
+                    elapsed=round(self.elapsed, 4) if self.elapsed is not None else None,
+                    samples=sum(self._sampler.stacks.values()) if self._sampler else 0)
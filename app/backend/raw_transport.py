@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Raw RGB pixel files for passing images between local processes.
+
+A 16-byte header followed by tightly packed uint8 pixels, row-major:
+
+    magic 'ARMR' | version u16 | channels u16 | width u32 | height u32
+
+Files live in /dev/shm when available, so reading one back with map_raw()
+is a page-mapped view of shared memory: no PNG encode, no base64.
+raw_to_png() encodes one to PNG a strip of rows at a time.
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import tempfile
+
+HEADER = struct.Struct('<4sHHII')
+MAGIC = b'ARMR'
+VERSION = 1
+RAW_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def raw_path(name):
+    """Path for a raw image in the shared-memory directory"""
+    return os.path.join(RAW_DIR, f"{name}.rgb")
+
+
+def write_raw(path, width, height, pixels, channels=3):
+    """Write header + pixels (any buffer of height*width*channels bytes)"""
+    data = memoryview(pixels).cast('B')
+    expected = width * height * channels
+    if data.nbytes != expected:
+        raise ValueError(f"Expected {expected} pixel bytes, got {data.nbytes}")
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, channels, width, height))
+        f.write(data)
+    os.replace(tmp, path)
+    return path
+
+
+def create_raw(path, width, height, channels=3):
+    """Header + zero-filled (sparse) pixel area, for filling in place through a mapping"""
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, channels, width, height))
+        f.truncate(HEADER.size + width * height * channels)
+    return path
+
+
+def read_header(path):
+    """(width, height, channels) of a raw image file"""
+    with open(path, 'rb') as f:
+        return _unpack(f.read(HEADER.size))
+
+
+def _unpack(header):
+    if len(header) < HEADER.size:
+        raise ValueError("Truncated raw image header")
+    magic, version, channels, width, height = HEADER.unpack(header[:HEADER.size])
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a raw image file")
+    return width, height, channels
+
+
+def map_raw(path):
+    """Map a raw image read-only: (width, height, channels, mmap).
+
+    Pixels start at HEADER.size; close the mmap when done.
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        width, height, channels = _unpack(mm[:HEADER.size])
+        if len(mm) < HEADER.size + width * height * channels:
+            raise ValueError("Truncated raw image data")
+    except ValueError:
+        mm.close()
+        raise
+    return width, height, channels, mm
+
+
+PNG_COLOR_TYPES = {1: 0, 3: 2, 4: 6}  # channels -> grey, RGB, RGBA
+STRIP_BYTES = 16 << 20
+
+
+def _png_chunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+
+def raw_to_png(path, output_path, compress_level=1):
+    """Encode a raw image file to PNG, reading and compressing it in row strips.
+
+    Memory stays around STRIP_BYTES whatever the image size; rows already
+    encoded are dropped from the page cache mapping as it goes.
+    """
+    width, height, channels, mm = map_raw(path)
+    if channels not in PNG_COLOR_TYPES:
+        mm.close()
+        raise ValueError(f"No PNG color type for {channels} channels")
+    stride = width * channels
+    rows_per_strip = max(1, STRIP_BYTES // stride)
+    tmp = f"{output_path}.tmp{os.getpid()}"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            _png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, PNG_COLOR_TYPES[channels], 0, 0, 0))
+            encoder = zlib.compressobj(compress_level)
+            for top in range(0, height, rows_per_strip):
+                rows = min(rows_per_strip, height - top)
+                start = HEADER.size + top * stride
+                strip = bytearray(rows * (stride + 1))  # each row: filter byte 0 (none) + pixels
+                for row in range(rows):
+                    offset = row * (stride + 1) + 1
+                    strip[offset:offset + stride] = mm[start + row * stride:start + (row + 1) * stride]
+                data = encoder.compress(strip)
+                if data:
+                    _png_chunk(f, b'IDAT', data)
+                end = (start + rows * stride) // mmap.PAGESIZE * mmap.PAGESIZE
+                if end and hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_DONTNEED, 0, end)
+            _png_chunk(f, b'IDAT', encoder.flush())
+            _png_chunk(f, b'IEND', b'')
+        os.replace(tmp, output_path)
+    finally:
+        mm.close()
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return output_path
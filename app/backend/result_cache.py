@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for finished outputs (ARMscaler, LaMa).
+
+Keys are a SHA-256 over the input bytes plus every parameter that changes
+the output. Values are the encoded output file (PNG bytes). A small
+in-memory LRU sits in front of a size-bounded directory on disk; disk
+entries are evicted least-recently-used first (by mtime, refreshed on hit).
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+CACHE_ROOT = Path(os.environ.get('ZARMA_CACHE_DIR', Path.home() / '.cache' / 'zarma'))
+
+
+def make_key(input_bytes, **params):
+    """Hash of the input plus the canonical JSON of the parameters"""
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(input_bytes).digest())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def file_fingerprint(*paths):
+    """Cheap identity for model files: name, size and mtime (not content)"""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}")
+        except OSError:
+            parts.append(f"{os.path.basename(path)}:missing")
+    return '|'.join(parts)
+
+
+class ResultCache:
+    """Disk-backed result cache with an in-memory LRU front"""
+
+    def __init__(self, name, max_disk_bytes=2 << 30, max_memory_bytes=256 << 20, enabled=True):
+        self.directory = CACHE_ROOT / name
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None  # scanned lazily
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+                         'stores': 0, 'evictions': 0}
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def get(self, key):
+        """Cached bytes for key, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters['hits'] += 1
+                self.counters['memory_hits'] += 1
+                return data
+
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.counters['misses'] += 1
+            return None
+
+        with self._lock:
+            self.counters['hits'] += 1
+            self.counters['disk_hits'] += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        if not self.enabled or not data:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            existed = path.exists()
+            tmp = path.with_name(f"{key}.tmp{os.getpid()}.{threading.get_ident()}")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+
+        with self._lock:
+            self.counters['stores'] += 1
+            self._remember(key, data)
+            if self._disk_bytes is not None and not existed:
+                self._disk_bytes += len(data)
+        self._evict_disk()
+
+    def _remember(self, key, data):
+        """Add to the memory LRU (caller holds the lock)"""
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _entries(self):
+        if not self.directory.exists():
+            return []
+        entries = []
+        for path in self.directory.glob('*/*'):
+            if '.tmp' in path.name:
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_disk(self):
+        with self._lock:
+            if self._disk_bytes is not None and self._disk_bytes <= self.max_disk_bytes:
+                return
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+            with self._lock:
+                old = self._memory.pop(path.name, None)
+                if old is not None:
+                    self._memory_bytes -= len(old)
+        with self._lock:
+            self._disk_bytes = total
+            self.counters['evictions'] += evicted
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        for _, _, path in self._entries():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                'enabled': self.enabled,
+                **self.counters,
+                'hit_rate': round(self.counters['hits'] / lookups, 3) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_bytes': self._disk_bytes,
+                'max_disk_bytes': self.max_disk_bytes,
+                'directory': str(self.directory),
+            }
@@ -322,6 +322,13 @@ app.post('/api/cleanup', async (req, res) => {
   res.json({ success: true, message: 'Cleanup completed' });
 });
 
+// Heavy one-shot scripts go through zygote.py, which falls back to a plain run if it's down
+const ZYGOTE_SCRIPT = path.join(__dirname, 'zygote.py');
+const ZYGOTE_ENABLED = process.env.ZARMA_ZYGOTE !== '0';
+function pythonArgs(script, args) {
+  return ZYGOTE_ENABLED ? [ZYGOTE_SCRIPT, 'run', script, ...args] : [script, ...args];
+}
+
 // Check Python availability
 let pythonCmd = null;
 (async () => {
@@ -340,6 +347,11 @@ let pythonCmd = null;
   }
   if (!pythonCmd) {
     console.log('✗ Python not found');
+  } else if (ZYGOTE_ENABLED) {
+    // Warm fork server: one-shot scripts skip the torch/onnxruntime imports
+    const zygote = spawn(pythonCmd, [ZYGOTE_SCRIPT, 'serve'], { detached: true, stdio: 'ignore' });
+    zygote.on('error', (err) => console.error('Zygote failed to start:', err.message));
+    zygote.unref();
   }
 })();
 
@@ -385,8 +397,11 @@ app.get('/api/armscaler-status', async (req, res) => {
       });
     }
     
+    // Answered from the capability snapshot (or the resident server); ?refresh=1 re-probes
+    const statusArgs = [ARMSCALER_QUICK_STATUS];
+    if (req.query.refresh) statusArgs.push('--refresh');
     const result = await new Promise((resolve, reject) => {
-      execFile(pythonCmd, [ARMSCALER_QUICK_STATUS], { timeout: 10000 }, (err, stdout) => {
+      execFile(pythonCmd, statusArgs, { timeout: req.query.refresh ? 120000 : 10000 }, (err, stdout) => {
         if (err) reject(err);
         else resolve(stdout.trim());
       });
@@ -414,6 +429,17 @@ app.get('/api/armscaler-status', async (req, res) => {
 const armScalerJobs = {};
 
 // Start processing job
+// Optional region of interest: roi = {x, y, w, h} (or [x, y, w, h]), roiMargin, roiCrop
+function roiArgs(body) {
+  const { roi, roiMargin, roiCrop } = body;
+  if (!roi) return [];
+  const rect = Array.isArray(roi) ? roi : [roi.x, roi.y, roi.w, roi.h];
+  const args = ['--roi', rect.map((v) => Math.round(Number(v))).join(',')];
+  if (roiMargin !== undefined) args.push('--roi-margin', String(parseInt(roiMargin, 10)));
+  if (roiCrop) args.push('--roi-crop');
+  return args;
+}
+
 app.post('/api/armscaler/job', async (req, res) => {
   const { imageBase64, task = 'sr', upscale = 4, quality = 'balanced' } = req.body;
   if (!imageBase64) return res.status(400).json({ error: 'No image data' });
@@ -428,7 +454,9 @@ app.post('/api/armscaler/job', async (req, res) => {
     logs: [['info', 'Starting ARMscaler inference...']],
     resultBase64: null,
     error: null,
-    progress: 10
+    progress: 10,
+    predictedSeconds: null,  // from armscaler_simple's cost model, once it has logged it
+    runStart: null
   };
   armScalerJobs[jobId] = job;
   
@@ -452,21 +480,20 @@ app.post('/api/armscaler/job', async (req, res) => {
     NVIDIA_TF32_OVERRIDE: '1'
   };
   
-  const child = spawn(pythonCmd || 'python3', [
-    ARMSCALER_SCRIPT,
+  const child = spawn(pythonCmd || 'python3', pythonArgs(ARMSCALER_SCRIPT, [
     inputPath,
     outputPath,
     '--task', task,
     '--upscale', String(upscale),
-    '--quality', quality
-  ], { env });
+    '--quality', quality,
+    ...roiArgs(req.body)
+  ]), { env });
   
   let stdoutBuffer = '';
   let stderrBuffer = '';
   
   child.stdout.on('data', (data) => {
     stdoutBuffer += data.toString();
-    job.progress = Math.min(90, job.progress + 5);
     
     // Parse progress from output
     const lines = data.toString().split('\n');
@@ -483,6 +510,11 @@ app.post('/api/armscaler/job', async (req, res) => {
     stderrBuffer += data.toString();
     const lines = data.toString().split('\n');
     for (const line of lines) {
+      const predicted = line.match(/Predicted duration: ([\d.]+)s/);
+      if (predicted) {
+        job.predictedSeconds = parseFloat(predicted[1]);
+        job.runStart = Date.now();
+      }
       if (line.trim()) {
         job.logs.push(['info', line.trim()]);
       }
@@ -520,14 +552,29 @@ app.post('/api/armscaler/job', async (req, res) => {
   res.json({ job_id: jobId });
 });
 
+// Progress and ETA from elapsed time against the predicted duration (capped at 95% until done)
+function jobProgress(job) {
+  if (job.status !== 'running' || !job.predictedSeconds) {
+    return { progress: job.progress, etaSeconds: null };
+  }
+  const elapsed = (Date.now() - job.runStart) / 1000;
+  return {
+    progress: Math.round(Math.min(95, 10 + 85 * elapsed / job.predictedSeconds)),
+    etaSeconds: Math.max(0, Math.round(job.predictedSeconds - elapsed))
+  };
+}
+
 app.get('/api/armscaler/job/:id', (req, res) => {
   const job = armScalerJobs[req.params.id];
   if (!job) return res.status(404).json({ error: 'Job not found' });
   
+  const { progress, etaSeconds } = jobProgress(job);
   res.json({
     id: job.id,
     status: job.status,
-    progress: job.progress,
+    progress,
+    etaSeconds,
+    predictedSeconds: job.predictedSeconds,
     logs: job.logs.map(([type, msg]) => `[${type}] ${msg}`),
     error: job.error,
     imageBase64: job.status === 'done' ? job.resultBase64 : undefined,
@@ -564,14 +611,14 @@ app.post('/api/armscaler', async (req, res) => {
     };
     
     await new Promise((resolve, reject) => {
-      const child = spawn(pythonCmd || 'python3', [
-        ARMSCALER_SCRIPT,
+      const child = spawn(pythonCmd || 'python3', pythonArgs(ARMSCALER_SCRIPT, [
         inputPath,
         outputPath,
         '--task', task,
         '--upscale', String(upscale),
-        '--quality', quality
-      ], { env });
+        '--quality', quality,
+        ...roiArgs(req.body)
+      ]), { env });
       
       let stderr = '';
       child.stderr.on('data', (d) => {
@@ -615,8 +662,62 @@ app.post('/api/armscaler', async (req, res) => {
 // ═══════════════════════════════════════════════════════════════
 
 const INPAINT_SCRIPT = path.join(__dirname, 'inpaint_lama.py');
+const INPAINT_SERVER_SCRIPT = path.join(__dirname, 'inpaint_server.py');
 const MODEL_PATH = path.join(__dirname, 'models', 'lama_fp32.onnx');
 
+// Resident LaMa server: one warm ONNX session shared by every request
+let inpaintServer = null;
+
+function getInpaintServer() {
+  if (inpaintServer) return inpaintServer;
+
+  const child = spawn(pythonCmd, [INPAINT_SERVER_SCRIPT, '--model', MODEL_PATH]);
+  const server = { child, pending: new Map(), nextId: 1, buffer: '' };
+
+  child.stdout.on('data', (data) => {
+    server.buffer += data.toString();
+    let nl;
+    while ((nl = server.buffer.indexOf('\n')) >= 0) {
+      const line = server.buffer.slice(0, nl).trim();
+      server.buffer = server.buffer.slice(nl + 1);
+      const msg = fastParseJSON(line, null);
+      if (msg && msg.id !== undefined && server.pending.has(msg.id)) {
+        server.pending.get(msg.id).resolve(msg);
+        server.pending.delete(msg.id);
+      }
+    }
+  });
+  child.stderr.resume(); // engine progress logs
+  child.on('exit', () => {
+    for (const { reject } of server.pending.values()) reject(new Error('Inpaint server exited'));
+    server.pending.clear();
+    if (inpaintServer === server) inpaintServer = null;
+  });
+  child.on('error', () => {});
+
+  inpaintServer = server;
+  return server;
+}
+
+function inpaintServerRequest(cmd, timeoutMs) {
+  const server = getInpaintServer();
+  const id = server.nextId++;
+  return new Promise((resolve, reject) => {
+    const timer = setTimeout(() => {
+      server.pending.delete(id);
+      // A running LaMa pass can't be withdrawn: stop the server so it can't write
+      // this request's output later (the next request starts a fresh one)
+      server.child.kill();
+      reject(new Error('Inpaint server timeout'));
+    }, timeoutMs);
+    server.pending.set(id, {
+      resolve: (msg) => { clearTimeout(timer); resolve(msg); },
+      reject: (err) => { clearTimeout(timer); reject(err); }
+    });
+    server.child.stdin.write(JSON.stringify({ ...cmd, id }) + '\n');
+  });
+}
+
 app.get('/api/inpaint-status', async (req, res) => {
   try {
     await fsPromises.access(MODEL_PATH);
@@ -637,6 +738,9 @@ app.post('/api/inpaint', async (req, res) => {
   if (!imageBase64 || !mask) {
     return res.status(400).json({ error: 'Missing imageBase64 or mask' });
   }
+  if (!pythonCmd) {
+    return res.status(503).json({ error: 'Python not found' });
+  }
   
   const tmpDir = path.join(os.tmpdir(), 'zimage-inpaint');
   try {
@@ -644,29 +748,47 @@ app.post('/api/inpaint', async (req, res) => {
     
     const ts = Date.now();
     const inputPath = path.join(tmpDir, `input_${ts}.png`);
-    const outputPath = path.join(tmpDir, `output_${ts}.png`);
+    let outputPath = path.join(tmpDir, `output_${ts}.png`);
     
     const base64Data = imageBase64.replace(/^data:image\/\w+;base64,/, '');
     await fsPromises.writeFile(inputPath, Buffer.from(base64Data, 'base64'));
     
-    const args = [
-      INPAINT_SCRIPT,
+    const fallbackPath = path.join(tmpDir, `output_${ts}_oneshot.png`);
+    const args = pythonArgs(INPAINT_SCRIPT, [
       inputPath,
-      outputPath,
+      fallbackPath,
       String(Math.round(mask.x)),
       String(Math.round(mask.y)),
       String(Math.round(mask.w)),
       String(Math.round(mask.h)),
       String(Math.round(mask.padding || 3)),
       MODEL_PATH
-    ];
+    ]);
     
-    await new Promise((resolve, reject) => {
-      execFile(pythonCmd || 'python3', args, { timeout: 60000 }, (err) => {
-        if (err) reject(err);
-        else resolve();
+    try {
+      const response = await inpaintServerRequest({
+        action: 'inpaint',
+        input_path: inputPath,
+        output_path: outputPath,
+        x: Math.round(mask.x),
+        y: Math.round(mask.y),
+        w: Math.round(mask.w),
+        h: Math.round(mask.h),
+        padding: Math.round(mask.padding || 3)
+      }, 60000);
+      if (!response.success) throw new Error(response.error || 'Inpaint failed');
+    } catch (serverErr) {
+      console.error('Inpaint server failed, using one-shot script:', serverErr.message);
+      // Own output path: nothing the resident server wrote can be mistaken for this result
+      try { await fsPromises.unlink(outputPath); } catch(e) {}
+      outputPath = fallbackPath;
+      await new Promise((resolve, reject) => {
+        execFile(pythonCmd, args, { timeout: 60000 }, (err) => {
+          if (err) reject(err);
+          else resolve();
+        });
       });
-    });
+    }
     
     try {
       await fsPromises.access(outputPath);
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Bounded LRU for intermediate pipeline outputs (cleaner output, VAE
+condition latents) so re-runs of the same input at another quality preset
+skip straight to sampling.
+
+Values are tensors, arrays, or dicts/lists/tuples of them. Tensors are kept
+on the CPU and moved back to the device they came from on a hit, so the
+cache costs host RAM, not VRAM. Hits and misses are counted per kind.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+def _map(value, fn):
+    if isinstance(value, dict):
+        return {k: _map(v, fn) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_map(v, fn) for v in value)
+    return fn(value)
+
+
+def _nbytes(value):
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    if hasattr(value, 'element_size') and hasattr(value, 'numel'):  # torch.Tensor
+        return value.element_size() * value.numel()
+    return getattr(value, 'nbytes', 0)
+
+
+def _device(value):
+    found = []
+    _map(value, lambda v: found.append(v.device) if hasattr(v, 'device') and hasattr(v, 'to') else None)
+    return found[0] if found else None
+
+
+def _to(value, device, copy=False):
+    """Tensors moved to device (always a new tensor with copy=True); anything else as is"""
+    return _map(value, lambda v: v.detach().to(device, copy=copy) if hasattr(v, 'detach') else v)
+
+
+class StageCache:
+    """`get(kind, key)` / `put(kind, key, value)` under one byte budget"""
+
+    def __init__(self, max_bytes=1 << 30, enabled=True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries = OrderedDict()  # (kind, key) -> (value on cpu, device, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def _count(self, kind, field):
+        counts = self.counters.setdefault(kind, {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0})
+        counts[field] += 1
+
+    def get(self, kind, key):
+        """The cached value on its original device, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None:
+                self._count(kind, 'misses')
+                return None
+            self._entries.move_to_end((kind, key))
+            self._count(kind, 'hits')
+        value, device, _ = entry
+        return _to(value, device, copy=True) if device is not None else value
+
+    def put(self, kind, key, value):
+        if not self.enabled or value is None:
+            return
+        device = _device(value)
+        stored = _to(value, 'cpu', copy=True) if device is not None else value
+        size = _nbytes(stored)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((kind, key), None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[(kind, key)] = (stored, device, size)
+            self._bytes += size
+            self._count(kind, 'stores')
+            while self._bytes > self.max_bytes:
+                (evicted_kind, _), (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._count(evicted_kind, 'evictions')
+
+    def stats(self):
+        with self._lock:
+            kinds = {}
+            for kind, counts in self.counters.items():
+                lookups = counts['hits'] + counts['misses']
+                kinds[kind] = dict(counts, hit_rate=round(counts['hits'] / lookups, 3) if lookups else None)
+            return {'enabled': self.enabled, 'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, **kinds}
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Tile planner for the DiffBIR pipeline.
+
+Estimates the peak memory of each stage (cleaner, VAE encoder, CLDM
+sampler, VAE decoder) from the input and output size, precision, batch
+size and tile parameters, then picks per stage:
+
+  - no tiling when the whole image fits the budget,
+  - else the largest tile that fits, with the smallest overlap that still
+    keeps MIN_OVERLAP of the tile (strides are spread evenly so the last
+    tile isn't a sliver).
+
+The per-pixel costs below are rough fp16 working sets with DiffBIR's
+SDPA/xformers attention (linear in tile area); fp32 doubles them. Plans
+are logged next to the measured CUDA peak so they can be recalibrated.
+
+    python3 tile_planner.py WIDTH HEIGHT [--upscale 4] [--budget-mb 8192] [--precision fp16]
+"""
+
+import sys
+import json
+import math
+
+# Bytes per pixel at fp16
+CLEANER_BYTES_PER_INPUT_PX = 3072      # RRDB/SwinIR activations, incl. the 4x upsampled head
+VAE_ENCODER_BYTES_PER_PX = 1024        # 128-channel blocks at full resolution
+VAE_DECODER_BYTES_PER_PX = 1536        # same, plus the wider up-blocks
+CLDM_BYTES_PER_PX = 384                # UNet + ControlNet per latent token (/64), cfg doubles the batch
+BASE_BYTES_PER_OUTPUT_PX = 48          # full-size image, condition and latent buffers held throughout
+
+MIN_OVERLAP = 0.25
+ALIGN = 8
+
+# Candidate tile sizes, largest first (cleaner in input pixels, the rest in output pixels)
+TILE_SIZES = {
+    'cleaner': (1024, 768, 512, 384, 256, 128),
+    'vae_encoder': (2048, 1536, 1024, 768, 512, 384, 256),
+    'cldm': (2048, 1536, 1024, 768, 512, 256),
+    'vae_decoder': (2048, 1536, 1024, 768, 512, 384, 256),
+}
+STAGE_COST = {
+    'cleaner': CLEANER_BYTES_PER_INPUT_PX,
+    'vae_encoder': VAE_ENCODER_BYTES_PER_PX,
+    'cldm': CLDM_BYTES_PER_PX,
+    'vae_decoder': VAE_DECODER_BYTES_PER_PX,
+}
+STRIDED = ('cleaner', 'cldm')  # the VAE tiles use DiffBIR's fixed internal overlap
+
+
+def _precision_scale(precision):
+    return 2 if precision == 'fp32' else 1
+
+
+def _tile_count(length, tile, stride):
+    if length <= tile:
+        return 1
+    return math.ceil((length - tile) / stride) + 1
+
+
+def _stride(width, height, tile, min_overlap):
+    """Largest ALIGN-multiple stride keeping min_overlap, spread evenly over the longer side"""
+    max_stride = max(ALIGN, (tile - math.ceil(tile * min_overlap)) // ALIGN * ALIGN)
+    length = max(width, height)
+    n = _tile_count(length, tile, max_stride)
+    if n <= 1:
+        return max_stride
+    even = math.ceil((length - tile) / (n - 1) / ALIGN) * ALIGN
+    return min(max_stride, even)
+
+
+def stage_bytes(stage, width, height, tile=None, precision='fp16', batch=1):
+    """Working set of one stage over a width x height image (tile=None: untiled)"""
+    if tile is not None:
+        width, height = min(width, tile), min(height, tile)
+    return width * height * STAGE_COST[stage] * _precision_scale(precision) * batch
+
+
+def plan_tiles(input_size, output_size, budget_bytes, precision='fp16', batch=1,
+               min_overlap=MIN_OVERLAP):
+    """Tiling plan for one sampling loop.
+
+    input_size/output_size are (w, h) of the low-quality input and the
+    result. Returns {'stages': {stage: {...}}, 'base_bytes', 'peak_bytes',
+    'budget_bytes', 'fits'}; each stage has tiled, tile, stride, tiles and
+    bytes (its estimated working set).
+    """
+    out_w, out_h = output_size
+    base = out_w * out_h * BASE_BYTES_PER_OUTPUT_PX * _precision_scale(precision) * batch
+    available = budget_bytes - base
+    stages = {}
+    fits = available > 0
+    for stage, sizes in TILE_SIZES.items():
+        w, h = input_size if stage == 'cleaner' else output_size
+        whole = stage_bytes(stage, w, h, None, precision, batch)
+        if whole <= available:
+            stages[stage] = {'tiled': False, 'tile': max(w, h), 'stride': max(w, h),
+                             'tiles': 1, 'bytes': whole}
+            continue
+        # Tiles at least as large as the image would be the untiled case again
+        candidates = [t for t in sizes if t < max(w, h)] or [sizes[-1]]
+        chosen = next((t for t in candidates
+                       if stage_bytes(stage, w, h, t, precision, batch) <= available), None)
+        if chosen is None:
+            chosen, fits = candidates[-1], False
+        stride = _stride(w, h, chosen, min_overlap) if stage in STRIDED else chosen
+        stages[stage] = {'tiled': True, 'tile': chosen, 'stride': stride,
+                         'tiles': _tile_count(w, chosen, stride) * _tile_count(h, chosen, stride),
+                         'bytes': stage_bytes(stage, w, h, chosen, precision, batch)}
+    return {
+        'stages': stages,
+        'base_bytes': base,
+        'peak_bytes': base + max(s['bytes'] for s in stages.values()),
+        'budget_bytes': budget_bytes,
+        'fits': fits,
+    }
+
+
+def apply_plan(args, plan):
+    """Set the InferenceLoop args' tiling fields from a plan"""
+    for stage, entry in plan['stages'].items():
+        setattr(args, f'{stage}_tiled', entry['tiled'])
+        setattr(args, f'{stage}_tile_size', entry['tile'])
+        if stage in STRIDED:
+            setattr(args, f'{stage}_tile_stride', entry['stride'])
+
+
+def plan_cli_args(plan):
+    """The same plan as inference.py flags"""
+    flags = []
+    for stage, entry in plan['stages'].items():
+        if not entry['tiled']:
+            continue
+        flags += [f'--{stage}_tiled', f'--{stage}_tile_size', str(entry['tile'])]
+        if stage in STRIDED:
+            flags += [f'--{stage}_tile_stride', str(entry['stride'])]
+    return flags
+
+
+def describe(plan):
+    """One log line: each stage's tiling and the estimated peak against the budget"""
+    parts = []
+    for stage, entry in plan['stages'].items():
+        if not entry['tiled']:
+            parts.append(f"{stage}=whole")
+        elif stage in STRIDED:
+            parts.append(f"{stage}={entry['tile']}/{entry['stride']}x{entry['tiles']}")
+        else:
+            parts.append(f"{stage}={entry['tile']}x{entry['tiles']}")
+    note = '' if plan['fits'] else ' (over budget at the smallest tiles)'
+    return (f"{' '.join(parts)} | est. peak {plan['peak_bytes'] / 2**20:.0f}MB"
+            f" of {plan['budget_bytes'] / 2**20:.0f}MB{note}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} WIDTH HEIGHT [--upscale 4] [--budget-mb 8192] [--precision fp16] [--batch 1]")
+        sys.exit(1)
+
+    width, height = int(sys.argv[1]), int(sys.argv[2])
+    opts = {'upscale': 4, 'budget_mb': 8192, 'precision': 'fp16', 'batch': 1}
+    args = sys.argv[3:]
+    i = 0
+    while i < len(args):
+        if args[i] == '--upscale' and i + 1 < len(args):
+            opts['upscale'] = int(args[i + 1]); i += 2
+        elif args[i] == '--budget-mb' and i + 1 < len(args):
+            opts['budget_mb'] = int(args[i + 1]); i += 2
+        elif args[i] == '--precision' and i + 1 < len(args):
+            opts['precision'] = args[i + 1]; i += 2
+        elif args[i] == '--batch' and i + 1 < len(args):
+            opts['batch'] = int(args[i + 1]); i += 2
+        else:
+            i += 1
+
+    plan = plan_tiles((width, height), (width * opts['upscale'], height * opts['upscale']),
+                      opts['budget_mb'] << 20, opts['precision'], opts['batch'])
+    print(describe(plan), file=sys.stderr)
+    print(json.dumps(plan, indent=2))
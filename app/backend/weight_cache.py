@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Pre-converted DiffBIR weights: each checkpoint in diffbir_engine/weights is
+converted once to a safetensors file already cast to the run's precision,
+and later loads memory-map that file instead of unpickling the .pth.
+
+Cache files are <stem>-<source sha256[:16]>-<precision>.safetensors under
+~/.cache/zarma/weights (ARMSCALER_WEIGHT_CACHE_DIR). Source hashes are kept
+in index.json against size and mtime, so a load doesn't re-read the
+checkpoint just to hash it. Checkpoints that aren't a plain dict of tensors
+(optionally under "state_dict") are left to torch.load.
+
+Inside `patched(precision)` every torch.load of a checkpoint under the
+weights directory goes through the cache; a miss loads the checkpoint and
+writes its cache file. Each load is timed per file.
+
+    python3 weight_cache.py prepare [--precision fp16|bf16|fp32] [--weights-dir DIR]
+    python3 weight_cache.py bench [--precision P] [--cold]   # torch.load vs cache, per file
+    python3 weight_cache.py list | clear
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import contextlib
+import importlib.util
+from pathlib import Path
+
+from result_cache import CACHE_ROOT
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+WEIGHTS_DIR = SCRIPT_DIR / 'diffbir_engine' / 'weights'
+CACHE_DIR = Path(os.environ.get('ARMSCALER_WEIGHT_CACHE_DIR', CACHE_ROOT / 'weights'))
+ENABLED = os.environ.get('ARMSCALER_WEIGHT_CACHE', '1') != '0'
+AUTO_PREPARE = os.environ.get('ARMSCALER_WEIGHT_CACHE_AUTO', '1') != '0'
+CHECKPOINT_SUFFIXES = ('.pth', '.pt', '.ckpt')
+PRECISIONS = ('fp16', 'bf16', 'fp32')
+HASH_CHUNK = 8 << 20
+
+_index_lock = threading.Lock()
+_load_times = []  # every timed load in this process, oldest first
+
+
+def log(msg):
+    print(f"  {msg}", file=sys.stderr, flush=True)
+
+
+def _dtype(precision):
+    import torch
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision} (expected one of {', '.join(PRECISIONS)})")
+    return {'fp16': torch.float16, 'bf16': torch.bfloat16, 'fp32': torch.float32}[precision]
+
+
+def checkpoints(weights_dir=WEIGHTS_DIR):
+    return sorted(p for p in Path(weights_dir).glob('*') if p.suffix in CHECKPOINT_SUFFIXES)
+
+
+# ── Source identity ──
+
+def _load_index():
+    try:
+        with open(CACHE_DIR / 'index.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(index):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_DIR / f'index.json.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp, CACHE_DIR / 'index.json')
+
+
+def source_hash(source):
+    """sha256 of the checkpoint, re-read only when its size or mtime changed"""
+    source = Path(source).resolve()
+    st = source.stat()
+    with _index_lock:
+        entry = _load_index().get(str(source))
+    if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+        return entry['sha256']
+    h = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    with _index_lock:
+        index = _load_index()
+        index[str(source)] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': h.hexdigest()}
+        _save_index(index)
+    return h.hexdigest()
+
+
+def cache_path(source, precision):
+    source = Path(source)
+    return CACHE_DIR / f"{source.stem}-{source_hash(source)[:16]}-{precision}.safetensors"
+
+
+# ── Conversion ──
+
+def _state_dict(obj):
+    """(tensors, wrapper key or '') for a plain tensor dict, else (None, None)"""
+    import torch
+    wrapper = ''
+    if isinstance(obj, dict) and isinstance(obj.get('state_dict'), dict):
+        obj, wrapper = obj['state_dict'], 'state_dict'
+    if not isinstance(obj, dict) or not obj:
+        return None, None
+    if not all(isinstance(k, str) and isinstance(v, torch.Tensor) for k, v in obj.items()):
+        return None, None
+    return obj, wrapper
+
+
+def _cast(tensors, precision):
+    """Floating tensors in the target dtype, contiguous, with no shared storage"""
+    dtype = _dtype(precision)
+    out, seen = {}, set()
+    for name, tensor in tensors.items():
+        tensor = tensor.detach().cpu()
+        if tensor.is_floating_point():
+            tensor = tensor.to(dtype)
+        tensor = tensor.contiguous()
+        if tensor.numel() and tensor.data_ptr() in seen:
+            tensor = tensor.clone()
+        seen.add(tensor.data_ptr())
+        out[name] = tensor
+    return out
+
+
+def convert(source, precision, checkpoint=None):
+    """Write the cache file for `source` (loading it unless `checkpoint` is given).
+
+    Returns the cache path, or None when the checkpoint isn't a tensor dict.
+    """
+    import torch
+    from safetensors.torch import save_file
+    target = cache_path(source, precision)
+    if target.exists():
+        return target
+    if checkpoint is None:
+        checkpoint = _original_load(str(source), map_location='cpu')
+    tensors, wrapper = _state_dict(checkpoint)
+    if tensors is None:
+        return None
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + f'.{os.getpid()}.tmp')
+    try:
+        save_file(_cast(tensors, precision), str(tmp),
+                  metadata={'source': Path(source).name, 'precision': precision, 'wrapper': wrapper,
+                            'torch': torch.__version__})
+        os.replace(tmp, target)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return target
+
+
+def _record(source, origin, seconds, nbytes, precision):
+    entry = {'file': Path(source).name, 'source': origin, 'precision': precision,
+             'seconds': round(seconds, 3), 'bytes': nbytes, 'time': time.time()}
+    _load_times.append(entry)
+    return entry
+
+
+def load(source, precision):
+    """The cached state for `source`, memory-mapped (None on a cache miss)"""
+    from safetensors import safe_open
+    from safetensors.torch import load_file
+    path = cache_path(source, precision)
+    if not path.exists():
+        return None
+    start = time.time()
+    with safe_open(str(path), framework='pt') as f:
+        wrapper = (f.metadata() or {}).get('wrapper', '')
+    tensors = load_file(str(path), device='cpu')
+    _record(source, 'cache', time.time() - start, path.stat().st_size, precision)
+    return {wrapper: tensors} if wrapper else tensors
+
+
+def load_times():
+    return [dict(entry) for entry in _load_times]
+
+
+# ── torch.load hook ──
+
+_torch_load = None  # the real torch.load while patched() is active
+
+
+def _weight_file(f):
+    """Path of `f` if it names a checkpoint under the weights directory"""
+    if not isinstance(f, (str, os.PathLike)):
+        return None
+    path = Path(f).resolve()
+    if path.suffix not in CHECKPOINT_SUFFIXES or path.parent != WEIGHTS_DIR.resolve():
+        return None
+    return path
+
+
+def _map_location(state, location):
+    if location is None or str(location) == 'cpu':
+        return state
+    if isinstance(state, dict) and len(state) == 1 and isinstance(next(iter(state.values())), dict):
+        (key, tensors), = state.items()
+        return {key: {k: v.to(location) for k, v in tensors.items()}}
+    return {k: v.to(location) for k, v in state.items()}
+
+
+@contextlib.contextmanager
+def patched(precision, auto_prepare=AUTO_PREPARE):
+    """Route torch.load of weights-directory checkpoints through the cache.
+
+    Yields the list of this block's per-file load records.
+    """
+    global _torch_load
+    import torch
+    records = []
+    if not ENABLED:
+        yield records
+        return
+    if importlib.util.find_spec('safetensors') is None:
+        log("safetensors not installed; loading checkpoints directly")
+        yield records
+        return
+    original = torch.load
+
+    def cached_load(f, *args, **kwargs):
+        path = _weight_file(f)
+        location = kwargs.get('map_location', args[0] if args else None)
+        if path is None or not (location is None or isinstance(location, (str, torch.device))):
+            return original(f, *args, **kwargs)
+        try:
+            state = load(path, precision)
+        except Exception as e:
+            log(f"Weight cache: {path.name} unreadable ({e}); loading the checkpoint")
+            state = None
+        if state is not None:
+            records.append(_load_times[-1])
+            return _map_location(state, location)
+        start = time.time()
+        checkpoint = original(f, *args, **kwargs)
+        records.append(_record(path, 'checkpoint', time.time() - start, path.stat().st_size, precision))
+        if auto_prepare:
+            try:
+                start = time.time()
+                if convert(path, precision, checkpoint) is not None:
+                    log(f"Weight cache: converted {path.name} to {precision} in {time.time() - start:.1f}s")
+            except Exception as e:
+                log(f"Weight cache: could not convert {path.name}: {e}")
+        return checkpoint
+
+    _torch_load, torch.load = original, cached_load
+    try:
+        yield records
+    finally:
+        torch.load = original
+        _torch_load = None
+
+
+def _original_load(*args, **kwargs):
+    import torch
+    return (_torch_load or torch.load)(*args, **kwargs)
+
+
+# ── CLI ──
+
+def _drop_page_cache(path):
+    """Evict a file from the page cache so the next read is a cold one"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except (OSError, AttributeError):
+        pass
+
+
+def prepare(weights_dir=WEIGHTS_DIR, precision='fp16'):
+    for source in checkpoints(weights_dir):
+        start = time.time()
+        target = convert(source, precision)
+        if target is None:
+            print(f"{source.name}: skipped (not a plain state dict)")
+        else:
+            print(f"{source.name}: {target.name} ({target.stat().st_size / 1e6:.0f} MB, "
+                  f"{time.time() - start:.1f}s)")
+
+
+def bench(weights_dir=WEIGHTS_DIR, precision='fp16', cold=False):
+    """torch.load vs the mapped cache for each checkpoint, on the CPU"""
+    print(f"{'file':32} {'checkpoint_s':>12} {'cache_s':>8} {'speedup':>8}")
+    for source in checkpoints(weights_dir):
+        target = convert(source, precision)
+        if target is None:
+            print(f"{source.name:32} {'(not a plain state dict)':>30}")
+            continue
+        if cold:
+            _drop_page_cache(source)
+        start = time.time()
+        checkpoint = _original_load(str(source), map_location='cpu')
+        checkpoint_s = time.time() - start
+        del checkpoint
+        if cold:
+            _drop_page_cache(target)
+        state = load(source, precision)
+        cache_s = _load_times[-1]['seconds']
+        del state
+        print(f"{source.name:32} {checkpoint_s:12.2f} {cache_s:8.2f} {checkpoint_s / max(cache_s, 1e-3):7.1f}x")
+
+
+def main(argv):
+    if not argv or argv[0] not in ('prepare', 'bench', 'list', 'clear'):
+        print(f"Usage: {sys.argv[0]} prepare [--precision fp16|bf16|fp32] [--weights-dir DIR]", file=sys.stderr)
+        print(f"       {sys.argv[0]} bench [--precision P] [--weights-dir DIR] [--cold]", file=sys.stderr)
+        print(f"       {sys.argv[0]} list | clear", file=sys.stderr)
+        return 1
+    command, opts = argv[0], {'weights_dir': WEIGHTS_DIR, 'precision': 'fp16', 'cold': False}
+    i = 1
+    while i < len(argv):
+        if argv[i] == '--precision' and i + 1 < len(argv):
+            opts['precision'] = argv[i + 1]
+            i += 2
+        elif argv[i] == '--weights-dir' and i + 1 < len(argv):
+            opts['weights_dir'] = Path(argv[i + 1])
+            i += 2
+        elif argv[i] == '--cold':
+            opts['cold'] = True
+            i += 1
+        else:
+            print(f"Unknown option: {argv[i]}", file=sys.stderr)
+            return 1
+    if opts['precision'] not in PRECISIONS:
+        print(f"Unknown precision: {opts['precision']}", file=sys.stderr)
+        return 1
+    if command == 'list':
+        for path in sorted(CACHE_DIR.glob('*.safetensors')):
+            print(f"{path.name}  {path.stat().st_size / 1e6:.0f} MB")
+        return 0
+    if command == 'clear':
+        for path in CACHE_DIR.glob('*.safetensors'):
+            path.unlink()
+        (CACHE_DIR / 'index.json').unlink(missing_ok=True)
+        return 0
+    if not checkpoints(opts['weights_dir']):
+        print(f"No checkpoints in {opts['weights_dir']}", file=sys.stderr)
+        return 1
+    if command == 'prepare':
+        prepare(opts['weights_dir'], opts['precision'])
+    else:
+        bench(opts['weights_dir'], opts['precision'], opts['cold'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Fork server ("zygote") for the one-shot Python scripts.
+
+`serve` imports the heavy modules once (numpy, PIL, onnxruntime, torch,
+DiffBIR's inference package; never initializing CUDA) and waits on a Unix
+socket. `run SCRIPT ARGS...` connects and hands over its argv, environment,
+cwd and stdin/stdout/stderr file descriptors. The zygote forks a child
+that runs SCRIPT as __main__ on those descriptors, with the client's CPU affinity
+and a torch thread count from its OMP_NUM_THREADS. The client relays
+SIGINT/SIGTERM/SIGHUP and exits with the child's status. A spawned
+script starts in milliseconds instead of re-importing torch.
+
+Each job gets a small monitor process between the zygote and the script.
+It reports the exit status (signals included) and kills the script if the
+client goes away, e.g. on a subprocess timeout. Without a zygote that
+matches this interpreter (or with ZARMA_ZYGOTE=0), `run` execs the script
+in a plain interpreter exactly as before, and starts a zygote in the
+background for the next call.
+
+    python3 zygote.py serve [--socket PATH] [--idle-timeout S]
+    python3 zygote.py run SCRIPT [ARGS...]
+    python3 zygote.py status | stop
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import fcntl
+import errno
+import signal
+import select
+import socket
+
+# The client runs on every spawn, so this module sticks to cheap imports (no tempfile/pathlib)
+ZYGOTE_SCRIPT = os.path.abspath(__file__)
+DIFFBIR_DIR = os.path.join(os.path.dirname(ZYGOTE_SCRIPT), 'diffbir_engine')
+TMP_DIR = os.environ.get('TMPDIR') or '/tmp'
+SOCKET_PATH = os.environ.get('ZARMA_ZYGOTE_SOCKET', os.path.join(TMP_DIR, 'zarma_zygote.sock'))
+LOG_PATH = os.environ.get('ZARMA_ZYGOTE_LOG', os.path.join(TMP_DIR, 'zarma_zygote.log'))
+ENABLED = os.environ.get('ZARMA_ZYGOTE', '1') != '0'
+AUTOSTART = os.environ.get('ZARMA_ZYGOTE_AUTOSTART', '1') != '0'
+IDLE_TIMEOUT = float(os.environ.get('ZARMA_ZYGOTE_IDLE_TIMEOUT', '3600'))
+PRELOAD = os.environ.get('ZARMA_ZYGOTE_PRELOAD',
+                         'numpy,PIL.Image,onnxruntime,torch,torchvision,diffbir.inference').split(',')
+CONNECT_TIMEOUT = 2.0
+KILL_GRACE = 5.0  # seconds between SIGTERM and SIGKILL once the client is gone
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+
+_preloaded = []
+_spawned = 0
+_torch_threads = None  # torch's default pool size here, for jobs that don't set OMP_NUM_THREADS
+THREAD_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def log(msg):
+    print(f"  {msg}", file=sys.stderr, flush=True)
+
+
+# ── Zygote ──
+
+def preload(modules=PRELOAD):
+    """Import what every job would import; the same backend flags as armscaler_server.
+
+    Nothing here runs a parallel op, so no OpenMP pool exists yet at fork.
+    Thread counts are per job (see _apply_cpu), so the zygote's own
+    OMP/MKL settings are dropped first and torch keeps its plain default.
+    """
+    global _torch_threads
+    import importlib
+    for var in THREAD_VARS:
+        os.environ.pop(var, None)
+    sys.path.insert(1, DIFFBIR_DIR)
+    for name in (m.strip() for m in modules if m.strip()):
+        start = time.time()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            log(f"Preload {name}: skipped ({e})")
+            continue
+        _preloaded.append(name)
+        log(f"Preload {name}: {time.time() - start:.2f}s")
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        _torch_threads = torch.get_num_threads()
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
+        if torch.cuda.is_initialized():
+            log("WARNING: CUDA was initialized while preloading; forked jobs cannot use the GPU")
+
+
+def _recv_request(conn):
+    """(request dict, [stdin, stdout, stderr] fds) from one client"""
+    data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 3)
+    while not data.endswith(b'\n'):
+        more = conn.recv(1 << 16)
+        if not more:
+            break
+        data += more
+    return json.loads(data), fds
+
+
+def _send(conn, obj):
+    try:
+        conn.sendall((json.dumps(obj) + '\n').encode('utf-8'))
+    except OSError:
+        pass
+
+
+def _stdio(fd, mode, unbuffered):
+    """A fresh sys.std* for fd, buffered the way a new interpreter would buffer it"""
+    if mode == 'r':
+        return io.TextIOWrapper(open(fd, 'rb', closefd=False), encoding='utf-8')
+    binary = open(fd, 'wb', buffering=0 if unbuffered else -1, closefd=False)
+    return io.TextIOWrapper(binary, encoding='utf-8',
+                            errors='backslashreplace' if fd == 2 else 'strict',
+                            line_buffering=fd == 2 or os.isatty(fd), write_through=unbuffered)
+
+
+def _apply_cpu(request):
+    """The job's CPU affinity and thread count, as if it had been spawned by the client.
+
+    A fork inherits the zygote's affinity and the torch pool size read when
+    torch was imported here, so both are set again from the request.
+    """
+    affinity = request.get('affinity')
+    if affinity:
+        try:
+            os.sched_setaffinity(0, affinity)
+        except OSError as e:
+            log(f"Zygote: could not restore CPU affinity: {e}")
+    torch = sys.modules.get('torch')
+    if torch is None:
+        return
+    threads = os.environ.get('OMP_NUM_THREADS', '')
+    if threads.isdigit() and int(threads) > 0:
+        torch.set_num_threads(int(threads))
+    elif _torch_threads:
+        torch.set_num_threads(max(1, min(_torch_threads, len(os.sched_getaffinity(0)))))
+
+
+def _run_script(request, fds):
+    """Become `python argv...` on the client's stdio (in the forked job; never returns)"""
+    code = 1
+    try:
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            if fd > 2:
+                os.close(fd)
+        for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        _apply_cpu(request)
+        unbuffered = bool(os.environ.get('PYTHONUNBUFFERED'))
+        sys.stdin, sys.stdout, sys.stderr = (_stdio(0, 'r', False), _stdio(1, 'w', unbuffered),
+                                             _stdio(2, 'w', unbuffered))
+
+        script = os.path.abspath(request['argv'][0])
+        sys.argv = list(request['argv'])
+        sys.path[0] = os.path.dirname(script)
+        for entry in reversed(os.environ.get('PYTHONPATH', '').split(os.pathsep)):
+            if entry and entry not in sys.path:
+                sys.path.insert(1, entry)
+
+        import runpy
+        try:
+            runpy.run_path(script, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+    except KeyboardInterrupt:
+        code = 128 + signal.SIGINT
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(code & 0xff)
+
+
+def _monitor(conn, request, fds):
+    """Fork the job, tell the client its pid, wait for it; kill it if the client leaves"""
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        _run_script(request, fds)
+    for fd in fds:
+        os.close(fd)
+    _send(conn, {'pid': pid})
+    # A pidfd becomes readable when the job exits, so the exit is reported without polling delay
+    exited = [os.pidfd_open(pid)] if hasattr(os, 'pidfd_open') else []
+    deadline = None
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        if deadline is not None:
+            if time.time() >= deadline:
+                os.kill(pid, signal.SIGKILL)
+                deadline = float('inf')
+            select.select(exited, [], [], 0.05)
+            continue
+        readable, _, _ = select.select([conn] + exited, [], [], 0.2)
+        if conn in readable and not conn.recv(4096):
+            os.kill(pid, signal.SIGTERM)  # client gone (killed, timed out): don't leave the job running
+            deadline = time.time() + KILL_GRACE
+    _send(conn, {'exit': os.waitstatus_to_exitcode(status)})
+
+
+def _reap(children):
+    while children:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            children.clear()
+            return
+        if pid == 0:
+            return
+        children.discard(pid)
+
+
+def serve(socket_path=SOCKET_PATH, idle_timeout=IDLE_TIMEOUT):
+    """Preload, then fork a job per request until idle_timeout passes with nothing running"""
+    global _spawned
+    lock = open(socket_path + '.lock', 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        log(f"A zygote is already serving {socket_path}")
+        return 0
+
+    start = time.time()
+    preload()
+    log(f"Preloaded {len(_preloaded)} module(s) in {time.time() - start:.1f}s")
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # created 0600: no window in which other users can connect
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen(64)
+    server.settimeout(1.0)
+    log(f"Zygote listening on {socket_path} (idle timeout: {idle_timeout:.0f}s)")
+
+    children = set()
+    last_activity = time.time()
+    try:
+        while True:
+            _reap(children)
+            if idle_timeout > 0 and not children and time.time() - last_activity > idle_timeout:
+                log(f"Idle for {idle_timeout:.0f}s, shutting down")
+                break
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            last_activity = time.time()
+            conn.settimeout(CONNECT_TIMEOUT)
+            try:
+                request, fds = _recv_request(conn)
+            except (OSError, ValueError) as e:
+                log(f"Bad request: {e}")
+                conn.close()
+                continue
+            conn.settimeout(None)
+            action = request.get('action', 'run')
+            if action in ('status', 'stop'):
+                _send(conn, {'pid': os.getpid(), 'python': sys.executable, 'preloaded': _preloaded,
+                             'spawned': _spawned, 'running': len(children)})
+                conn.close()
+                if action == 'stop':
+                    break
+                continue
+            if request.get('python') != sys.executable or len(fds) != 3:
+                _send(conn, {'error': f"zygote runs {sys.executable}"})
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+                continue
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                code = 1
+                try:
+                    _monitor(conn, request, fds)
+                    code = 0
+                finally:
+                    os._exit(code)
+            _spawned += 1
+            children.add(pid)
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+    finally:
+        server.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+        lock.close()
+    return 0
+
+
+# ── Client ──
+
+def _connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def request(action, socket_path=SOCKET_PATH):
+    """status/stop: the zygote's reply, or None if none is listening"""
+    try:
+        sock = _connect(socket_path)
+    except OSError:
+        return None
+    with sock:
+        socket.send_fds(sock, [(json.dumps({'action': action}) + '\n').encode('utf-8')], [])
+        line = sock.makefile('r', encoding='utf-8').readline()
+    return json.loads(line) if line else None
+
+
+def run(argv, socket_path=SOCKET_PATH):
+    """Exit status of `python argv...` forked from the zygote, or None if it can't take the job"""
+    if not ENABLED:
+        return None
+    try:
+        sock = _connect(socket_path)
+    except OSError:
+        return None
+    with sock:
+        reader = sock.makefile('r', encoding='utf-8')
+        try:
+            payload = {'action': 'run', 'argv': list(argv), 'env': dict(os.environ), 'cwd': os.getcwd(),
+                       'python': sys.executable, 'affinity': sorted(os.sched_getaffinity(0))}
+            socket.send_fds(sock, [(json.dumps(payload) + '\n').encode('utf-8')], [0, 1, 2])
+            started = json.loads(reader.readline() or '{}')
+        except (OSError, ValueError):
+            return None
+        if 'pid' not in started:
+            return None
+
+        def forward(signum, _frame):
+            try:
+                os.kill(started['pid'], signum)
+            except OSError:
+                pass
+        for signum in FORWARDED_SIGNALS:
+            signal.signal(signum, forward)
+
+        sock.settimeout(None)
+        while True:
+            try:
+                line = reader.readline()
+                break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    return 1
+        finished = json.loads(line) if line else {}
+    code = finished.get('exit', 1)
+    return 128 - code if code < 0 else code
+
+
+def start_background(socket_path=SOCKET_PATH):
+    """Start a detached zygote (it exits by itself when idle)"""
+    import subprocess
+    with open(LOG_PATH, 'ab') as log_file:
+        subprocess.Popen([sys.executable, ZYGOTE_SCRIPT, 'serve', '--socket', socket_path],
+                         stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                         start_new_session=True)
+
+
+def command(argv):
+    """argv to spawn `python argv...` through the zygote client (plain python when disabled)"""
+    if not ENABLED:
+        return [sys.executable, *argv]
+    return [sys.executable, ZYGOTE_SCRIPT, 'run', *argv]
+
+
+def main(argv):
+    if not argv or argv[0] not in ('serve', 'run', 'status', 'stop'):
+        print(f"Usage: {sys.argv[0]} serve [--socket PATH] [--idle-timeout S]", file=sys.stderr)
+        print(f"       {sys.argv[0]} run SCRIPT [ARGS...]", file=sys.stderr)
+        print(f"       {sys.argv[0]} status | stop", file=sys.stderr)
+        return 1
+
+    if argv[0] == 'run':
+        if len(argv) < 2:
+            print(f"Usage: {sys.argv[0]} run SCRIPT [ARGS...]", file=sys.stderr)
+            return 1
+        code = run(argv[1:])
+        if code is not None:
+            return code
+        if ENABLED and AUTOSTART:
+            try:
+                start_background()
+            except OSError:
+                pass
+        os.execv(sys.executable, [sys.executable, *argv[1:]])
+
+    if argv[0] in ('status', 'stop'):
+        reply = request(argv[0])
+        print(json.dumps(reply if reply is not None else {'running': False}))
+        return 0
+
+    opts = {'socket': SOCKET_PATH, 'idle_timeout': IDLE_TIMEOUT}
+    i = 1
+    while i < len(argv):
+        if argv[i] == '--socket' and i + 1 < len(argv):
+            opts['socket'] = argv[i + 1]; i += 2
+        elif argv[i] == '--idle-timeout' and i + 1 < len(argv):
+            opts['idle_timeout'] = float(argv[i + 1]); i += 2
+        else:
+            i += 1
+    return serve(opts['socket'], opts['idle_timeout'])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))